@@ -0,0 +1,68 @@
+"""Gunicorn configuration of the production profile.
+
+Run with ``gunicorn -c gunicorn.conf.py``.
+
+Sizing
+------
+Workers (WEB_CONCURRENCY) default to 2 * CPU cores + 1. Each worker
+is a separate process with its own copy of the journey planner's
+connections, so memory grows linearly with workers.
+
+The default ``gthread`` worker serves WSGI with GUNICORN_THREADS threads
+per worker. Every thread keeps one persistent database connection (see
+``DB_CONN_MAX_AGE`` in settings_production.py), so one instance opens up
+to ``workers * threads`` connections. For instance, 4 cores give 9
+workers * 4 threads = 36 connections. Keep the sum over all instances,
+plus migrations and admin sessions, below PostgreSQL's
+``max_connections`` (100 by default), or lower the threads first: most
+request time is spent in Python, not waiting on the database.
+
+Set GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker to serve ASGI
+instead, e.g. for many slow clients of the async views. Each worker then
+handles requests concurrently on an event loop, but Django 5.0 cannot
+keep connections across ASGI requests, so they are closed after every
+request; pool them with PgBouncer.
+
+Metrics
+-------
+Workers share the port, so a /metrics scrape lands on any of them. They
+write their metrics to METRICS_DIR (a per-instance temporary directory by
+default), which is cleared when the server starts, and every scrape sums
+the files of all workers.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+ASGI_WORKER_CLASS = "uvicorn.workers.UvicornWorker"
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(
+    os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1)
+)
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+if worker_class == ASGI_WORKER_CLASS:
+    wsgi_app = "train_station_service.asgi:application"
+    os.environ["DB_CONN_MAX_AGE"] = "0"
+else:
+    wsgi_app = "train_station_service.wsgi:application"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound memory growth.
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = "-"
+
+# Read by the workers, which inherit the environment of the master.
+os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "train_station_metrics")
+)
+
+
+def on_starting(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
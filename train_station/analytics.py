@@ -0,0 +1,216 @@
+"""Daily sales and occupancy rollups per route and per train.
+
+Every refresh adds the tickets of the orders created since the last one,
+in batches of ``ANALYTICS_BATCH_SIZE`` orders grouped in a single query
+per rollup, to the stats of the day their trips depart. It then recounts
+the trips and seats of every day from the earliest one it touched, or
+today, on, so that trips scheduled since the last refresh are counted and
+days without sales get a row too. Reports then read one row per route or
+train and day instead of aggregating tickets on the primary database.
+
+Orders younger than ``ANALYTICS_GRACE_SECONDS`` are left for the next
+refresh: their transactions may still be running, and an order committed
+after the watermark passed its id would never be counted. Cancelled
+tickets are not subtracted, a rebuild recomputes the rollups from
+scratch."""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from train_station.models import (
+    AnalyticsWatermark,
+    Order,
+    RouteDailyStats,
+    Ticket,
+    TrainDailyStats,
+    Trip,
+)
+
+WATERMARK = "daily_stats"
+
+SALES_FIELDS = ("tickets_sold", "orders", "passenger_km")
+CAPACITY_FIELDS = ("trips", "seats")
+
+# Rollup models and the trip field they are grouped by.
+ROLLUPS = (
+    (RouteDailyStats, "route"),
+    (TrainDailyStats, "train"),
+)
+
+
+def _ticket_totals(first_order_id, last_order_id, field) -> dict:
+    """Sales of the orders in an id range by (route or train, day)."""
+    rows = (
+        Ticket.objects.filter(
+            order_id__gt=first_order_id, order_id__lte=last_order_id
+        )
+        .values(
+            key=F(f"trip__{field}_id"),
+            day=TruncDate("trip__departure_time"),
+        )
+        .annotate(
+            tickets_sold=Count("id"),
+            orders=Count("order_id", distinct=True),
+            passenger_km=Sum("trip__route__distance_km"),
+        )
+        .order_by()
+    )
+    return {(row.pop("key"), row.pop("day")): row for row in rows}
+
+
+def _add_to_rollup(model, field, totals):
+    existing = model.objects.filter(
+        **{f"{field}_id__in": {key for key, _ in totals}},
+        day__in={day for _, day in totals},
+    ).values(f"{field}_id", "day", *SALES_FIELDS)
+    existing = {
+        (stats.pop(f"{field}_id"), stats.pop("day")): stats
+        for stats in existing
+    }
+    rows = []
+    for (key, day), row in totals.items():
+        stats = existing.get((key, day), {})
+        rows.append(
+            model(
+                **{f"{field}_id": key},
+                day=day,
+                tickets_sold=stats.get("tickets_sold", 0)
+                + row["tickets_sold"],
+                orders=stats.get("orders", 0) + row["orders"],
+                passenger_km=stats.get("passenger_km", 0)
+                + (row["passenger_km"] or 0),
+            )
+        )
+
+    # One upsert instead of bulk_update, whose CASE expressions are slow
+    # to build for thousands of rows.
+    model.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=[field, "day"],
+        update_fields=SALES_FIELDS,
+    )
+
+
+def _recount_capacity(first_day):
+    """Recount the trips and seats of every route and train and day from
+    ``first_day`` on, adding rows for days without sales."""
+    for model, field in ROLLUPS:
+        capacity = (
+            Trip.objects.filter(
+                departure_time__gte=datetime.combine(first_day, time.min)
+            )
+            .values(key=F(f"{field}_id"), day=TruncDate("departure_time"))
+            .annotate(
+                trips=Count("id"),
+                seats=Sum(
+                    F("train__cargo_num") * F("train__places_in_cargo")
+                ),
+            )
+            .order_by()
+        )
+        with transaction.atomic():
+            # Days whose trips were all deleted keep no capacity.
+            model.objects.filter(day__gte=first_day).exclude(
+                trips=0
+            ).update(trips=0, seats=0)
+            model.objects.bulk_create(
+                [
+                    model(
+                        **{f"{field}_id": row["key"]},
+                        day=row["day"],
+                        trips=row["trips"],
+                        seats=row["seats"],
+                    )
+                    for row in capacity
+                ],
+                update_conflicts=True,
+                unique_fields=[field, "day"],
+                update_fields=CAPACITY_FIELDS,
+            )
+
+
+def _refresh_batch(cutoff, batch_size):
+    """Add the next batch of orders and return their number and the first
+    departure day of their tickets."""
+    first_day = None
+    with transaction.atomic():
+        # Locking the watermark serializes concurrent refreshes.
+        watermark, _ = (
+            AnalyticsWatermark.objects.select_for_update().get_or_create(
+                name=WATERMARK
+            )
+        )
+        orders = Order.objects.filter(id__gt=watermark.last_order_id)
+        # Stop before the first young order, even if older orders with a
+        # higher id follow it.
+        first_young_id = orders.filter(created_at__gt=cutoff).aggregate(
+            first_id=Min("id")
+        )["first_id"]
+        if first_young_id is not None:
+            orders = orders.filter(id__lt=first_young_id)
+        order_ids = list(
+            orders.order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+
+        if order_ids:
+            for model, field in ROLLUPS:
+                totals = _ticket_totals(
+                    watermark.last_order_id, order_ids[-1], field
+                )
+                if totals:
+                    _add_to_rollup(model, field, totals)
+                    first_day = min(day for _, day in totals)
+            watermark.last_order_id = order_ids[-1]
+        watermark.refreshed_at = timezone.now()
+        watermark.save()
+    return len(order_ids), first_day
+
+
+def refresh_rollups(batch_size=None, first_day=None) -> int:
+    """Add the orders created since the last refresh, except those younger
+    than ``ANALYTICS_GRACE_SECONDS``, recount trips and seats from
+    ``first_day`` (today by default) or the earliest day of these orders,
+    and return the number of orders."""
+    batch_size = batch_size or settings.ANALYTICS_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.ANALYTICS_GRACE_SECONDS
+    )
+    first_day = first_day or timezone.now().date()
+    processed = 0
+    while True:
+        batch, batch_first_day = _refresh_batch(cutoff, batch_size)
+        if not batch:
+            break
+        processed += batch
+        if batch_first_day is not None:
+            first_day = min(first_day, batch_first_day)
+    _recount_capacity(first_day)
+    return processed
+
+
+def rebuild_rollups(batch_size=None) -> int:
+    """Recompute the rollups from all orders and trips, e.g. after
+    cancellations. Reports see partial stats until it is done."""
+    with transaction.atomic():
+        for model, _ in ROLLUPS:
+            model.objects.all().delete()
+        AnalyticsWatermark.objects.filter(name=WATERMARK).delete()
+    first_departure = Trip.objects.aggregate(
+        first=Min("departure_time")
+    )["first"]
+    return refresh_rollups(
+        batch_size, first_departure.date() if first_departure else None
+    )
+
+
+def rollup_status() -> dict:
+    watermark = AnalyticsWatermark.objects.filter(name=WATERMARK).first()
+    return {
+        "last_order": watermark.last_order_id if watermark else None,
+        "refreshed_at": watermark.refreshed_at if watermark else None,
+    }
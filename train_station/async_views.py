@@ -0,0 +1,333 @@
+"""Async versions of the hottest read endpoints.
+
+Trip list, trip availability and journey search are served with the
+async ORM, and seat changes are pushed as server-sent events, so one ASGI
+worker can multiplex many slow client connections instead of holding a
+thread for each. DRF views are sync only, so these
+are plain Django views that authenticate with the same JWT backend and
+apply the same user throttling as the REST API."""
+import asyncio
+import base64
+import math
+from datetime import datetime
+from functools import wraps
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from train_station.holds import attach_held_seats
+from train_station.journeys import asearch_journeys
+from train_station.models import Trip
+from train_station.seat_events import LAGGED, seat_broker
+from train_station.serializer import (
+    JourneySearchSerializer,
+    JourneySerializer,
+    TripAvailabilitySearchSerializer,
+    TripAvailabilitySerializer,
+    TripListSerializer,
+)
+from train_station.views import TripPagination
+from train_station_service.middleware import serializer_timer
+
+
+def _response(data, status_code=status.HTTP_200_OK, **kwargs):
+    with serializer_timer():
+        return JsonResponse(
+            data,
+            status=status_code,
+            encoder=JSONEncoder,
+            safe=False,
+            **kwargs,
+        )
+
+
+def _error(detail, status_code):
+    return _response({"detail": detail}, status_code)
+
+
+async def _authenticate(request):
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+    except (InvalidToken, TokenError):
+        return None
+    return await (
+        get_user_model()
+        .objects.filter(
+            **{
+                jwt_settings.USER_ID_FIELD: token.get(
+                    jwt_settings.USER_ID_CLAIM
+                )
+            },
+            is_active=True,
+        )
+        .afirst()
+    )
+
+
+def async_api_view(view):
+    """Authenticate and throttle requests to an async view."""
+
+    @require_GET
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await _authenticate(request)
+        if user is None:
+            return _error(
+                "Authentication credentials were not provided or are "
+                "not valid.",
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        request.user = user
+
+        throttle = UserRateThrottle()
+        if not await sync_to_async(throttle.allow_request)(request, None):
+            wait = math.ceil(throttle.wait() or 0)
+            return _response(
+                {
+                    "detail": "Request was throttled. Expected available "
+                    f"in {wait} seconds."
+                },
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(wait)},
+            )
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _encode_cursor(trip) -> str:
+    position = f"{trip.departure_time.isoformat()}|{trip.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    departure_time, trip_id = (
+        base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    )
+    return datetime.fromisoformat(departure_time), int(trip_id)
+
+
+@async_api_view
+async def trip_list(request):
+    """Trips ordered by departure, filtered by ``date`` and ``route``.
+
+    Pages are linked by a keyset cursor on (departure_time, id) that only
+    goes forward."""
+    queryset = Trip.objects.select_related(
+        "route__source", "route__destination", "train__train_type"
+    ).defer("occupancy")
+    try:
+        if date := request.GET.get("date"):
+            queryset = queryset.departing_on(
+                datetime.strptime(date, "%Y-%m-%d").date()
+            )
+        if route_id := request.GET.get("route"):
+            queryset = queryset.on_route(int(route_id))
+        if cursor := request.GET.get("cursor"):
+            departure_time, trip_id = _decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(departure_time__gt=departure_time)
+                | Q(departure_time=departure_time, id__gt=trip_id)
+            )
+        page_size = min(
+            max(
+                int(
+                    request.GET.get(
+                        TripPagination.page_size_query_param,
+                        TripPagination.page_size,
+                    )
+                ),
+                1,
+            ),
+            TripPagination.max_page_size,
+        )
+    except ValueError:
+        return _error(
+            "Invalid date, route, cursor or page size.",
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    trips = [
+        trip
+        async for trip in queryset.order_by(
+            *TripPagination.ordering
+        )[: page_size + 1]
+    ]
+    next_url = None
+    if len(trips) > page_size:
+        trips = trips[:page_size]
+        params = request.GET.copy()
+        params["cursor"] = _encode_cursor(trips[-1])
+        next_url = request.build_absolute_uri(
+            f"{request.path}?{params.urlencode()}"
+        )
+
+    await sync_to_async(attach_held_seats)(trips)
+    return _response(
+        {
+            "next": next_url,
+            "previous": None,
+            "results": TripListSerializer(trips, many=True).data,
+        }
+    )
+
+
+async def _trip_availability(pk):
+    trip = await Trip.objects.for_availability().filter(pk=pk).afirst()
+    if trip is None:
+        return None
+
+    await sync_to_async(attach_held_seats)([trip])
+    return TripAvailabilitySerializer(trip).data
+
+
+@async_api_view
+async def trip_availability(request, pk):
+    """Free seat count and taken and held seats of a trip."""
+    availability = await _trip_availability(pk)
+    if availability is None:
+        return _error("Not found.", status.HTTP_404_NOT_FOUND)
+    return _response(availability)
+
+
+def _server_sent_event(event, data) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), orjson.dumps(data))
+
+
+async def _seat_events(pk):
+    broker = seat_broker()
+    # Subscribe before loading the snapshot, so that no change is missed.
+    # Changes already in the snapshot may be sent again.
+    subscription = broker.subscribe(pk)
+    try:
+        event = LAGGED
+        while True:
+            if event is LAGGED:
+                snapshot = await _trip_availability(pk)
+                if snapshot is None:
+                    return
+                yield _server_sent_event("snapshot", snapshot)
+            elif event is not None:
+                yield _server_sent_event("seats", event)
+            else:
+                yield b": keep-alive\n\n"
+            try:
+                event = await asyncio.wait_for(
+                    subscription.get(),
+                    settings.SEAT_EVENTS_KEEPALIVE_SECONDS,
+                )
+            except asyncio.TimeoutError:
+                event = None
+    finally:
+        # Also runs when Django cancels the stream of a disconnected client.
+        broker.unsubscribe(subscription)
+
+
+@async_api_view
+async def trip_seat_events(request, pk):
+    """Server-sent events of the seats of a trip: a ``snapshot`` like
+    ``trip_availability`` on connect, then a ``seats`` event with the seats
+    taken and released by every committed booking or cancellation, and a
+    new ``snapshot`` if the client fell behind.
+
+    Streams are held open, so they are only served over ASGI."""
+    if not isinstance(request, ASGIRequest):
+        return _error(
+            "Seat events are only served over ASGI.",
+            status.HTTP_501_NOT_IMPLEMENTED,
+        )
+    if not await Trip.objects.filter(pk=pk).aexists():
+        return _error("Not found.", status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(
+        _seat_events(pk), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _free_by_cargo(trip) -> list:
+    taken = trip.seat_map.taken_by_cargo()
+    for cargo, seat in trip.held_seats:
+        if not trip.seat_map.is_taken(cargo, seat):
+            taken[cargo - 1] += 1
+    return [
+        {"cargo": cargo, "free": trip.train.places_in_cargo - count}
+        for cargo, count in enumerate(taken, start=1)
+    ]
+
+
+@async_api_view
+async def trips_availability(request):
+    """Free seat counts of the trips of ``ids``, comma separated, and with
+    ``cargo`` their free seats by cargo.
+
+    One query and one hold lookup for all trips. Unknown ids are left out
+    of the response, the others keep the order of ``ids``."""
+    search = TripAvailabilitySearchSerializer(data=request.GET)
+    if not search.is_valid():
+        return _response(search.errors, status.HTTP_400_BAD_REQUEST)
+    ids = search.validated_data["ids"]
+    by_cargo = search.validated_data["cargo"]
+
+    fields = [
+        "id",
+        "tickets_sold",
+        "train__cargo_num",
+        "train__places_in_cargo",
+    ]
+    if by_cargo:
+        fields.append("occupancy")
+    trips = {
+        trip.id: trip
+        async for trip in Trip.objects.select_related("train")
+        .only(*fields)
+        .filter(id__in=ids)
+    }
+    await sync_to_async(attach_held_seats)(trips.values())
+
+    results = []
+    for trip_id in ids:
+        trip = trips.get(trip_id)
+        if trip is None:
+            continue
+        result = {"id": trip.id, "tickets_available": trip.tickets_available}
+        if by_cargo:
+            result["free_by_cargo"] = _free_by_cargo(trip)
+        results.append(result)
+    return _response(results)
+
+
+@async_api_view
+async def journey_list(request):
+    """Search journeys between two stations, including changes."""
+    search = JourneySearchSerializer(data=request.GET)
+    if not search.is_valid():
+        return _response(search.errors, status.HTTP_400_BAD_REQUEST)
+
+    journeys = await asearch_journeys(
+        search.validated_data["source"],
+        search.validated_data["destination"],
+        search.validated_data.get("departure"),
+        search.validated_data["limit"],
+    )
+    return _response(JourneySerializer(journeys, many=True).data)
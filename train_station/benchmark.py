@@ -0,0 +1,41 @@
+import math
+import time
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_samples)) - 1, 0)
+    return sorted_samples[rank]
+
+
+def summarize(samples) -> dict:
+    """Latency summary in milliseconds of samples given in seconds."""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": 1000 * sum(samples) / len(samples) if samples else 0.0,
+        "p50": 1000 * percentile(samples, 0.50),
+        "p95": 1000 * percentile(samples, 0.95),
+        "p99": 1000 * percentile(samples, 0.99),
+        "max": 1000 * samples[-1] if samples else 0.0,
+    }
+
+
+def format_summary(name, summary) -> str:
+    return (
+        f"{name:<32} n={summary['count']:<6} "
+        f"mean={summary['mean']:8.2f}ms p50={summary['p50']:8.2f}ms "
+        f"p95={summary['p95']:8.2f}ms p99={summary['p99']:8.2f}ms"
+    )
+
+
+def measure(func, repeat) -> list:
+    """Call ``func`` ``repeat`` times and return durations in seconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
@@ -0,0 +1,239 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from train_station.holds import hold_store
+from train_station.models import Order, Ticket, Trip
+from train_station.seating import assign_seats
+
+# SQLSTATE codes of PostgreSQL serialization failures and deadlocks.
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+
+class SeatConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Some of the requested seats are already taken."
+    default_code = "seat_conflict"
+
+    def __init__(self, seats):
+        super().__init__()
+        # Set after init, which would turn the seat numbers into strings.
+        self.detail = {
+            "detail": self.detail,
+            "seats": [
+                {"trip": trip_id, "cargo": cargo, "seat": seat}
+                for trip_id, cargo, seat in sorted(seats)
+            ],
+        }
+
+
+class NotEnoughSeats(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The trip has no free seats matching the request."
+    default_code = "not_enough_seats"
+
+
+class BookingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Booking is busy, please try again."
+    default_code = "booking_busy"
+
+
+def is_serialization_failure(error) -> bool:
+    """Whether ``error`` is a transient lock conflict, so that the whole
+    transaction can safely be retried."""
+    cause = error.__cause__
+    sqlstate = getattr(cause, "sqlstate", None) or getattr(
+        cause, "pgcode", None
+    )
+    if sqlstate is not None:
+        return sqlstate in RETRYABLE_SQLSTATES
+    # SQLite reports write conflicts as locked databases or tables.
+    return "locked" in str(error)
+
+
+def validate_seats(tickets_data):
+    """Validate requested seats in memory and return their (trip, cargo, seat)
+    keys. Trips in ``tickets_data`` must come with their train loaded."""
+    seats = []
+    seen = set()
+    for ticket_data in tickets_data:
+        trip = ticket_data["trip"]
+        Ticket.validate_ticket(
+            ticket_data["cargo"],
+            ticket_data["seat"],
+            trip.train,
+            ValidationError,
+        )
+        seat_key = (trip.id, ticket_data["cargo"], ticket_data["seat"])
+        if seat_key in seen:
+            raise ValidationError(
+                {
+                    "tickets": f"Seat (cargo: {seat_key[1]}, "
+                    f"seat: {seat_key[2]}) on trip {seat_key[0]} "
+                    f"is requested more than once"
+                }
+            )
+        seen.add(seat_key)
+        seats.append(seat_key)
+    return seats
+
+
+def create_order(tickets_data, **order_data):
+    """Create an order with all its tickets in a constant number of queries,
+    no matter how many seats are booked."""
+    return book_seats(validate_seats(tickets_data), **order_data)
+
+
+def _with_retries(book, *args):
+    """Run ``book``, retrying transactions aborted by serialization
+    failures up to ``BOOKING_MAX_ATTEMPTS`` times with a jittered backoff,
+    unless running inside an outer transaction."""
+    can_retry = not transaction.get_connection().in_atomic_block
+
+    for attempt in range(1, settings.BOOKING_MAX_ATTEMPTS + 1):
+        try:
+            return book(*args)
+        except OperationalError as error:
+            if not is_serialization_failure(error):
+                raise
+            if not can_retry or attempt == settings.BOOKING_MAX_ATTEMPTS:
+                raise BookingBusy() from error
+            time.sleep(
+                random.uniform(0, settings.BOOKING_RETRY_BACKOFF * attempt)
+            )
+
+
+def book_seats(seats, hold_id=None, **order_data):
+    """Create an order of validated (trip, cargo, seat) keys.
+
+    Booked trips are locked for the duration of the transaction, so
+    concurrent bookings of a trip are serialized. Seats sold meanwhile or
+    held by a hold other than ``hold_id`` raise ``SeatConflict``."""
+    return _with_retries(_book_seats, seats, order_data, hold_id)
+
+
+def _book_seats(seats, order_data, hold_id=None):
+    with transaction.atomic():
+        trips = Trip.lock_for_booking({trip_id for trip_id, _, _ in seats})
+        missing_trips = {
+            trip_id for trip_id, _, _ in seats if trip_id not in trips
+        }
+        if missing_trips:
+            raise ValidationError(
+                {"tickets": f"Trips {sorted(missing_trips)} do not exist"}
+            )
+
+        taken_seats = [
+            (trip_id, cargo, seat)
+            for trip_id, cargo, seat in seats
+            if trips[trip_id].seat_map.is_taken(cargo, seat)
+        ]
+        taken_seats += hold_store().held_by_others(seats, hold_id)
+        if taken_seats:
+            raise SeatConflict(set(taken_seats))
+
+        return _create_order(seats, trips, order_data)
+
+
+def auto_book(trip_id, party_size, preference, **order_data):
+    """Create an order of ``party_size`` seats of a trip, picked by
+    ``preference`` (see ``train_station.seating``).
+
+    Seats are picked from the seat map of the locked trip and skip held
+    seats, so the booking cannot conflict with concurrent ones."""
+    return _with_retries(
+        _auto_book, trip_id, party_size, preference, order_data
+    )
+
+
+def _auto_book(trip_id, party_size, preference, order_data):
+    with transaction.atomic():
+        trips = Trip.lock_for_booking([trip_id])
+        if trip_id not in trips:
+            raise ValidationError({"trip": f"Trip {trip_id} does not exist"})
+
+        held_seats = hold_store().held_seats([trip_id]).get(trip_id, ())
+        seats = assign_seats(
+            trips[trip_id].seat_map, party_size, preference, held_seats
+        )
+        if seats is None:
+            raise NotEnoughSeats()
+
+        return _create_order(
+            [(trip_id, cargo, seat) for cargo, seat in seats],
+            trips,
+            order_data,
+        )
+
+
+def _create_order(seats, trips, order_data):
+    order = Order.objects.create(**order_data)
+    try:
+        # The savepoint keeps the transaction usable on PostgreSQL to
+        # look up the conflicting seats.
+        with transaction.atomic():
+            Ticket.objects.bulk_create(
+                Ticket(order=order, trip_id=trip_id, cargo=cargo, seat=seat)
+                for trip_id, cargo, seat in seats
+            )
+    except IntegrityError:
+        # A ticket written without updating the seat map, e.g. by a
+        # raw import, still holds one of the seats.
+        raise SeatConflict(_sold_seats(seats))
+    Trip.update_seat_maps(taken=seats, trips=trips)
+    return order
+
+
+def _sold_seats(seats) -> list:
+    sold = set(
+        Ticket.objects.filter(
+            trip_id__in={trip_id for trip_id, _, _ in seats}
+        ).values_list("trip_id", "cargo", "seat")
+    )
+    return [seat_key for seat_key in seats if seat_key in sold]
+
+
+def place_hold(tickets_data, user_id):
+    """Hold the requested seats for ``SEAT_HOLD_TTL_SECONDS``.
+
+    Trips in ``tickets_data`` must come with their train and occupancy
+    loaded, sold seats are checked against their seat maps."""
+    seats = validate_seats(tickets_data)
+    if len(seats) > settings.SEAT_HOLD_MAX_SEATS:
+        raise ValidationError(
+            {
+                "tickets": f"At most {settings.SEAT_HOLD_MAX_SEATS} seats "
+                f"can be held at once"
+            }
+        )
+
+    trips = {
+        ticket_data["trip"].id: ticket_data["trip"]
+        for ticket_data in tickets_data
+    }
+    sold_seats = [
+        (trip_id, cargo, seat)
+        for trip_id, cargo, seat in seats
+        if trips[trip_id].seat_map.is_taken(cargo, seat)
+    ]
+    if sold_seats:
+        raise SeatConflict(sold_seats)
+
+    hold, held_seats = hold_store().reserve(
+        user_id, seats, settings.SEAT_HOLD_TTL_SECONDS
+    )
+    if held_seats:
+        raise SeatConflict(held_seats)
+    return hold
+
+
+def checkout_hold(hold, **order_data):
+    """Convert ``hold`` into an order and release it once committed."""
+    order = book_seats(list(hold.seats), hold_id=hold.id, **order_data)
+    transaction.on_commit(lambda: hold_store().release(hold))
+    return order
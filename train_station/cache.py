@@ -0,0 +1,98 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _version_key(model) -> str:
+    return f"catalog:version:{model._meta.label_lower}"
+
+
+def get_versions(models) -> list:
+    """Return the current data version of every model.
+
+    A version is the timestamp in whole seconds of the last change, so it
+    also serves as the Last-Modified date of responses built from the
+    model."""
+    cache = catalog_cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time()), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """Move the version of ``model`` to the current second, or past the
+    current version if it is not older, so that every change gets a later
+    Last-Modified date than the responses served before it."""
+    cache = catalog_cache()
+    key = _version_key(model)
+    now = int(time.time())
+    cache.add(key, now, timeout=None)
+    if cache.incr(key) < now:
+        cache.set(key, now, timeout=None)
+
+
+def invalidate_model(model):
+    """Start a new data version of ``model``.
+
+    The version is bumped right away and once more after commit, so that a
+    response cached by a concurrent request between the write and the
+    commit does not survive."""
+    bump_version(model)
+    transaction.on_commit(lambda: bump_version(model))
+
+
+class CachedListMixin:
+    """Serve list responses from the catalog cache, with ETag and
+    Last-Modified headers and conditional GET support.
+
+    Cached lists are keyed by the request URL and the data versions of
+    ``cache_models`` (the viewset model by default), which are bumped by
+    save/delete signals."""
+
+    cache_models = ()
+
+    def get_cache_models(self):
+        return self.cache_models or (self.queryset.model,)
+
+    def list(self, request, *args, **kwargs):
+        versions = get_versions(self.get_cache_models())
+        last_modified = max(versions)
+        fingerprint = f"{request.build_absolute_uri()}|{versions}"
+        etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+
+        conditional_response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if conditional_response is not None:
+            conditional_response["ETag"] = etag
+            return conditional_response
+
+        cache_key = f"catalog:list:{etag}"
+        cache = catalog_cache()
+        data = cache.get(cache_key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(cache_key, response.data)
+        else:
+            response = Response(data)
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        response["Cache-Control"] = "private, no-cache"
+        return response
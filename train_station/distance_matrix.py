@@ -0,0 +1,138 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from numpy.lib.format import open_memmap
+
+from train_station.geo import EARTH_RADIUS_KM
+from train_station.models import Station
+
+
+def haversine_matrix(latitudes, longitudes, out=None, chunk_size=1024):
+    """Compute great-circle distances in kilometers between every pair
+    of points, using the same formula as ``geo.haversine``.
+
+    Rows are computed ``chunk_size`` at a time to bound the memory used
+    by temporary arrays; ``out`` may be a memory-mapped array."""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    size = len(lat)
+    if out is None:
+        out = np.empty((size, size), dtype=np.float32)
+    cos_lat = np.cos(lat)
+
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        different_lat = lat[np.newaxis, :] - lat[start:stop, np.newaxis]
+        different_long = lon[np.newaxis, :] - lon[start:stop, np.newaxis]
+
+        temp = (
+            np.sin(different_lat / 2) ** 2
+            + cos_lat[start:stop, np.newaxis] * cos_lat[np.newaxis, :]
+            * np.sin(different_long / 2) ** 2
+        )
+        np.clip(temp, 0, 1, out=temp)
+
+        out[start:stop] = (
+            2 * EARTH_RADIUS_KM
+            * np.arctan2(np.sqrt(temp), np.sqrt(1 - temp))
+        )
+    return out
+
+
+MATRIX_FILE = "distances.npy"
+IDS_FILE = "station_ids.npy"
+
+# Versions kept besides the current one, for readers still opening it.
+KEEP_VERSIONS = 1
+
+
+def _versions(path) -> list:
+    """Version directories of the matrix at ``path``, oldest first."""
+    versions = []
+    for version in path.parent.glob(f".{path.name}.*"):
+        suffix = version.name.rsplit(".", 1)[1]
+        if version.is_dir() and suffix.isdigit():
+            versions.append((int(suffix), version))
+    return [version for _, version in sorted(versions)]
+
+
+class StationDistanceMatrix:
+    """Read-only view of a stored all-pairs station distance matrix.
+
+    The matrix is memory-mapped, so worker processes opening the same file
+    share its pages instead of each loading a copy."""
+
+    def __init__(self, station_ids, distances):
+        self.station_ids = station_ids
+        self.distances = distances
+        self._index = {
+            station_id: index
+            for index, station_id in enumerate(station_ids.tolist())
+        }
+
+    @classmethod
+    def load(cls, path=None):
+        # Resolve the link once, so both files come from one version.
+        version = Path(
+            os.path.realpath(path or settings.STATION_DISTANCE_MATRIX_PATH)
+        )
+        return cls(
+            np.load(version / IDS_FILE),
+            np.load(version / MATRIX_FILE, mmap_mode="r"),
+        )
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def distance(self, source_id, destination_id) -> float:
+        row = self._index[source_id]
+        column = self._index[destination_id]
+        return float(self.distances[row, column])
+
+
+def build_station_distance_matrix(path=None, chunk_size=1024):
+    """Compute distances between all stations and store them as ``.npy``
+    files: the matrix itself and the station ids of its rows/columns.
+
+    Both files are written to a new version directory, and ``path`` is a
+    symbolic link to it replaced with one rename, so readers never see a
+    partially written matrix or ids of another version."""
+    path = Path(path or settings.STATION_DISTANCE_MATRIX_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    rows = np.array(
+        Station.objects.order_by("id").values_list(
+            "id", "latitude", "longitude"
+        ),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    station_ids = rows[:, 0].astype(np.int64)
+
+    version = path.with_name(f".{path.name}.{time.time_ns()}")
+    version.mkdir()
+    distances = open_memmap(
+        version / MATRIX_FILE,
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(station_ids), len(station_ids)),
+    )
+    haversine_matrix(
+        rows[:, 1], rows[:, 2], out=distances, chunk_size=chunk_size
+    )
+    distances.flush()
+    del distances
+    np.save(version / IDS_FILE, station_ids)
+
+    tmp_link = path.with_name(f".{path.name}.link")
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(version.name)
+    os.replace(tmp_link, path)
+
+    for old_version in _versions(path)[:-1 - KEEP_VERSIONS]:
+        shutil.rmtree(old_version, ignore_errors=True)
+
+    return StationDistanceMatrix.load(path)
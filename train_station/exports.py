@@ -0,0 +1,221 @@
+"""Streaming exports of trips, orders and tickets for admins.
+
+Rows are read through ``.iterator()``, a server-side cursor on PostgreSQL,
+or in id ranges where server-side cursors are disabled, and written out in
+chunks of ``EXPORT_CHUNK_SIZE`` rows, so memory use does not depend on the
+number of exported rows."""
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.db.models import Count
+from django.http import StreamingHttpResponse
+
+from train_station.models import Order, Ticket, Trip
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class Export:
+    """Columns of an export as (header, lookup) pairs, and the lookups
+    filtered by the date range and route of an export request.
+
+    Subclasses must set ``queryset``, the exported rows ordered by id."""
+
+    name = None
+    queryset = None
+    fields = ()
+    date_field = None
+    route_field = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.queryset is None:
+            raise ImproperlyConfigured(f"{cls.__name__} must set queryset.")
+
+    def get_queryset(self):
+        # A fresh clone, so that no export reuses a cached result.
+        return self.queryset.all()
+
+    def filter(self, queryset, date_from=None, date_to=None, route=None):
+        if date_from is not None:
+            queryset = queryset.filter(
+                **{f"{self.date_field}__gte": datetime.combine(
+                    date_from, time.min
+                )}
+            )
+        if date_to is not None:
+            queryset = queryset.filter(
+                **{f"{self.date_field}__lt": datetime.combine(
+                    date_to + timedelta(days=1), time.min
+                )}
+            )
+        if route is not None:
+            queryset = queryset.filter(**{self.route_field: route})
+        return queryset
+
+    @property
+    def headers(self) -> list:
+        return [header for header, _ in self.fields]
+
+    def rows(self, **filters):
+        """Iterate over the value tuples of the filtered rows."""
+        queryset = self.filter(self.get_queryset(), **filters).values_list(
+            *(lookup for _, lookup in self.fields)
+        )
+        if connections[queryset.db].settings_dict.get(
+            "DISABLE_SERVER_SIDE_CURSORS"
+        ):
+            return self._keyset_rows(queryset)
+        return queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+    @staticmethod
+    def _keyset_rows(queryset):
+        # Without a server-side cursor the driver would load the whole
+        # result, so read it in id ranges. Exports are ordered by id, their
+        # first column.
+        last_id = 0
+        while rows := list(
+            queryset.filter(id__gt=last_id)[: settings.EXPORT_CHUNK_SIZE]
+        ):
+            yield from rows
+            last_id = rows[-1][0]
+
+
+class TripExport(Export):
+    name = "trips"
+    fields = (
+        ("id", "id"),
+        ("route", "route_id"),
+        ("source", "route__source__name"),
+        ("destination", "route__destination__name"),
+        ("train", "train__name"),
+        ("departure_time", "departure_time"),
+        ("arrival_time", "arrival_time"),
+        ("tickets_sold", "tickets_sold"),
+    )
+    date_field = "departure_time"
+    route_field = "route_id"
+    queryset = Trip.objects.order_by("id")
+
+
+class OrderExport(Export):
+    """Orders by creation date, with a route: orders of tickets on it."""
+
+    name = "orders"
+    fields = (
+        ("id", "id"),
+        ("created_at", "created_at"),
+        ("user", "user_id"),
+        ("user_email", "user__email"),
+        ("tickets", "tickets_count"),
+    )
+    date_field = "created_at"
+    queryset = Order.objects.annotate(
+        tickets_count=Count("tickets")
+    ).order_by("id")
+
+    def filter(self, queryset, route=None, **filters):
+        queryset = super().filter(queryset, **filters)
+        if route is not None:
+            # A subquery instead of a join keeps the ticket counts whole.
+            queryset = queryset.filter(
+                id__in=Ticket.objects.filter(trip__route_id=route).values(
+                    "order_id"
+                )
+            )
+        return queryset
+
+
+class TicketExport(Export):
+    name = "tickets"
+    fields = (
+        ("id", "id"),
+        ("order", "order_id"),
+        ("created_at", "order__created_at"),
+        ("user_email", "order__user__email"),
+        ("trip", "trip_id"),
+        ("route", "trip__route_id"),
+        ("departure_time", "trip__departure_time"),
+        ("cargo", "cargo"),
+        ("seat", "seat"),
+    )
+    date_field = "trip__departure_time"
+    route_field = "trip__route_id"
+    queryset = Ticket.objects.order_by("id")
+
+
+EXPORTS = {
+    export.name: export
+    for export in (TripExport(), OrderExport(), TicketExport())
+}
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while batch := list(islice(rows, settings.EXPORT_CHUNK_SIZE)):
+        yield batch
+
+
+def ndjson_chunks(headers, rows):
+    for batch in _batches(rows):
+        yield b"".join(
+            orjson.dumps(
+                dict(zip(headers, row)), option=orjson.OPT_APPEND_NEWLINE
+            )
+            for row in batch
+        )
+
+
+def _csv_value(value):
+    # Same datetime format as the NDJSON export.
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def csv_chunks(headers, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for batch in _batches(rows):
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _async_chunks(chunks):
+    # Each chunk is read in the request's sync thread, where the cursor
+    # lives, instead of Django buffering a sync iterator under ASGI.
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def export_response(request, export, export_format, **filters):
+    """Stream ``export`` as NDJSON or CSV as an attachment."""
+    rows = export.rows(**filters)
+    if export_format == "csv":
+        chunks = csv_chunks(export.headers, rows)
+    else:
+        chunks = ndjson_chunks(export.headers, rows)
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+
+    response = StreamingHttpResponse(
+        chunks, content_type=CONTENT_TYPES[export_format]
+    )
+    filename = f"{export.name}-{date.today().isoformat()}.{export_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
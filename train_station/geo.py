@@ -0,0 +1,21 @@
+import math
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine(lat1, lon1, lat2, lon2) -> float:
+    """Great-circle distance in kilometers between two points
+    given in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    different_long = lon2 - lon1
+    different_lat = lat2 - lat1
+
+    temp = (
+        math.sin(different_lat / 2)
+        ** 2 + math.cos(lat1) * math.cos(lat2)
+        * math.sin(different_long / 2) ** 2
+    )
+
+    distance = 2 * math.atan2(math.sqrt(temp), math.sqrt(1 - temp))
+
+    return EARTH_RADIUS_KM * distance
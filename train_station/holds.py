@@ -0,0 +1,269 @@
+"""Short-lived seat holds taken during checkout.
+
+A hold reserves (trip, cargo, seat) keys for one user until it expires or
+is converted into an order. Holds never touch the database: they live in
+a store picked by ``SEAT_HOLD_STORE``, an in-process one by default or a
+Django cache shared by all processes."""
+import heapq
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+SeatHold = namedtuple("SeatHold", ["id", "user_id", "seats", "expires_at"])
+
+
+def _new_hold(user_id, seats, ttl):
+    return SeatHold(
+        uuid.uuid4().hex, user_id, tuple(sorted(seats)), time.time() + ttl
+    )
+
+
+class LocalHoldStore:
+    """Holds kept in memory of the current process.
+
+    Only suitable when a single process serves bookings. Expired holds are
+    swept in bulk from an expiry heap before every operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._holds = {}
+        self._seats = {}
+        self._trip_holds = defaultdict(set)
+        self._expiry = []
+
+    def _sweep(self, now) -> int:
+        swept = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, hold_id = heapq.heappop(self._expiry)
+            hold = self._holds.get(hold_id)
+            if hold is not None:
+                self._remove(hold)
+                swept += 1
+        return swept
+
+    def _remove(self, hold):
+        del self._holds[hold.id]
+        for seat_key in hold.seats:
+            if self._seats.get(seat_key) == hold.id:
+                del self._seats[seat_key]
+            trip_holds = self._trip_holds.get(seat_key[0])
+            if trip_holds is not None:
+                trip_holds.discard(hold.id)
+                if not trip_holds:
+                    del self._trip_holds[seat_key[0]]
+
+    def sweep(self) -> int:
+        """Drop all expired holds and return how many were dropped."""
+        with self._lock:
+            return self._sweep(time.time())
+
+    def reserve(self, user_id, seats, ttl):
+        """Hold ``seats`` for ``ttl`` seconds.
+
+        Return ``(hold, [])`` or ``(None, conflicting seats)`` if any of
+        the seats is held by another hold."""
+        with self._lock:
+            self._sweep(time.time())
+            conflicts = [
+                seat_key for seat_key in seats if seat_key in self._seats
+            ]
+            if conflicts:
+                return None, conflicts
+
+            hold = _new_hold(user_id, seats, ttl)
+            self._holds[hold.id] = hold
+            for seat_key in hold.seats:
+                self._seats[seat_key] = hold.id
+                self._trip_holds[seat_key[0]].add(hold.id)
+            heapq.heappush(self._expiry, (hold.expires_at, hold.id))
+            return hold, []
+
+    def get(self, hold_id):
+        with self._lock:
+            self._sweep(time.time())
+            return self._holds.get(hold_id)
+
+    def release(self, hold):
+        with self._lock:
+            if self._holds.get(hold.id) == hold:
+                self._remove(hold)
+
+    def held_by_others(self, seats, hold_id=None) -> list:
+        """Return the seats held by holds other than ``hold_id``."""
+        with self._lock:
+            self._sweep(time.time())
+            return [
+                seat_key
+                for seat_key in seats
+                if self._seats.get(seat_key, hold_id) != hold_id
+            ]
+
+    def held_seats(self, trip_ids) -> dict:
+        """Return the held (cargo, seat) pairs of every trip with holds."""
+        with self._lock:
+            self._sweep(time.time())
+            held = {}
+            for trip_id in trip_ids:
+                for hold_id in self._trip_holds.get(trip_id, ()):
+                    held.setdefault(trip_id, set()).update(
+                        (cargo, seat)
+                        for seat_trip_id, cargo, seat in self._holds[
+                            hold_id
+                        ].seats
+                        if seat_trip_id == trip_id
+                    )
+            return held
+
+
+class CacheHoldStore:
+    """Holds shared by all processes through a Django cache, e.g. Redis.
+
+    Seats are claimed with atomic ``cache.add`` calls on one key per seat,
+    so two processes can never hold the same seat; the keys expire with
+    the hold. A per-trip index of hold ids serves availability counts. It
+    is updated without a lock, so a racing write may drop a hold from a
+    count until that hold expires, but never from the seat claims.
+    Expired hold ids are swept from an index in bulk whenever it is
+    written."""
+
+    def __init__(self, alias=None):
+        self.alias = alias or settings.SEAT_HOLD_CACHE_ALIAS
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _hold_key(hold_id):
+        return f"hold:{hold_id}"
+
+    @staticmethod
+    def _seat_key(seat_key):
+        return "hold:seat:{}:{}:{}".format(*seat_key)
+
+    @staticmethod
+    def _trip_key(trip_id):
+        return f"hold:trip:{trip_id}"
+
+    def _update_trip_index(self, trip_ids, add=None, remove=None):
+        now = time.time()
+        for trip_id in trip_ids:
+            key = self._trip_key(trip_id)
+            index = {
+                hold_id: expires_at
+                for hold_id, expires_at in self.cache.get(key, {}).items()
+                if expires_at > now and hold_id != remove
+            }
+            if add is not None:
+                index[add.id] = add.expires_at
+            if index:
+                self.cache.set(
+                    key, index, timeout=max(index.values()) - now + 1
+                )
+            else:
+                self.cache.delete(key)
+
+    def sweep(self) -> int:
+        # Hold and seat keys expire on their own and trip indexes are
+        # swept when written.
+        return 0
+
+    def reserve(self, user_id, seats, ttl):
+        hold = _new_hold(user_id, seats, ttl)
+        claimed = []
+        for seat_key in hold.seats:
+            if not self.cache.add(
+                self._seat_key(seat_key), hold.id, timeout=ttl
+            ):
+                break
+            claimed.append(seat_key)
+        else:
+            self.cache.set(self._hold_key(hold.id), hold, timeout=ttl)
+            self._update_trip_index(
+                {trip_id for trip_id, _, _ in hold.seats}, add=hold
+            )
+            return hold, []
+
+        self.cache.delete_many(
+            [self._seat_key(seat_key) for seat_key in claimed]
+        )
+        return None, self.held_by_others(seats)
+
+    def get(self, hold_id):
+        hold = self.cache.get(self._hold_key(hold_id))
+        if hold is None or hold.expires_at <= time.time():
+            return None
+        return hold
+
+    def release(self, hold):
+        owned = self.cache.get_many(
+            [self._seat_key(seat_key) for seat_key in hold.seats]
+        )
+        self.cache.delete_many(
+            [key for key, hold_id in owned.items() if hold_id == hold.id]
+        )
+        self.cache.delete(self._hold_key(hold.id))
+        self._update_trip_index(
+            {trip_id for trip_id, _, _ in hold.seats}, remove=hold.id
+        )
+
+    def held_by_others(self, seats, hold_id=None) -> list:
+        keys = {self._seat_key(seat_key): seat_key for seat_key in seats}
+        held = self.cache.get_many(keys)
+        return [
+            keys[key]
+            for key, seat_hold_id in held.items()
+            if seat_hold_id != hold_id
+        ]
+
+    def held_seats(self, trip_ids) -> dict:
+        trip_ids = set(trip_ids)
+        now = time.time()
+        indexes = self.cache.get_many(
+            [self._trip_key(trip_id) for trip_id in trip_ids]
+        )
+        hold_ids = {
+            hold_id
+            for index in indexes.values()
+            for hold_id, expires_at in index.items()
+            if expires_at > now
+        }
+        held = {}
+        for hold in self.cache.get_many(
+            [self._hold_key(hold_id) for hold_id in hold_ids]
+        ).values():
+            if hold.expires_at <= now:
+                continue
+            for trip_id, cargo, seat in hold.seats:
+                if trip_id in trip_ids:
+                    held.setdefault(trip_id, set()).add((cargo, seat))
+        return held
+
+
+def attach_held_seats(trips):
+    """Set ``held_seats`` of all ``trips`` with a single store lookup."""
+    held = hold_store().held_seats([trip.id for trip in trips])
+    for trip in trips:
+        trip.held_seats = frozenset(held.get(trip.id, ()))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def hold_store():
+    """Return the configured hold store of this process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.SEAT_HOLD_STORE)()
+    return _store
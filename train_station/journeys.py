@@ -0,0 +1,250 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from train_station.holds import attach_held_seats
+from train_station.models import Trip
+
+Connection = namedtuple(
+    "Connection",
+    [
+        "departure_time",
+        "trip_id",
+        "arrival_time",
+        "source_id",
+        "destination_id",
+    ],
+)
+
+
+class Journey:
+    def __init__(self, legs):
+        self.legs = legs
+
+    @property
+    def departure_time(self):
+        return self.legs[0].departure_time
+
+    @property
+    def arrival_time(self):
+        return self.legs[-1].arrival_time
+
+    @property
+    def transfers(self) -> int:
+        return len(self.legs) - 1
+
+    @property
+    def tickets_available(self) -> int:
+        return min(leg.tickets_available for leg in self.legs)
+
+
+class JourneyPlanner:
+    """Earliest-arrival journey search over all trips with the connection
+    scan algorithm.
+
+    Every trip is a connection between the stations of its route. The
+    connections are kept in memory sorted by departure time; they are
+    loaded once per process, patched by trip signals and fully reloaded
+    after ``ttl`` seconds to pick up changes made by other processes."""
+
+    def __init__(self, min_transfer, ttl):
+        self.min_transfer = min_transfer
+        self.ttl = ttl
+        self._connections = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _connection(trip_id, source_id, destination_id, departure, arrival):
+        if arrival < departure:
+            return None
+        return Connection(
+            departure, trip_id, arrival, source_id, destination_id
+        )
+
+    def load(self):
+        rows = Trip.objects.values_list(
+            "id",
+            "route__source_id",
+            "route__destination_id",
+            "departure_time",
+            "arrival_time",
+        )
+        connections = sorted(
+            connection
+            for connection in (self._connection(*row) for row in rows)
+            if connection is not None
+        )
+        with self._lock:
+            self._connections = connections
+            self._loaded_at = time.monotonic()
+        return connections
+
+    def invalidate(self):
+        with self._lock:
+            self._connections = None
+
+    def connections(self) -> list:
+        connections, loaded_at = self._connections, self._loaded_at
+        if connections is None or time.monotonic() - loaded_at > self.ttl:
+            connections = self.load()
+        return connections
+
+    def update_trip(self, trip):
+        """Replace the connection of a created or changed trip."""
+        connection = self._connection(
+            trip.id,
+            trip.route.source_id,
+            trip.route.destination_id,
+            trip.departure_time,
+            trip.arrival_time,
+        )
+        with self._lock:
+            if self._connections is None:
+                return
+            # Copy on write so that running searches keep a stable list.
+            connections = [
+                current
+                for current in self._connections
+                if current.trip_id != trip.id
+            ]
+            if connection is not None:
+                insort(connections, connection)
+            self._connections = connections
+
+    def remove_trip(self, trip_id):
+        with self._lock:
+            if self._connections is None:
+                return
+            self._connections = [
+                current
+                for current in self._connections
+                if current.trip_id != trip_id
+            ]
+
+    def earliest_arrival(self, source_id, destination_id, departure_time):
+        """Return the legs of the journey reaching ``destination_id``
+        the earliest when leaving ``source_id`` at ``departure_time``."""
+        connections = self.connections()
+        arrival = {source_id: departure_time}
+        reached_by = {}
+
+        for index in range(
+            bisect_left(connections, (departure_time,)), len(connections)
+        ):
+            connection = connections[index]
+            best_arrival = arrival.get(destination_id)
+            if (
+                best_arrival is not None
+                and connection.departure_time >= best_arrival
+            ):
+                break
+
+            reached_at = arrival.get(connection.source_id)
+            if reached_at is None:
+                continue
+            if connection.source_id != source_id:
+                reached_at += self.min_transfer
+            if connection.departure_time < reached_at:
+                continue
+
+            current_arrival = arrival.get(connection.destination_id)
+            if (
+                current_arrival is None
+                or connection.arrival_time < current_arrival
+            ):
+                arrival[connection.destination_id] = connection.arrival_time
+                reached_by[connection.destination_id] = connection
+
+        if destination_id not in reached_by:
+            return None
+
+        legs = []
+        station_id = destination_id
+        while station_id != source_id:
+            leg = reached_by[station_id]
+            legs.append(leg)
+            station_id = leg.source_id
+        return legs[::-1]
+
+    def search(self, source_id, destination_id, departure_time, limit=3):
+        """Return up to ``limit`` journeys, each one being the earliest
+        arrival for a departure later than the previous journey's."""
+        journeys = []
+        if source_id == destination_id:
+            return journeys
+
+        while len(journeys) < limit:
+            legs = self.earliest_arrival(
+                source_id, destination_id, departure_time
+            )
+            if legs is None:
+                break
+            journeys.append(legs)
+            departure_time = legs[0].departure_time + timedelta(
+                microseconds=1
+            )
+        return journeys
+
+
+planner = JourneyPlanner(
+    min_transfer=timedelta(minutes=settings.JOURNEY_MIN_TRANSFER_MINUTES),
+    ttl=settings.JOURNEY_GRAPH_TTL_SECONDS,
+)
+
+
+def _journey_trips():
+    return Trip.objects.select_related(
+        "route__source", "route__destination", "train"
+    ).defer("occupancy")
+
+
+def _trip_ids(journeys) -> set:
+    return {leg.trip_id for legs in journeys for leg in legs}
+
+
+def _build_journeys(journeys, trips) -> list:
+    attach_held_seats(trips.values())
+    return [
+        Journey([trips[leg.trip_id] for leg in legs])
+        for legs in journeys
+        if all(leg.trip_id in trips for leg in legs)
+    ]
+
+
+def search_journeys(source_id, destination_id, departure_time=None, limit=3):
+    """Find journeys and load their trips with seat availability
+    in a single query. Journeys with trips deleted meanwhile by another
+    process are dropped."""
+    journeys = planner.search(
+        source_id,
+        destination_id,
+        departure_time or timezone.now(),
+        limit,
+    )
+    trips = _journey_trips().in_bulk(_trip_ids(journeys))
+    return _build_journeys(journeys, trips)
+
+
+async def asearch_journeys(
+    source_id, destination_id, departure_time=None, limit=3
+):
+    """Async version of ``search_journeys``.
+
+    The search runs in the sync thread, as the first one of a process
+    loads all connections from the database; trips are loaded with the
+    async ORM."""
+    journeys = await sync_to_async(planner.search)(
+        source_id,
+        destination_id,
+        departure_time or timezone.now(),
+        limit,
+    )
+    trips = await _journey_trips().ain_bulk(_trip_ids(journeys))
+    return await sync_to_async(_build_journeys)(journeys, trips)
@@ -0,0 +1,259 @@
+"""Self-contained HTTP load driver for the booking API.
+
+Virtual users log in with JWT, then replay a weighted mix of read and
+booking requests against a running server for a fixed duration. Only the
+standard library is used, so the driver can run from any machine with
+the project checked out."""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+from django.urls import reverse
+
+from train_station.benchmark import summarize
+
+DEFAULT_MIX = {
+    "trip-list": 30,
+    "trip-list-filtered": 15,
+    "trip-detail": 15,
+    "route-list": 8,
+    "station-list": 5,
+    "journey-search": 10,
+    "order-list": 7,
+    "order-create": 10,
+}
+
+
+class ApiSession:
+    """JWT authenticated HTTP session of one virtual user."""
+
+    def __init__(self, base_url, email, password, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.timeout = timeout
+        self.token = None
+
+    def login(self):
+        _, body = self._send(
+            "POST",
+            reverse("user:token_obtain_pair"),
+            body={"email": self.email, "password": self.password},
+            authenticated=False,
+        )
+        self.token = body["access"]
+
+    def _send(self, method, path, params=None, body=None, authenticated=True):
+        url = f"{self.base_url}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        if authenticated:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        request = Request(url, data=data, headers=headers, method=method)
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                payload = response.read()
+                status = response.status
+        except HTTPError as error:
+            payload = error.read()
+            status = error.code
+        if status >= 400 and not authenticated:
+            raise RuntimeError(f"{method} {path} failed with {status}")
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            # Empty bodies and HTML error pages.
+            return status, None
+
+    def request(self, method, path, params=None, body=None):
+        """Send a request, logging in again once if the token expired."""
+        if self.token is None:
+            self.login()
+        status, payload = self._send(method, path, params, body)
+        if status == 401:
+            self.login()
+            status, payload = self._send(method, path, params, body)
+        return status, payload
+
+
+class Catalog:
+    """Ids discovered from the API, used to build realistic requests."""
+
+    def __init__(self, session, pages=5):
+        self.stations = [
+            station["id"]
+            for station in session.request(
+                "GET", reverse("train_station:station-list")
+            )[1]
+        ]
+        self.routes = [
+            route["id"]
+            for route in session.request(
+                "GET", reverse("train_station:route-list")
+            )[1]["results"]
+        ]
+        self.trips = []
+        url = reverse("train_station:trip-list")
+        params = {"page_size": 100}
+        for _ in range(pages):
+            _, page = session.request("GET", url, params)
+            self.trips += [trip["id"] for trip in page["results"]]
+            if not page["next"]:
+                break
+            params = parse_qs(urlsplit(page["next"]).query)
+
+        if not (self.stations and self.routes and self.trips):
+            raise RuntimeError(
+                "Load test needs stations, routes and trips, "
+                "run generate_data first"
+            )
+
+
+def build_actions(catalog, rng):
+    """Return ``name -> callable(session)`` for every traffic type."""
+
+    def trip_list(session):
+        return session.request("GET", reverse("train_station:trip-list"))
+
+    def trip_list_filtered(session):
+        day = date.today() + timedelta(days=rng.randrange(30))
+        return session.request(
+            "GET",
+            reverse("train_station:trip-list"),
+            {"route": rng.choice(catalog.routes), "date": day.isoformat()},
+        )
+
+    def trip_detail(session):
+        return session.request(
+            "GET",
+            reverse(
+                "train_station:trip-detail", args=[rng.choice(catalog.trips)]
+            ),
+        )
+
+    def route_list(session):
+        return session.request("GET", reverse("train_station:route-list"))
+
+    def station_list(session):
+        return session.request("GET", reverse("train_station:station-list"))
+
+    def journey_search(session):
+        source, destination = rng.sample(catalog.stations, 2)
+        return session.request(
+            "GET",
+            reverse("train_station:journey-list"),
+            {"source": source, "destination": destination},
+        )
+
+    def order_list(session):
+        return session.request("GET", reverse("train_station:order-list"))
+
+    def order_create(session):
+        ticket = {
+            "trip": rng.choice(catalog.trips),
+            "cargo": rng.randint(1, 4),
+            "seat": rng.randint(1, 30),
+        }
+        return session.request(
+            "POST",
+            reverse("train_station:order-list"),
+            body={"tickets": [ticket]},
+        )
+
+    return {
+        "trip-list": trip_list,
+        "trip-list-filtered": trip_list_filtered,
+        "trip-detail": trip_detail,
+        "route-list": route_list,
+        "station-list": station_list,
+        "journey-search": journey_search,
+        "order-list": order_list,
+        "order-create": order_create,
+    }
+
+
+class LoadTestResult:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, status):
+        with self._lock:
+            self.samples[name].append(elapsed)
+            self.statuses[name][status] += 1
+
+    def report(self) -> dict:
+        """Per endpoint latency summary (ms), throughput and statuses."""
+        report = {}
+        for name, samples in sorted(self.samples.items()):
+            report[name] = {
+                **summarize(samples),
+                "throughput": len(samples) / self.duration,
+                "statuses": dict(self.statuses[name]),
+            }
+        return report
+
+
+def run_load_test(
+    base_url,
+    credentials,
+    duration=60,
+    concurrency=10,
+    mix=None,
+    seed=0,
+    actions=build_actions,
+):
+    """Replay mixed traffic against ``base_url`` with ``concurrency``
+    virtual users for ``duration`` seconds.
+
+    ``credentials`` is a list of (email, password) pairs shared round-robin
+    by the virtual users; use enough of them to stay under the API's
+    per-user throttling rate. ``actions`` builds the requests like
+    ``build_actions``, ``mix`` weighs them by name."""
+    mix = mix or DEFAULT_MIX
+    sessions = [
+        ApiSession(base_url, *credentials[number % len(credentials)])
+        for number in range(concurrency)
+    ]
+    # Log in up front, so that password hashing is not measured.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(ApiSession.login, sessions))
+    catalog = Catalog(sessions[0])
+    result = LoadTestResult()
+
+    def virtual_user(number):
+        rng = random.Random(seed + number)
+        user_actions = actions(catalog, rng)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        session = sessions[number]
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, _ = user_actions[name](session)
+            except (URLError, OSError):
+                status = "error"
+            result.record(name, time.perf_counter() - started, status)
+
+    started = time.monotonic()
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(virtual_user, range(concurrency)))
+    result.duration = time.monotonic() - started
+    return result
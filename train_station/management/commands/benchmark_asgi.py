@@ -0,0 +1,112 @@
+from datetime import date, timedelta
+
+from django.core.management import BaseCommand
+from django.urls import reverse
+
+from train_station.benchmark import format_summary
+from train_station.loadtest import run_load_test
+
+MIX = {"trip-list": 4, "trip-availability": 4, "journey-search": 2}
+
+
+def _build_actions(trip_list_name, availability_name, journey_list_name):
+    def build(catalog, rng):
+        def list_trips(session):
+            day = date.today() + timedelta(days=rng.randrange(30))
+            return session.request(
+                "GET",
+                reverse(trip_list_name),
+                {"route": rng.choice(catalog.routes), "date": day.isoformat()},
+            )
+
+        def get_availability(session):
+            return session.request(
+                "GET",
+                reverse(availability_name, args=[rng.choice(catalog.trips)]),
+            )
+
+        def search_journeys(session):
+            source, destination = rng.sample(catalog.stations, 2)
+            return session.request(
+                "GET",
+                reverse(journey_list_name),
+                {"source": source, "destination": destination},
+            )
+
+        return {
+            "trip-list": list_trips,
+            "trip-availability": get_availability,
+            "journey-search": search_journeys,
+        }
+
+    return build
+
+
+# Both sides serve the same payloads, so that the comparison measures the
+# servers and not the response sizes.
+sync_actions = _build_actions(
+    "train_station:trip-list",
+    "train_station:trip-availability",
+    "train_station:journey-list",
+)
+async_actions = _build_actions(
+    "train_station:async-trip-list",
+    "train_station:async-trip-availability",
+    "train_station:async-journey-list",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of the sync read endpoints served over WSGI "
+        "with their async versions served over ASGI under the same "
+        "concurrent load. Start both servers against the same database "
+        "first, e.g. 'gunicorn train_station_service.wsgi -b :8000' and "
+        "'uvicorn train_station_service.asgi:application --port 8001', "
+        "with users created by generate_data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wsgi-url", default="http://localhost:8000")
+        parser.add_argument("--asgi-url", default="http://localhost:8001")
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--password", default="loadtest")
+        parser.add_argument("--prefix", default="loadtest")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument(
+            "--duration", type=int, default=30, help="Seconds per server"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args: any, **options: any) -> None:
+        credentials = [
+            (f"{options['prefix']}-{number}@example.com", options["password"])
+            for number in range(options["users"])
+        ]
+        for label, base_url, actions in (
+            ("sync WSGI", options["wsgi_url"], sync_actions),
+            ("async ASGI", options["asgi_url"], async_actions),
+        ):
+            result = run_load_test(
+                base_url,
+                credentials,
+                duration=options["duration"],
+                concurrency=options["concurrency"],
+                mix=MIX,
+                seed=options["seed"],
+                actions=actions,
+            )
+            total = 0
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for name, report in result.report().items():
+                total += report["count"]
+                self.stdout.write(
+                    f"{format_summary(name, report)} "
+                    f"{report['throughput']:.1f} req/s {report['statuses']}"
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{label}: {total / result.duration:.1f} req/s "
+                    f"with {options['concurrency']} concurrent clients"
+                )
+            )
@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from train_station.benchmark import format_summary, measure, summarize
+from train_station.models import Trip
+
+MODES = (
+    ("new connection per request", 0, False),
+    ("persistent + health checks", 600, True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the database part of the request cycle when every "
+        "request opens a new connection versus persistent connections "
+        "with health checks, as configured by settings_production. Run "
+        "loadtest against the servers for end-to-end numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args: any, **options: any) -> None:
+        connection = connections[options["database"]]
+        settings_dict = connection.settings_dict
+        original = {
+            key: settings_dict[key]
+            for key in ("CONN_MAX_AGE", "CONN_HEALTH_CHECKS")
+        }
+
+        def request_cycle():
+            # The signals close obsolete connections like a real request.
+            request_started.send(sender=self.__class__)
+            Trip.objects.using(options["database"]).filter(id=0).exists()
+            request_finished.send(sender=self.__class__)
+
+        try:
+            for label, max_age, health_checks in MODES:
+                connection.close()
+                settings_dict["CONN_MAX_AGE"] = max_age
+                settings_dict["CONN_HEALTH_CHECKS"] = health_checks
+                samples = measure(request_cycle, options["requests"])
+                self.stdout.write(format_summary(label, summarize(samples)))
+        finally:
+            connection.close()
+            settings_dict.update(original)
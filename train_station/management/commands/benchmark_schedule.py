@@ -0,0 +1,76 @@
+import random
+from datetime import date, timedelta
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from train_station import synthetic
+from train_station.benchmark import format_summary, measure, summarize
+from train_station.views import TripViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large schedule of trips and measure the timetable "
+        "search queries of the trip list endpoint. Seeded rows are "
+        "rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trips", type=int, default=1_000_000)
+        parser.add_argument("--routes", type=int, default=500)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args: any, **options: any) -> None:
+        rng = random.Random(options["seed"])
+        start = date.today()
+
+        with transaction.atomic():
+            routes = self.seed_schedule(rng, start, options)
+            self.run_benchmarks(rng, start, routes, options)
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def seed_schedule(self, rng, start, options):
+        prefix = f"benchmark-{rng.getrandbits(32):08x}"
+        stations = synthetic.create_stations(
+            rng, options["routes"], prefix=f"{prefix} station"
+        )
+        routes = synthetic.create_routes(rng, stations, options["routes"])
+        trains = synthetic.create_trains(rng, 5, prefix=f"{prefix} train")
+
+        self.stdout.write(f"Seeding {options['trips']} trips...")
+        synthetic.create_trips(
+            rng, routes, trains, options["trips"], start, options["days"]
+        )
+        return routes
+
+    def run_benchmarks(self, rng, start, routes, options):
+        queryset = TripViewSet.queryset.defer("occupancy").order_by(
+            "departure_time", "id"
+        )
+
+        def random_day():
+            return start + timedelta(days=rng.randrange(options["days"]))
+
+        cases = {
+            "route + date": lambda: queryset.on_route(
+                rng.choice(routes).id
+            ).departing_on(random_day()),
+            "date": lambda: queryset.departing_on(random_day()),
+            "route": lambda: queryset.on_route(rng.choice(routes).id),
+            "date (departure_time__date)": lambda: queryset.filter(
+                departure_time__date=random_day()
+            ),
+        }
+        for name, build_queryset in cases.items():
+            summary = summarize(
+                measure(
+                    lambda: list(build_queryset()[:21]), options["repeat"]
+                )
+            )
+            self.stdout.write(format_summary(name, summary))
+            self.stdout.write(build_queryset().explain())
@@ -0,0 +1,90 @@
+import random
+from datetime import date
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from train_station import synthetic
+from train_station.benchmark import measure, summarize
+from train_station.renderers import ORJSONRenderer
+from train_station.serializer import (
+    RouteListSerializer,
+    RouteListValuesSerializer,
+    TripListSerializer,
+    TripListValuesSerializer,
+)
+from train_station.views import RouteViewSet, TripViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed trips and routes and compare the rows per second of the "
+        "model serializers with JSONRenderer and of the values "
+        "serializers with ORJSONRenderer used by the list endpoints. "
+        "Seeded rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args: any, **options: any) -> None:
+        rng = random.Random(options["seed"])
+        rows = options["rows"]
+
+        with transaction.atomic():
+            prefix = f"benchmark-{rng.getrandbits(32):08x}"
+            stations = synthetic.create_stations(
+                rng, 200, prefix=f"{prefix} station"
+            )
+            routes = synthetic.create_routes(rng, stations, rows)
+            trains = synthetic.create_trains(
+                rng, 5, prefix=f"{prefix} train"
+            )
+            synthetic.create_trips(
+                rng, routes, trains, rows, date.today(), 30
+            )
+
+            trips = TripViewSet.queryset.defer("occupancy").order_by(
+                "departure_time", "id"
+            )[:rows]
+            routes = RouteViewSet.queryset.order_by("id")[:rows]
+            cases = {
+                "trips": (
+                    lambda: JSONRenderer().render(
+                        TripListSerializer(trips.all(), many=True).data
+                    ),
+                    lambda: ORJSONRenderer().render(
+                        TripListValuesSerializer(
+                            TripListValuesSerializer.get_rows(trips.all())
+                        ).data
+                    ),
+                ),
+                "routes": (
+                    lambda: JSONRenderer().render(
+                        RouteListSerializer(routes.all(), many=True).data
+                    ),
+                    lambda: ORJSONRenderer().render(
+                        RouteListValuesSerializer(
+                            RouteListValuesSerializer.get_rows(routes.all())
+                        ).data
+                    ),
+                ),
+            }
+            for name, (model_path, values_path) in cases.items():
+                # Every run queries the rows again, like a request.
+                model_rate = rows / self.median(model_path, options)
+                values_rate = rows / self.median(values_path, options)
+                self.stdout.write(
+                    f"{name:<8} model serializer {model_rate:>9.0f} rows/s "
+                    f"values serializer {values_rate:>9.0f} rows/s "
+                    f"speedup {values_rate / model_rate:.1f}x"
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def median(func, options) -> float:
+        """Median duration of ``func`` in seconds."""
+        return summarize(measure(func, options["repeat"]))["p50"] / 1000
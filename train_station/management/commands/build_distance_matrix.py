@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from train_station.distance_matrix import build_station_distance_matrix
+
+
+class Command(BaseCommand):
+    help = "Build the all-pairs station distance matrix as .npy files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=settings.STATION_DISTANCE_MATRIX_PATH,
+            help="Link to the current matrix version, replaced on success",
+        )
+        parser.add_argument("--chunk-size", type=int, default=1024)
+
+    def handle(self, *args: any, **options: any) -> None:
+        started = time.perf_counter()
+        matrix = build_station_distance_matrix(
+            options["output"], chunk_size=options["chunk_size"]
+        )
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Built {len(matrix)}x{len(matrix)} distance matrix "
+                f"in {elapsed:.2f}s: {options['output']}"
+            )
+        )
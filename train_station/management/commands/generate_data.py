@@ -0,0 +1,86 @@
+import random
+import time
+from datetime import date
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from train_station import synthetic
+from train_station.cache import invalidate_model
+from train_station.journeys import planner
+from train_station.signals import CATALOG_MODELS
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic network of stations, routes, trains, trips, "
+        "users, orders and tickets for benchmarks and load tests"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stations", type=int, default=200)
+        parser.add_argument("--routes", type=int, default=1000)
+        parser.add_argument("--trains", type=int, default=30)
+        parser.add_argument("--crew", type=int, default=100)
+        parser.add_argument("--trips", type=int, default=50_000)
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=20_000)
+        parser.add_argument(
+            "--password",
+            default="loadtest",
+            help="Password of the generated users",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="loadtest",
+            help="Prefix of generated names, must be unique per run",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args: any, **options: any) -> None:
+        rng = random.Random(options["seed"])
+        prefix = options["prefix"]
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            stations = synthetic.create_stations(
+                rng, options["stations"], prefix=f"{prefix} station"
+            )
+            routes = synthetic.create_routes(
+                rng, stations, options["routes"]
+            )
+            trains = synthetic.create_trains(
+                rng, options["trains"], prefix=f"{prefix} train"
+            )
+            synthetic.create_crew(rng, options["crew"])
+            trips = synthetic.create_trips(
+                rng,
+                routes,
+                trains,
+                options["trips"],
+                date.today(),
+                options["days"],
+            )
+            users = synthetic.create_users(
+                options["users"], options["password"], prefix=f"{prefix}-"
+            )
+            tickets = synthetic.create_orders(
+                rng, users, trips, options["orders"], date.today()
+            )
+
+        # bulk_create does not send signals.
+        planner.invalidate()
+        for model in CATALOG_MODELS:
+            invalidate_model(model)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {len(stations)} stations, {len(routes)} routes, "
+                f"{len(trains)} trains, {len(trips)} trips, "
+                f"{len(users)} users and {tickets} tickets "
+                f"in {time.perf_counter() - started:.1f}s. "
+                f"Users log in as {prefix}-<n>@example.com / "
+                f"{options['password']}"
+            )
+        )
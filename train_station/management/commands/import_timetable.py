@@ -0,0 +1,61 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+
+from train_station.timetable import import_timetable, read_csv, read_json
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a timetable of trips (CSV or JSON) and recurrence rules "
+        "(JSON) in one transaction. Nothing is imported if any row has "
+        "errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument(
+            "--format",
+            choices=("csv", "json"),
+            help="Format of the file, by default from its extension",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only validate the timetable",
+        )
+
+    def handle(self, *args: any, **options: any) -> None:
+        path = options["path"]
+        timetable_format = options["format"] or path.suffix.lstrip(".")
+        if timetable_format not in ("csv", "json"):
+            raise CommandError("Pass --format csv or --format json.")
+
+        started = time.perf_counter()
+        content = path.read_text()
+        if timetable_format == "csv":
+            trip_rows, rule_rows = read_csv(content)
+        else:
+            trip_rows, rule_rows = read_json(json.loads(content))
+
+        count, errors = import_timetable(
+            trip_rows, rule_rows, dry_run=options["dry_run"]
+        )
+        for error in errors:
+            for field, messages in error["errors"].items():
+                for message in messages:
+                    self.stderr.write(
+                        f"row {error['row']}: {field}: {message}"
+                    )
+        if errors:
+            raise CommandError(f"{len(errors)} rows have errors.")
+
+        verb = "Validated" if options["dry_run"] else "Imported"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {count} trips "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+        )
@@ -0,0 +1,61 @@
+from django.core.management import BaseCommand
+
+from train_station.benchmark import format_summary
+from train_station.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay mixed read and booking traffic against a running server "
+        "as users created by generate_data and report latency "
+        "percentiles and throughput per endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=100,
+            help="Number of generated users to log in as",
+        )
+        parser.add_argument("--password", default="loadtest")
+        parser.add_argument("--prefix", default="loadtest")
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--duration", type=int, default=60, help="Seconds"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args: any, **options: any) -> None:
+        credentials = [
+            (f"{options['prefix']}-{number}@example.com", options["password"])
+            for number in range(options["users"])
+        ]
+        result = run_load_test(
+            options["base_url"],
+            credentials,
+            duration=options["duration"],
+            concurrency=options["concurrency"],
+            seed=options["seed"],
+        )
+
+        total = 0
+        for name, report in result.report().items():
+            total += report["count"]
+            statuses = ", ".join(
+                f"{status}: {count}"
+                for status, count in sorted(
+                    report["statuses"].items(), key=lambda item: str(item)
+                )
+            )
+            self.stdout.write(
+                f"{format_summary(name, report)} "
+                f"{report['throughput']:.1f} req/s [{statuses}]"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} requests in {result.duration:.1f}s, "
+                f"{total / result.duration:.1f} req/s"
+            )
+        )
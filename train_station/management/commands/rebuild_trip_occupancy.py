@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from train_station.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Rebuild trip seat maps and sold ticket counters from tickets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "trip_ids",
+            nargs="*",
+            type=int,
+            help="Trips to rebuild, all trips if omitted",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args: any, **options: any) -> None:
+        processed = Trip.rebuild_seat_maps(
+            trip_ids=options["trip_ids"] or None,
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt occupancy of {processed} trips")
+        )
@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from train_station.models import Route
+
+
+class Command(BaseCommand):
+    help = "Recompute stored route distances from station coordinates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args: any, **options: any) -> None:
+        updated = Route.recompute_distances(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Recomputed distance of {updated} routes")
+        )
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+
+from train_station.analytics import rebuild_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the orders created since the last run to the daily route and "
+        "train analytics and recount the trips and seats of upcoming days. "
+        "Run it periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute the analytics from all orders, e.g. after "
+            "cancellations",
+        )
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args: any, **options: any) -> None:
+        refresh = rebuild_rollups if options["rebuild"] else refresh_rollups
+        processed = refresh(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Added {processed} orders to the analytics")
+        )
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.3 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+from train_station.occupancy import SeatMap
+
+
+def fill_trip_occupancy(apps, schema_editor):
+    Trip = apps.get_model("train_station", "Trip")
+    Ticket = apps.get_model("train_station", "Ticket")
+
+    seat_maps = {}
+    for trip in Trip.objects.select_related("train").iterator():
+        seat_maps[trip.id] = SeatMap(
+            trip.train.cargo_num, trip.train.places_in_cargo
+        )
+    for trip_id, cargo, seat in Ticket.objects.values_list(
+        "trip_id", "cargo", "seat"
+    ).iterator():
+        try:
+            seat_maps[trip_id].take(cargo, seat)
+        except IndexError:
+            # Tickets outside their train's layout are left out, like in
+            # Trip.rebuild_seat_maps().
+            pass
+
+    Trip.objects.bulk_update(
+        [
+            Trip(id=trip_id, occupancy=seat_map.to_bytes())
+            for trip_id, seat_map in seat_maps.items()
+        ],
+        ["occupancy"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("train_station", "0005_train_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="occupancy",
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(fill_trip_occupancy, migrations.RunPython.noop),
+    ]
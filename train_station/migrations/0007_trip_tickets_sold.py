@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 03:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_tickets_sold(apps, schema_editor):
+    Trip = apps.get_model("train_station", "Trip")
+    Ticket = apps.get_model("train_station", "Ticket")
+
+    Trip.objects.update(
+        tickets_sold=Coalesce(
+            Subquery(
+                Ticket.objects.filter(trip=OuterRef("pk"))
+                .order_by()
+                .values("trip")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("train_station", "0006_trip_occupancy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="tickets_sold",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_tickets_sold, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+from train_station.geo import haversine
+
+
+def fill_route_distance(apps, schema_editor):
+    Route = apps.get_model("train_station", "Route")
+
+    routes = list(Route.objects.select_related("source", "destination"))
+    for route in routes:
+        route.distance_km = haversine(
+            route.source.latitude,
+            route.source.longitude,
+            route.destination.latitude,
+            route.destination.longitude,
+        )
+    Route.objects.bulk_update(routes, ["distance_km"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("train_station", "0007_trip_tickets_sold"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="distance_km",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_route_distance, migrations.RunPython.noop),
+    ]
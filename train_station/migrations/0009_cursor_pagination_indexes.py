@@ -0,0 +1,27 @@
+# Generated by Django 5.0.3 on 2026-10-18 03:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("train_station", "0008_route_distance_km"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-created_at", "id"],
+                name="order_user_created_id_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                fields=["departure_time", "id"], name="trip_departure_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 03:18
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking writes to the trips table.
+    atomic = False
+
+    dependencies = [
+        ("train_station", "0009_cursor_pagination_indexes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="trip",
+            index=models.Index(
+                fields=["route", "departure_time", "id"],
+                name="trip_route_departure_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.0.3 on 2026-10-18 04:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("train_station", "0010_trip_route_departure_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalyticsWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=63, unique=True)),
+                ("last_order_id", models.BigIntegerField(default=0)),
+                ("refreshed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="RouteDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("trips", models.PositiveIntegerField(default=0)),
+                ("seats", models.PositiveIntegerField(default=0)),
+                ("tickets_sold", models.PositiveIntegerField(default=0)),
+                ("orders", models.PositiveIntegerField(default=0)),
+                ("passenger_km", models.FloatField(default=0)),
+                (
+                    "route",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="train_station.route",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["day", "route"],
+                "indexes": [
+                    models.Index(fields=["day"], name="route_daily_stats_day_idx")
+                ],
+                "unique_together": {("route", "day")},
+            },
+        ),
+        migrations.CreateModel(
+            name="TrainDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("trips", models.PositiveIntegerField(default=0)),
+                ("seats", models.PositiveIntegerField(default=0)),
+                ("tickets_sold", models.PositiveIntegerField(default=0)),
+                ("orders", models.PositiveIntegerField(default=0)),
+                ("passenger_km", models.FloatField(default=0)),
+                (
+                    "train",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="train_station.train",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["day", "train"],
+                "indexes": [
+                    models.Index(fields=["day"], name="train_daily_stats_day_idx")
+                ],
+                "unique_together": {("train", "day")},
+            },
+        ),
+    ]
@@ -1,11 +1,17 @@
-import math
 import os
 import uuid
+from datetime import datetime, time, timedelta
+from functools import partial
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 
+from train_station.cache import invalidate_model
+from train_station.geo import haversine
+from train_station.occupancy import SeatMap
+from train_station.seat_events import publish_seat_changes
 from train_station_service import settings
 
 
@@ -40,6 +46,26 @@ class Train(models.Model):
     def __str__(self) -> str:
         return f"{self.name}"
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous_layout = (
+                Train.objects.filter(pk=self.pk)
+                .values_list("cargo_num", "places_in_cargo")
+                .first()
+                if self.pk
+                else None
+            )
+            super().save(*args, **kwargs)
+            if previous_layout not in (
+                None,
+                (self.cargo_num, self.places_in_cargo),
+            ):
+                # Seat bits are laid out by cargo size, so the stored maps
+                # of the train's trips must be recomputed.
+                Trip.rebuild_seat_maps(
+                    list(self.trips.values_list("id", flat=True))
+                )
+
     class Meta:
         ordering = ["name"]
         unique_together = ["cargo_num", "places_in_cargo"]
@@ -54,6 +80,30 @@ class Station(models.Model):
     def __str__(self) -> str:
         return f"{self.name}"
 
+    def save(self, *args, **kwargs):
+        previous_coordinates = (
+            Station.objects.filter(pk=self.pk)
+            .values_list("latitude", "longitude")
+            .first()
+            if self.pk
+            else None
+        )
+        super().save(*args, **kwargs)
+        if previous_coordinates not in (
+            None,
+            (self.latitude, self.longitude),
+        ):
+            self.recompute_route_distances()
+
+    def recompute_route_distances(self) -> int:
+        """Refresh the stored distance of every route
+        starting or ending at this station."""
+        return Route.recompute_distances(
+            Route.objects.filter(
+                models.Q(source=self) | models.Q(destination=self)
+            )
+        )
+
     class Meta:
         ordering = ["name"]
 
@@ -69,35 +119,58 @@ class Route(models.Model):
         on_delete=models.CASCADE,
         related_name="destination_routes"
     )
+    distance_km = models.FloatField(default=0, editable=False)
 
     class Meta:
         unique_together = ["source", "destination"]
 
-    @property
-    def distance(self) -> str:
-        radius_of_planet = 6371
-        lat1, lon1, lat2, lon2 = map(math.radians, [
+    def compute_distance(self) -> float:
+        return haversine(
             self.source.latitude,
             self.source.longitude,
             self.destination.latitude,
-            self.destination.longitude
-        ])
-        different_long = lon2 - lon1
-        different_lat = lat2 - lat1
-
-        temp = (
-            math.sin(different_lat / 2)
-            ** 2 + math.cos(lat1) * math.cos(lat2)
-            * math.sin(different_long / 2) ** 2
+            self.destination.longitude,
         )
 
-        distance = 2 * math.atan2(math.sqrt(temp), math.sqrt(1 - temp))
+    def save(self, *args, **kwargs):
+        self.distance_km = self.compute_distance()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "distance_km"}
+        super().save(*args, **kwargs)
 
-        return f"{round(radius_of_planet * distance)} km"
+    @staticmethod
+    def recompute_distances(queryset=None, batch_size=1000) -> int:
+        """Refresh the stored distance of the given routes (all by default)
+        and return the number of updated routes."""
+        if queryset is None:
+            queryset = Route.objects.all()
+        routes = list(queryset.select_related("source", "destination"))
+        for route in routes:
+            route.distance_km = route.compute_distance()
+        Route.objects.bulk_update(
+            routes, ["distance_km"], batch_size=batch_size
+        )
+        # bulk_update() sends no signals, so cached route lists are dropped
+        # here.
+        invalidate_model(Route)
+        return len(routes)
+
+    @staticmethod
+    def format_distance(distance_km) -> str:
+        return f"{round(distance_km)} km"
+
+    @staticmethod
+    def format_name(source_name, destination_name) -> str:
+        return f"{source_name} - {destination_name}"
+
+    @property
+    def distance(self) -> str:
+        return Route.format_distance(self.distance_km)
 
     @property
     def name(self) -> str:
-        return f"{self.source} - {self.destination}"
+        return Route.format_name(self.source, self.destination)
 
 
 class Crew(models.Model):
@@ -115,6 +188,34 @@ class Crew(models.Model):
         ordering = ["first_name"]
 
 
+class TripQuerySet(models.QuerySet):
+    def departing_on(self, date):
+        """Filter trips departing on ``date`` with a half-open datetime
+        range, which unlike ``departure_time__date`` can use an index."""
+        start = datetime.combine(date, time.min)
+        return self.filter(
+            departure_time__gte=start,
+            departure_time__lt=start + timedelta(days=1),
+        )
+
+    def on_route(self, route_id):
+        return self.filter(route_id=route_id)
+
+    def for_availability(self):
+        """Only the columns needed for free and taken seats."""
+        return self.select_related("train").only(
+            "id",
+            "occupancy",
+            "tickets_sold",
+            "train__cargo_num",
+            "train__places_in_cargo",
+        )
+
+
+# Trip columns maintained from the trip's tickets.
+SEAT_STATE_FIELDS = ("occupancy", "tickets_sold")
+
+
 class Trip(models.Model):
     route = models.ForeignKey(
         Route,
@@ -129,10 +230,170 @@ class Trip(models.Model):
     crew = models.ManyToManyField(Crew, blank=True)
     departure_time = models.DateTimeField()
     arrival_time = models.DateTimeField()
+    occupancy = models.BinaryField(default=bytes)
+    tickets_sold = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TripQuerySet.as_manager()
+
+    # (cargo, seat) pairs under active seat holds, see
+    # ``train_station.holds.attach_held_seats``.
+    held_seats = frozenset()
 
     def __str__(self) -> str:
         return f"train: {self.train}, distance: {self.route}"
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["departure_time", "id"],
+                name="trip_departure_id_idx",
+            ),
+            models.Index(
+                fields=["route", "departure_time", "id"],
+                name="trip_route_departure_id_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Seat columns are only written by ``update_seat_maps`` under
+            # the trip lock, an instance loaded before concurrent bookings
+            # must not overwrite them.
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in SEAT_STATE_FIELDS
+            ]
+        with transaction.atomic():
+            previous_train_id = (
+                Trip.objects.filter(pk=self.pk)
+                .values_list("train_id", flat=True)
+                .first()
+                if self.pk
+                else None
+            )
+            super().save(*args, **kwargs)
+            if previous_train_id not in (None, self.train_id):
+                # Seat bits are laid out by the train's cargo size, so the
+                # stored map must be recomputed for the new train.
+                Trip.rebuild_seat_maps([self.pk])
+                self.__dict__.pop("seat_map", None)
+                self.refresh_from_db(fields=["occupancy", "tickets_sold"])
+
+    @cached_property
+    def seat_map(self) -> SeatMap:
+        return SeatMap(
+            self.train.cargo_num,
+            self.train.places_in_cargo,
+            self.occupancy,
+        )
+
+    @property
+    def taken_places(self) -> list:
+        return [
+            {"cargo": cargo, "seat": seat}
+            for cargo, seat in self.seat_map.taken_seats()
+        ]
+
+    @property
+    def held_places(self) -> list:
+        return [
+            {"cargo": cargo, "seat": seat}
+            for cargo, seat in sorted(self.held_seats)
+            if not self.seat_map.is_taken(cargo, seat)
+        ]
+
+    @staticmethod
+    def count_available(capacity, tickets_sold, held_count) -> int:
+        return max(capacity - tickets_sold - held_count, 0)
+
+    @property
+    def tickets_available(self) -> int:
+        return Trip.count_available(
+            self.train.cargo_num * self.train.places_in_cargo,
+            self.tickets_sold,
+            len(self.held_seats),
+        )
+
+    @staticmethod
+    def lock_for_booking(trip_ids) -> dict:
+        """Lock the given trips in id order and return them by id."""
+        queryset = (
+            Trip.objects.select_for_update(of=("self",))
+            .select_related("train")
+            .filter(id__in=trip_ids)
+            .order_by("id")
+        )
+        return {trip.id: trip for trip in queryset}
+
+    @staticmethod
+    def update_seat_maps(taken=(), released=(), trips=None):
+        """Mark (trip, cargo, seat) keys as taken or released in the stored
+        seat maps and publish the changes once committed. Must run inside
+        the transaction writing the tickets, ``trips`` are the already
+        locked trips, if any."""
+        if trips is None:
+            trips = Trip.lock_for_booking(
+                {trip_id for trip_id, _, _ in [*taken, *released]}
+            )
+        changes = {}
+        for trip_id, cargo, seat in released:
+            if trip_id in trips:
+                try:
+                    trips[trip_id].seat_map.release(cargo, seat)
+                except IndexError:
+                    continue
+                changes.setdefault(trip_id, ([], []))[1].append((cargo, seat))
+        for trip_id, cargo, seat in taken:
+            trips[trip_id].seat_map.take(cargo, seat)
+            changes.setdefault(trip_id, ([], []))[0].append((cargo, seat))
+
+        for trip in trips.values():
+            trip.occupancy = trip.seat_map.to_bytes()
+            trip.tickets_sold = trip.seat_map.taken_count
+        Trip.objects.bulk_update(trips.values(), ["occupancy", "tickets_sold"])
+        if changes:
+            transaction.on_commit(
+                partial(publish_seat_changes, changes), robust=True
+            )
+
+    @staticmethod
+    def rebuild_seat_maps(trip_ids=None, batch_size=1000) -> int:
+        """Recompute seat maps and sold counters from tickets and return
+        the number of processed trips."""
+        queryset = Trip.objects.select_related("train").order_by("id")
+        if trip_ids is not None:
+            queryset = queryset.filter(id__in=trip_ids)
+
+        processed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                trips = Trip.lock_for_booking(
+                    list(
+                        queryset.filter(id__gt=last_id).values_list(
+                            "id", flat=True
+                        )[:batch_size]
+                    )
+                )
+                if not trips:
+                    return processed
+                for trip in trips.values():
+                    trip.seat_map = SeatMap(
+                        trip.train.cargo_num, trip.train.places_in_cargo
+                    )
+                for trip_id, cargo, seat in Ticket.objects.filter(
+                    trip_id__in=trips
+                ).values_list("trip_id", "cargo", "seat"):
+                    try:
+                        trips[trip_id].seat_map.take(cargo, seat)
+                    except IndexError:
+                        pass
+                Trip.update_seat_maps(trips=trips)
+            processed += len(trips)
+            last_id = max(trips)
+
 
 class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -145,6 +406,12 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "id"],
+                name="order_user_created_id_idx",
+            ),
+        ]
 
 
 class Ticket(models.Model):
@@ -194,9 +461,21 @@ class Ticket(models.Model):
         update_fields=None,
     ):
         self.full_clean()
-        return super(Ticket, self).save(
-            force_insert, force_update, using, update_fields
-        )
+        with transaction.atomic():
+            previous_seat = (
+                Ticket.objects.filter(pk=self.pk)
+                .values_list("trip_id", "cargo", "seat")
+                .first()
+                if self.pk
+                else None
+            )
+            super(Ticket, self).save(
+                force_insert, force_update, using, update_fields
+            )
+            Trip.update_seat_maps(
+                taken=[(self.trip_id, self.cargo, self.seat)],
+                released=[previous_seat] if previous_seat else [],
+            )
 
     def __str__(self):
         return (
@@ -206,3 +485,66 @@ class Ticket(models.Model):
     class Meta:
         unique_together = ("trip", "cargo", "seat")
         ordering = ["cargo", "seat"]
+
+
+class DailyStats(models.Model):
+    """Sales and occupancy of the trips departing on ``day``, maintained by
+    ``train_station.analytics`` so that reports do not aggregate tickets."""
+
+    day = models.DateField()
+    trips = models.PositiveIntegerField(default=0)
+    seats = models.PositiveIntegerField(default=0)
+    tickets_sold = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    passenger_km = models.FloatField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def occupancy(self) -> float:
+        """Percentage of the seats sold."""
+        if not self.seats:
+            return 0.0
+        return round(100 * self.tickets_sold / self.seats, 1)
+
+
+class RouteDailyStats(DailyStats):
+    route = models.ForeignKey(
+        Route,
+        on_delete=models.CASCADE,
+        related_name="daily_stats"
+    )
+
+    class Meta:
+        unique_together = ("route", "day")
+        ordering = ["day", "route"]
+        indexes = [
+            models.Index(fields=["day"], name="route_daily_stats_day_idx"),
+        ]
+
+
+class TrainDailyStats(DailyStats):
+    train = models.ForeignKey(
+        Train,
+        on_delete=models.CASCADE,
+        related_name="daily_stats"
+    )
+
+    class Meta:
+        unique_together = ("train", "day")
+        ordering = ["day", "train"]
+        indexes = [
+            models.Index(fields=["day"], name="train_daily_stats_day_idx"),
+        ]
+
+
+class AnalyticsWatermark(models.Model):
+    """Last order whose tickets are included in the daily stats."""
+
+    name = models.CharField(max_length=63, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name}: order {self.last_order_id}"
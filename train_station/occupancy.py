@@ -0,0 +1,67 @@
+class SeatMap:
+    """Bitset with one bit per seat of a trip.
+
+    Seat ``(cargo, seat)`` maps to bit ``(cargo - 1) * places_in_cargo
+    + (seat - 1)``, so iterating the set bits yields taken seats ordered
+    by cargo and then by seat.
+    """
+
+    def __init__(self, cargo_num, places_in_cargo, data=b""):
+        self.cargo_num = cargo_num
+        self.places_in_cargo = places_in_cargo
+        size = (self.capacity + 7) // 8
+        self.data = bytearray(bytes(data or b"")[:size]).ljust(size, b"\0")
+
+    @property
+    def capacity(self) -> int:
+        return self.cargo_num * self.places_in_cargo
+
+    def _index(self, cargo, seat):
+        if not (
+            1 <= cargo <= self.cargo_num
+            and 1 <= seat <= self.places_in_cargo
+        ):
+            raise IndexError(f"No seat (cargo: {cargo}, seat: {seat})")
+        return (cargo - 1) * self.places_in_cargo + seat - 1
+
+    def is_taken(self, cargo, seat) -> bool:
+        index = self._index(cargo, seat)
+        return bool(self.data[index >> 3] & (1 << (index & 7)))
+
+    def take(self, cargo, seat):
+        index = self._index(cargo, seat)
+        self.data[index >> 3] |= 1 << (index & 7)
+
+    def release(self, cargo, seat):
+        index = self._index(cargo, seat)
+        self.data[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    @property
+    def taken_count(self) -> int:
+        return int.from_bytes(self.data, "little").bit_count()
+
+    @property
+    def free_count(self) -> int:
+        return self.capacity - self.taken_count
+
+    def taken_by_cargo(self) -> list:
+        """Return the number of taken seats of every cargo, in order."""
+        bits = int.from_bytes(self.data, "little")
+        mask = (1 << self.places_in_cargo) - 1
+        return [
+            (bits >> (cargo * self.places_in_cargo) & mask).bit_count()
+            for cargo in range(self.cargo_num)
+        ]
+
+    def taken_seats(self):
+        """Yield (cargo, seat) pairs of taken seats in seat order."""
+        for byte_index, byte in enumerate(self.data):
+            while byte:
+                low_bit = byte & -byte
+                index = (byte_index << 3) + low_bit.bit_length() - 1
+                byte ^= low_bit
+                cargo, seat = divmod(index, self.places_in_cargo)
+                yield cargo + 1, seat + 1
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.data)
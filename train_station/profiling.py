@@ -0,0 +1,154 @@
+"""Sampling profiler for slow requests.
+
+A daemon thread periodically samples the stacks of the threads that serve
+profiled requests. Profiles are written in the folded stack format, one
+``frame;frame;frame count`` line per distinct stack, which flamegraph.pl,
+speedscope and inferno render as flame graphs."""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+PROFILE_SUFFIX = ".folded"
+
+
+@lru_cache(maxsize=4096)
+def code_label(code) -> str:
+    path = "/".join(Path(code.co_filename).parts[-2:])
+    return f"{code.co_qualname} ({path}:{code.co_firstlineno})"
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    if code.co_name == "to_representation":
+        # Serializers and fields share DRF's to_representation, name the
+        # actual class so that nested serializers are told apart.
+        instance = frame.f_locals.get("self")
+        if instance is not None:
+            return f"{type(instance).__name__}.{code_label(code)}"
+    return code_label(code)
+
+
+def fold_stack(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Sample the stacks of registered threads every ``interval`` seconds.
+
+    The sampling thread only runs while at least one thread is
+    registered."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._thread = None
+
+    def start(self) -> None:
+        """Start sampling the current thread."""
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self) -> Counter:
+        """Stop sampling the current thread and return its stacks."""
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), Counter())
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._samples:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[fold_stack(frame)] += 1
+                del frames
+            time.sleep(self.interval)
+
+
+class ProfileStore:
+    """Profiles in a directory, the oldest are deleted once they take more
+    than ``max_bytes``."""
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def save(self, name: str, samples: Counter) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        base_name = f"{timestamp}-{name}-{os.getpid()}"
+        temporary = self.directory / f"{base_name}.tmp"
+        with temporary.open("w") as file:
+            for stack, count in samples.most_common():
+                file.write(f"{stack} {count}\n")
+        # Readers never see partially written profiles.
+        path = temporary.replace(
+            self.directory / f"{base_name}{PROFILE_SUFFIX}"
+        )
+        self.rotate()
+        return path
+
+    def _profiles(self) -> list:
+        profiles = []
+        for path in self.directory.glob(f"*{PROFILE_SUFFIX}"):
+            try:
+                profiles.append((path, path.stat()))
+            except FileNotFoundError:
+                # Deleted by another process in the meantime.
+                continue
+        return sorted(profiles, key=lambda profile: profile[1].st_mtime)
+
+    def rotate(self) -> None:
+        profiles = self._profiles()
+        total = sum(stat.st_size for _, stat in profiles)
+        for path, stat in profiles:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+
+    def list(self) -> list:
+        if not self.directory.is_dir():
+            return []
+        return [
+            {
+                "name": path.name,
+                "size": stat.st_size,
+                "created": datetime.fromtimestamp(stat.st_mtime),
+            }
+            for path, stat in reversed(self._profiles())
+        ]
+
+    def path(self, name: str) -> Path | None:
+        path = self.directory / name
+        if (
+            path.name != name
+            or path.suffix != PROFILE_SUFFIX
+            or not path.is_file()
+        ):
+            return None
+        return path
+
+
+def profile_store() -> ProfileStore:
+    return ProfileStore(settings.PROFILE_DIR, settings.PROFILE_DIR_MAX_BYTES)
@@ -0,0 +1,33 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+from train_station_service.middleware import serializer_timer
+
+ORJSON_OPTIONS = (
+    # Leave datetimes to DRF's encoder, which cuts them to milliseconds.
+    orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_NON_STR_KEYS
+)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Compact JSON rendered by orjson, which is several times faster than
+    the standard library encoder.
+
+    Types orjson does not handle natively go through DRF's encoder, so the
+    output matches ``JSONRenderer``. Indented output, requested with e.g.
+    ``Accept: application/json; indent=4``, is left to ``JSONRenderer``."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        with serializer_timer():
+            if self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(
+                    data, accepted_media_type, renderer_context
+                )
+            return orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=ORJSON_OPTIONS,
+            )
@@ -0,0 +1,200 @@
+"""Push of seat changes to clients watching a trip.
+
+Committed bookings and cancellations publish one event per trip with the
+seats taken and released, which a broker fans out to the subscribers of
+the trip, see ``async_views.trip_seat_events``. The broker is picked by
+``SEAT_EVENT_BROKER``: an in-process one by default, which only reaches
+subscribers of the process that wrote the tickets, or one relaying events
+through Redis pub/sub to every process."""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Put in the queue of a subscriber that fell too far behind, in place of
+# the events it missed.
+LAGGED = object()
+
+
+class Subscription:
+    """Queue of the events of one trip for one client, owned by the event
+    loop that serves the client."""
+
+    def __init__(self, trip_id, max_size):
+        self.trip_id = trip_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_size)
+
+    def put(self, event):
+        """Queue ``event``, or ``LAGGED`` once the queue is full. Must run
+        in the subscriber's event loop."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(LAGGED)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalSeatBroker:
+    """Fan out events to the subscribers of the current process.
+
+    Publishing is thread-safe and only schedules ``Subscription.put`` in
+    the subscribers' event loops, so it does not wait for slow clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, trip_id) -> Subscription:
+        """Subscribe to the events of a trip, from its event loop."""
+        subscription = Subscription(
+            trip_id, settings.SEAT_EVENTS_QUEUE_SIZE
+        )
+        with self._lock:
+            self._subscriptions[trip_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.trip_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.trip_id]
+
+    def subscriber_count(self, trip_id=None) -> int:
+        with self._lock:
+            if trip_id is not None:
+                return len(self._subscriptions.get(trip_id, ()))
+            return sum(map(len, self._subscriptions.values()))
+
+    def publish(self, trip_id, event):
+        self.dispatch(trip_id, event)
+
+    def dispatch(self, trip_id, event):
+        """Hand ``event`` to the subscribers of this process."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(trip_id, ()))
+        self._put(subscriptions, event)
+
+    def dispatch_all(self, event):
+        """Hand ``event`` to the subscribers of every trip."""
+        with self._lock:
+            subscriptions = [
+                subscription
+                for trip_subscriptions in self._subscriptions.values()
+                for subscription in trip_subscriptions
+            ]
+        self._put(subscriptions, event)
+
+    def _put(self, subscriptions, event):
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(
+                    subscription.put, event
+                )
+            except RuntimeError:
+                # The loop was closed, e.g. by a server shutting down.
+                self.unsubscribe(subscription)
+
+
+class RedisSeatBroker(LocalSeatBroker):
+    """Relay events through Redis pub/sub to the subscribers of every
+    process. Each process listens on one channel pattern in a daemon
+    thread, started by the first subscription."""
+
+    def __init__(self):
+        import redis
+
+        super().__init__()
+        self.redis = redis.Redis.from_url(
+            settings.SEAT_EVENTS_REDIS_URL, decode_responses=True
+        )
+        self.prefix = settings.SEAT_EVENTS_CHANNEL_PREFIX
+        self._listener = None
+
+    def subscribe(self, trip_id) -> Subscription:
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name="seat-events", daemon=True
+                )
+                self._listener.start()
+        return super().subscribe(trip_id)
+
+    def publish(self, trip_id, event):
+        self.redis.publish(f"{self.prefix}{trip_id}", json.dumps(event))
+
+    def _listen(self):
+        from redis.exceptions import RedisError
+
+        reconnecting = False
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{self.prefix}*")
+                if reconnecting:
+                    # Events published while disconnected are lost, so
+                    # every subscriber starts over from a new snapshot.
+                    logger.info("Seat event listener reconnected")
+                    self.dispatch_all(LAGGED)
+                    reconnecting = False
+                for message in pubsub.listen():
+                    self._dispatch_message(message)
+            except RedisError:
+                logger.exception("Seat event listener disconnected")
+                reconnecting = True
+                time.sleep(1)
+
+    def _dispatch_message(self, message):
+        try:
+            trip_id = int(message["channel"][len(self.prefix):])
+            event = json.loads(message["data"])
+        except ValueError:
+            logger.warning("Invalid seat event %r", message)
+            return
+        self.dispatch(trip_id, event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def seat_broker():
+    """Return the configured seat event broker of this process."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.SEAT_EVENT_BROKER)()
+    return _broker
+
+
+def _places(seats) -> list:
+    return [{"cargo": cargo, "seat": seat} for cargo, seat in sorted(seats)]
+
+
+def publish_seat_changes(changes):
+    """Publish the (taken, released) (cargo, seat) pairs of every trip of
+    ``changes``, once the transaction that made them is committed."""
+    broker = seat_broker()
+    for trip_id, (taken, released) in changes.items():
+        broker.publish(
+            trip_id,
+            {
+                "trip": trip_id,
+                "taken": _places(taken),
+                "released": _places(released),
+            },
+        )
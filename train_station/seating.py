@@ -0,0 +1,115 @@
+"""Automatic seat assignment.
+
+Seats are picked in memory from a trip's seat map and the seats held by
+seat holds, so booking a party only needs the locked trip row."""
+ADJACENT = "adjacent"
+FILL_FIRST = "fill_first"
+SPREAD = "spread"
+PREFERENCES = (ADJACENT, FILL_FIRST, SPREAD)
+
+
+def free_seats_by_cargo(seat_map, unavailable=()) -> dict:
+    """Return the free seat numbers of every cargo, in seat order."""
+    unavailable = set(unavailable)
+    return {
+        cargo: [
+            seat
+            for seat in range(1, seat_map.places_in_cargo + 1)
+            if not seat_map.is_taken(cargo, seat)
+            and (cargo, seat) not in unavailable
+        ]
+        for cargo in range(1, seat_map.cargo_num + 1)
+    }
+
+
+def _runs(seats):
+    """Split ascending seat numbers into runs of consecutive seats."""
+    runs = []
+    for seat in seats:
+        if runs and runs[-1][-1] + 1 == seat:
+            runs[-1].append(seat)
+        else:
+            runs.append([seat])
+    return runs
+
+
+def assign_adjacent(free, party_size):
+    """Seats of one cargo, consecutive if possible.
+
+    Takes the start of the shortest run of free seats that fits the party,
+    keeping longer runs for larger parties. Without such a run, takes the
+    closest group of free seats of one cargo."""
+    runs = [
+        (len(run), cargo, run[:party_size])
+        for cargo, seats in free.items()
+        for run in _runs(seats)
+        if len(run) >= party_size
+    ]
+    if runs:
+        _, cargo, seats = min(runs, key=lambda run: run[:2])
+        return [(cargo, seat) for seat in seats]
+
+    groups = [
+        (seats[start + party_size - 1] - seats[start], cargo, start)
+        for cargo, seats in free.items()
+        for start in range(len(seats) - party_size + 1)
+    ]
+    if not groups:
+        return None
+    _, cargo, start = min(groups)
+    return [
+        (cargo, seat) for seat in free[cargo][start:start + party_size]
+    ]
+
+
+def assign_fill_first(free, party_size):
+    """The first free seats in cargo and seat order."""
+    seats = [
+        (cargo, seat) for cargo, seats in free.items() for seat in seats
+    ]
+    if len(seats) < party_size:
+        return None
+    return seats[:party_size]
+
+
+def _distance(seat, occupied, places_in_cargo) -> int:
+    return min(
+        (abs(seat - other) for other in occupied), default=places_in_cargo
+    )
+
+
+def assign_spread(free, party_size, places_in_cargo):
+    """Seats in the emptiest cargos, each as far as possible from the
+    occupied seats of its cargo."""
+    if sum(len(seats) for seats in free.values()) < party_size:
+        return None
+    free = {cargo: set(seats) for cargo, seats in free.items()}
+    chosen = []
+    for _ in range(party_size):
+        cargo = max(free, key=lambda cargo: (len(free[cargo]), -cargo))
+        occupied = [
+            seat
+            for seat in range(1, places_in_cargo + 1)
+            if seat not in free[cargo]
+        ]
+        seat = max(
+            free[cargo],
+            key=lambda seat: (
+                _distance(seat, occupied, places_in_cargo),
+                -seat,
+            ),
+        )
+        free[cargo].remove(seat)
+        chosen.append((cargo, seat))
+    return sorted(chosen)
+
+
+def assign_seats(seat_map, party_size, preference, unavailable=()):
+    """Return ``party_size`` free (cargo, seat) pairs picked by
+    ``preference``, or None if the trip has no such seats."""
+    free = free_seats_by_cargo(seat_map, unavailable)
+    if preference == ADJACENT:
+        return assign_adjacent(free, party_size)
+    if preference == SPREAD:
+        return assign_spread(free, party_size, seat_map.places_in_cargo)
+    return assign_fill_first(free, party_size)
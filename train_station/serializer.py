@@ -1,7 +1,16 @@
-from django.db import transaction
+from datetime import date, datetime, timedelta
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Manager, Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from train_station.booking import auto_book, create_order, place_hold
+from train_station.exports import CONTENT_TYPES
+from train_station.holds import attach_held_seats, hold_store
+from train_station.seating import ADJACENT, PREFERENCES
 from train_station.models import (
     Crew,
     TrainType,
@@ -11,6 +20,8 @@ from train_station.models import (
     Station,
     Route,
     Order,
+    RouteDailyStats,
+    TrainDailyStats,
 )
 
 
@@ -34,6 +45,22 @@ class TrainSerializer(serializers.ModelSerializer):
             "image",
         )
 
+    def validate(self, attrs):
+        if self.instance is not None:
+            cargo_num = attrs.get("cargo_num", self.instance.cargo_num)
+            places_in_cargo = attrs.get(
+                "places_in_cargo", self.instance.places_in_cargo
+            )
+            outside = Ticket.objects.filter(trip__train=self.instance).filter(
+                Q(cargo__gt=cargo_num) | Q(seat__gt=places_in_cargo)
+            )
+            if outside.exists():
+                raise ValidationError(
+                    "Sold tickets of this train's trips have seats the new "
+                    "layout lacks."
+                )
+        return attrs
+
 
 class TrainImageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -65,13 +92,95 @@ class RouteListSerializer(RouteSerializer):
         fields = ("id", "source", "destination", "distance")
 
 
+class ValuesListSerializer:
+    """Read-only serializer of ``.values()`` rows for list actions.
+
+    ``values`` are the fetched columns and ``values_fields``, which every
+    subclass must set, maps every output key to a function of a row. This
+    skips DRF's field machinery, which dominates the cost of long lists, so
+    subclasses must keep producing the same output as the model serializer
+    they stand in for."""
+
+    values = ()
+    values_fields = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.values_fields:
+            raise ImproperlyConfigured(
+                f"{cls.__name__} must set values_fields."
+            )
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def get_rows(cls, queryset):
+        return queryset.values(*cls.values)
+
+    def prepare_rows(self, rows):
+        """Add data loaded once for all ``rows`` to each of them."""
+
+    @property
+    def data(self) -> list:
+        rows = list(self.rows)
+        self.prepare_rows(rows)
+        fields = tuple(self.values_fields.items())
+        return [{name: get(row) for name, get in fields} for row in rows]
+
+
+class RouteListValuesSerializer(ValuesListSerializer):
+    """Same output as ``RouteListSerializer``."""
+
+    values = ("id", "source__name", "destination__name", "distance_km")
+    values_fields = {
+        "id": itemgetter("id"),
+        "source": itemgetter("source__name"),
+        "destination": itemgetter("destination__name"),
+        "distance": lambda row: Route.format_distance(row["distance_km"]),
+    }
+
+
 class CrewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Crew
         fields = ("id", "first_name", "last_name")
 
 
+class TripPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Resolve trips from the batch prefetched by the parent list serializer
+    instead of issuing one query per ticket."""
+
+    def to_internal_value(self, data):
+        prefetched_trips = getattr(self.parent, "prefetched_trips", None)
+        if prefetched_trips and not isinstance(data, bool):
+            try:
+                return prefetched_trips[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class TicketBulkSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            trip_ids = {
+                int(item["trip"])
+                for item in data
+                if isinstance(item, dict)
+                and str(item.get("trip", "")).isdigit()
+            }
+            self.child.prefetched_trips = (
+                Trip.objects.select_related("train").in_bulk(trip_ids)
+            )
+        return super().to_internal_value(data)
+
+
 class TicketSerializer(serializers.ModelSerializer):
+    trip = TripPrimaryKeyRelatedField(
+        queryset=Trip.objects.select_related("train")
+    )
+
     def validate(self, attrs):
         data = super(TicketSerializer, self).validate(attrs=attrs)
         Ticket.validate_ticket(
@@ -85,6 +194,10 @@ class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = ("id", "cargo", "seat", "trip")
+        list_serializer_class = TicketBulkSerializer
+        # Seat conflicts are checked for the whole order at once
+        # in ``create_order`` instead of one query per ticket.
+        validators = []
 
 
 class TicketSeatsSerializer(TicketSerializer):
@@ -105,6 +218,37 @@ class TripSerializer(serializers.ModelSerializer):
             "arrival_time"
         )
 
+    def validate_train(self, train):
+        if self.instance is None or train.id == self.instance.train_id:
+            return train
+        outside = self.instance.tickets.filter(
+            Q(cargo__gt=train.cargo_num) | Q(seat__gt=train.places_in_cargo)
+        )
+        if outside.exists():
+            raise ValidationError(
+                "Sold tickets of this trip have seats the train lacks."
+            )
+        return train
+
+
+class HeldSeatsListSerializer(serializers.ListSerializer):
+    """Load the held seats of the trips of all listed items with one hold
+    store lookup instead of one per trip."""
+
+    def get_trips(self, items) -> list:
+        return items
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        attach_held_seats(
+            [
+                trip
+                for trip in self.get_trips(items)
+                if "held_seats" not in trip.__dict__
+            ]
+        )
+        return super().to_representation(items)
+
 
 class TripListSerializer(TripSerializer):
     train = serializers.CharField(source="train.name", read_only=True)
@@ -123,19 +267,280 @@ class TripListSerializer(TripSerializer):
             "distance",
             "tickets_available",
         )
+        list_serializer_class = HeldSeatsListSerializer
+
+
+class TripListValuesSerializer(ValuesListSerializer):
+    """Same output as ``TripListSerializer``."""
+
+    values = (
+        "id",
+        "departure_time",
+        "tickets_sold",
+        "train__name",
+        "train__cargo_num",
+        "train__places_in_cargo",
+        "route__source__name",
+        "route__destination__name",
+        "route__distance_km",
+    )
+
+    values_fields = {
+        "id": itemgetter("id"),
+        "train": itemgetter("train__name"),
+        "route": lambda row: Route.format_name(
+            row["route__source__name"], row["route__destination__name"]
+        ),
+        "distance": lambda row: Route.format_distance(
+            row["route__distance_km"]
+        ),
+        "tickets_available": lambda row: Trip.count_available(
+            row["train__cargo_num"] * row["train__places_in_cargo"],
+            row["tickets_sold"],
+            row["held_count"],
+        ),
+    }
+
+    def prepare_rows(self, rows):
+        held = hold_store().held_seats([row["id"] for row in rows])
+        for row in rows:
+            row["held_count"] = len(held.get(row["id"], ()))
 
 
 class TripDetailSerializer(TripSerializer):
     route = RouteListSerializer(many=False, read_only=True)
     train = TrainSerializer(many=False, read_only=True)
     crew = CrewSerializer(many=True, read_only=True)
-    taken_places = TicketSeatsSerializer(
-        source="tickets", many=True, read_only=True
+    taken_places = serializers.ListField(read_only=True)
+    held_places = serializers.ListField(read_only=True)
+
+    class Meta:
+        model = Trip
+        fields = (
+            "id",
+            "train",
+            "route",
+            "crew",
+            "taken_places",
+            "held_places",
+        )
+
+    def to_representation(self, instance):
+        if "held_seats" not in instance.__dict__:
+            attach_held_seats([instance])
+        return super().to_representation(instance)
+
+
+class TripAvailabilitySerializer(serializers.ModelSerializer):
+    tickets_available = serializers.IntegerField(read_only=True)
+    taken_places = serializers.ListField(read_only=True)
+    held_places = serializers.ListField(read_only=True)
+
+    class Meta:
+        model = Trip
+        fields = ("id", "tickets_available", "taken_places", "held_places")
+
+    def to_representation(self, instance):
+        if "held_seats" not in instance.__dict__:
+            attach_held_seats([instance])
+        return super().to_representation(instance)
+
+
+class JourneySearchSerializer(serializers.Serializer):
+    source = serializers.IntegerField()
+    destination = serializers.IntegerField()
+    departure = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=10, default=3)
+
+
+class TripAvailabilitySearchSerializer(serializers.Serializer):
+    ids = serializers.CharField()
+    cargo = serializers.BooleanField(default=False)
+
+    def validate_ids(self, value) -> list:
+        try:
+            ids = [int(trip_id) for trip_id in value.split(",") if trip_id]
+        except ValueError:
+            ids = None
+        if not ids:
+            raise ValidationError("Expected comma separated trip ids.")
+        max_ids = settings.TRIP_AVAILABILITY_MAX_IDS
+        if len(ids) > max_ids:
+            raise ValidationError(f"At most {max_ids} trip ids are allowed.")
+        return list(dict.fromkeys(ids))
+
+
+class ExportSerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(
+        choices=list(CONTENT_TYPES), default="ndjson"
+    )
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    route = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if attrs.get("date_to") and attrs.get("date_from") and (
+            attrs["date_to"] < attrs["date_from"]
+        ):
+            raise ValidationError(
+                {"date_to": "date_to must not be before date_from."}
+            )
+        return attrs
+
+
+class AnalyticsSearchSerializer(serializers.Serializer):
+    """Days of daily stats, the last 30 days by default."""
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        date_to = attrs.setdefault("date_to", date.today())
+        date_from = attrs.setdefault(
+            "date_from", date_to - timedelta(days=29)
+        )
+        if date_to < date_from:
+            raise ValidationError(
+                {"date_to": "date_to must not be before date_from."}
+            )
+        max_days = settings.ANALYTICS_MAX_DAYS
+        if (date_to - date_from).days >= max_days:
+            raise ValidationError(
+                {"date_from": f"At most {max_days} days are allowed."}
+            )
+        return attrs
+
+
+class RouteAnalyticsSearchSerializer(AnalyticsSearchSerializer):
+    route = serializers.IntegerField(min_value=1, required=False)
+
+
+class TrainAnalyticsSearchSerializer(AnalyticsSearchSerializer):
+    train = serializers.IntegerField(min_value=1, required=False)
+
+
+DAILY_STATS_FIELDS = (
+    "day",
+    "trips",
+    "seats",
+    "tickets_sold",
+    "occupancy",
+    "orders",
+    "passenger_km",
+)
+
+
+class RouteDailyStatsSerializer(serializers.ModelSerializer):
+    occupancy = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = RouteDailyStats
+        fields = ("route", *DAILY_STATS_FIELDS)
+
+
+class TrainDailyStatsSerializer(RouteDailyStatsSerializer):
+    class Meta:
+        model = TrainDailyStats
+        fields = ("train", *DAILY_STATS_FIELDS)
+
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class TimetableTripSerializer(serializers.Serializer):
+    """One trip of an imported timetable, validated without queries."""
+
+    route = serializers.IntegerField(min_value=1)
+    train = serializers.IntegerField(min_value=1)
+    departure_time = serializers.DateTimeField()
+    arrival_time = serializers.DateTimeField()
+    crew = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), default=list
+    )
+
+    def validate(self, attrs):
+        if attrs["arrival_time"] <= attrs["departure_time"]:
+            raise ValidationError(
+                {"arrival_time": "Arrival must be after departure."}
+            )
+        return attrs
+
+
+class TimetableRuleSerializer(serializers.Serializer):
+    """Trips of a route and train recurring on ``days`` of the week, e.g.
+    departing at 08:15 on "Mon-Fri" from ``start_date`` to ``end_date``.
+    Arrivals at or before the departure time are on the next day."""
+
+    route = serializers.IntegerField(min_value=1)
+    train = serializers.IntegerField(min_value=1)
+    departure = serializers.TimeField()
+    arrival = serializers.TimeField()
+    days = serializers.CharField(default="daily")
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    crew = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), default=list
+    )
+
+    def validate_days(self, value) -> frozenset:
+        """Parse "daily", "Mon-Fri", "Sat,Sun" or "Mon-Wed,Fri" into
+        weekday numbers."""
+        value = value.strip().lower().replace("\u2013", "-")
+        if value == "daily":
+            return frozenset(range(7))
+
+        weekdays = set()
+        try:
+            for part in value.split(","):
+                first, _, last = part.strip().partition("-")
+                start = WEEKDAYS.index(first.strip()[:3])
+                end = WEEKDAYS.index(last.strip()[:3]) if last else start
+                # Ranges may wrap around the week, e.g. "Fri-Mon".
+                weekdays.update(
+                    (start + offset) % 7
+                    for offset in range((end - start) % 7 + 1)
+                )
+        except ValueError:
+            raise ValidationError(
+                'Use "daily" or weekdays such as "Mon-Fri" or "Sat,Sun".'
+            )
+        return frozenset(weekdays)
+
+    def validate(self, attrs):
+        if attrs["end_date"] < attrs["start_date"]:
+            raise ValidationError(
+                {"end_date": "end_date must not be before start_date."}
+            )
+        return attrs
+
+
+class JourneyLegSerializer(TripSerializer):
+    route = serializers.CharField(source="route.name", read_only=True)
+    source = serializers.CharField(source="route.source", read_only=True)
+    destination = serializers.CharField(
+        source="route.destination", read_only=True
     )
+    tickets_available = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Trip
-        fields = ("id", "train", "route", "crew", "taken_places")
+        fields = (
+            "id",
+            "route",
+            "source",
+            "destination",
+            "departure_time",
+            "arrival_time",
+            "tickets_available",
+        )
+
+
+class JourneySerializer(serializers.Serializer):
+    departure_time = serializers.DateTimeField(read_only=True)
+    arrival_time = serializers.DateTimeField(read_only=True)
+    transfers = serializers.IntegerField(read_only=True)
+    tickets_available = serializers.IntegerField(read_only=True)
+    legs = JourneyLegSerializer(many=True, read_only=True)
 
 
 class TicketListSerializer(TicketSerializer):
@@ -150,13 +555,108 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ("id", "tickets", "created_at")
 
     def create(self, validated_data):
-        with transaction.atomic():
-            tickets_data = validated_data.pop("tickets")
-            order = Order.objects.create(**validated_data)
-            for ticket_data in tickets_data:
-                Ticket.objects.create(order=order, **ticket_data)
-            return order
+        tickets_data = validated_data.pop("tickets")
+        return create_order(tickets_data, **validated_data)
+
+
+class OrderAutoAssignSerializer(serializers.Serializer):
+    """Order of ``party_size`` seats of a trip picked by the server."""
+
+    trip = serializers.IntegerField(min_value=1, write_only=True)
+    party_size = serializers.IntegerField(min_value=1, write_only=True)
+    preference = serializers.ChoiceField(
+        choices=PREFERENCES, default=ADJACENT, write_only=True
+    )
+
+    def validate_party_size(self, value):
+        max_party_size = settings.AUTO_ASSIGN_MAX_PARTY_SIZE
+        if value > max_party_size:
+            raise ValidationError(
+                f"At most {max_party_size} seats are assigned at once."
+            )
+        return value
+
+    def create(self, validated_data):
+        return auto_book(
+            validated_data.pop("trip"),
+            validated_data.pop("party_size"),
+            validated_data.pop("preference"),
+            **validated_data,
+        )
+
+    def to_representation(self, instance):
+        return OrderSerializer(instance).data
+
+
+class SeatHoldSerializer(serializers.Serializer):
+    tickets = TicketSerializer(many=True, allow_empty=False)
+
+    def create(self, validated_data):
+        return place_hold(
+            validated_data["tickets"], validated_data["user_id"]
+        )
+
+    def to_representation(self, instance):
+        return {
+            "id": instance.id,
+            "expires_at": serializers.DateTimeField().to_representation(
+                datetime.fromtimestamp(instance.expires_at)
+            ),
+            "tickets": [
+                {"trip": trip_id, "cargo": cargo, "seat": seat}
+                for trip_id, cargo, seat in instance.seats
+            ],
+        }
+
+
+class OrderHeldSeatsListSerializer(HeldSeatsListSerializer):
+    def get_trips(self, items) -> list:
+        return [
+            ticket.trip for order in items for ticket in order.tickets.all()
+        ]
 
 
 class OrderListSerializer(OrderSerializer):
     tickets = TicketListSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ("id", "tickets", "created_at")
+        list_serializer_class = OrderHeldSeatsListSerializer
+
+
+class TicketCompactSerializer(serializers.ModelSerializer):
+    route = serializers.CharField(source="trip.route.name", read_only=True)
+    departure_time = serializers.DateTimeField(
+        source="trip.departure_time", read_only=True
+    )
+
+    class Meta:
+        model = Ticket
+        fields = ("id", "trip", "route", "departure_time", "cargo", "seat")
+        read_only_fields = fields
+
+
+class OrderCompactSerializer(serializers.ModelSerializer):
+    tickets = TicketCompactSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ("id", "tickets", "created_at")
+
+
+class TripCompactSerializer(TripSerializer):
+    train = serializers.CharField(source="train.name", read_only=True)
+    route = serializers.CharField(source="route.name", read_only=True)
+    distance = serializers.ReadOnlyField(source="route.distance")
+
+    class Meta:
+        model = Trip
+        fields = (
+            "id",
+            "train",
+            "route",
+            "distance",
+            "departure_time",
+            "arrival_time",
+        )
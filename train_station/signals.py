@@ -0,0 +1,70 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from train_station.cache import invalidate_model
+from train_station.journeys import planner
+from train_station.models import (
+    Crew,
+    Order,
+    Route,
+    Station,
+    Ticket,
+    Train,
+    TrainType,
+    Trip,
+)
+
+CATALOG_MODELS = (Crew, Route, Station, Train, TrainType)
+
+
+def _is_ticket_deletion(origin) -> bool:
+    if isinstance(origin, QuerySet):
+        return origin.model is Ticket
+    return isinstance(origin, Ticket)
+
+
+@receiver(post_delete, sender=Ticket)
+def release_ticket_seat(sender, instance, origin=None, **kwargs):
+    # Tickets deleted along with their order are released in one batch by
+    # ``release_order_seats``, and those deleted along with their trip
+    # leave no seat map to update.
+    if not _is_ticket_deletion(origin):
+        return
+    Trip.update_seat_maps(
+        released=[(instance.trip_id, instance.cargo, instance.seat)]
+    )
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_seats(sender, instance, **kwargs):
+    released = list(
+        Ticket.objects.filter(order=instance).values_list(
+            "trip_id", "cargo", "seat"
+        )
+    )
+    if released:
+        Trip.update_seat_maps(released=released)
+
+
+@receiver(post_save, sender=Trip)
+def update_journey_planner_trip(sender, instance, **kwargs):
+    planner.update_trip(instance)
+
+
+@receiver(post_delete, sender=Trip)
+def remove_journey_planner_trip(sender, instance, **kwargs):
+    planner.remove_trip(instance.id)
+
+
+@receiver(post_save, sender=Route)
+def reload_journey_planner(sender, instance, created, **kwargs):
+    if not created:
+        planner.invalidate()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_catalog_cache(sender, **kwargs):
+    if sender in CATALOG_MODELS:
+        invalidate_model(sender)
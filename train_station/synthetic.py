@@ -0,0 +1,244 @@
+"""Bulk generation of a synthetic train network for benchmarks and
+load tests.
+
+Station popularity follows a Zipf-like distribution, so a few hub
+stations get most routes and bookings. Departures cluster around morning
+and evening peaks, trip duration follows route distance and most orders
+are for one or two passengers with occasional group bookings."""
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from train_station.geo import haversine
+from train_station.models import (
+    Crew,
+    Order,
+    Route,
+    Station,
+    Ticket,
+    Train,
+    TrainType,
+    Trip,
+)
+from train_station.occupancy import SeatMap
+
+BATCH_SIZE = 10_000
+AVERAGE_SPEED_KMH = 80
+TRAIN_TYPES = ("Regional", "Intercity", "Night", "Express")
+PARTY_SIZES = (1, 2, 3, 4, 6, 10)
+PARTY_SIZE_WEIGHTS = (60, 25, 7, 5, 2, 1)
+
+
+def _zipf_cum_weights(count, exponent=1.1):
+    return list(
+        accumulate(1 / rank ** exponent for rank in range(1, count + 1))
+    )
+
+
+def _departure_minute(rng):
+    """Minute of the day, clustered around the 8:00 and 18:00 peaks."""
+    if rng.random() < 0.3:
+        minute = rng.randrange(5 * 60, 23 * 60)
+    else:
+        peak = rng.choice((8 * 60, 18 * 60))
+        minute = int(rng.gauss(peak, 90))
+    return min(max(minute, 0), 24 * 60 - 1)
+
+
+def create_stations(rng, count, prefix="Station"):
+    return Station.objects.bulk_create(
+        (
+            Station(
+                name=f"{prefix} {number}",
+                latitude=rng.uniform(44.5, 52.0),
+                longitude=rng.uniform(22.5, 40.0),
+            )
+            for number in range(count)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def create_routes(rng, stations, count):
+    """Create up to ``count`` routes between distinct new stations,
+    picking popular stations more often."""
+    cum_weights = _zipf_cum_weights(len(stations))
+    pairs = set()
+    for _ in range(count * 20):
+        if len(pairs) >= count:
+            break
+        source, destination = rng.choices(
+            stations, cum_weights=cum_weights, k=2
+        )
+        if source != destination:
+            pairs.add((source, destination))
+
+    return Route.objects.bulk_create(
+        (
+            Route(
+                source=source,
+                destination=destination,
+                distance_km=haversine(
+                    source.latitude,
+                    source.longitude,
+                    destination.latitude,
+                    destination.longitude,
+                ),
+            )
+            for source, destination in pairs
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def create_trains(rng, count, prefix="Train"):
+    """Create trains with distinct (cargo_num, places_in_cargo) sizes."""
+    train_types = [
+        TrainType.objects.get_or_create(name=name)[0] for name in TRAIN_TYPES
+    ]
+    taken_sizes = set(
+        Train.objects.values_list("cargo_num", "places_in_cargo")
+    )
+    sizes = [
+        (cargo_num, places_in_cargo)
+        for cargo_num in range(4, 21)
+        for places_in_cargo in range(30, 81)
+        if (cargo_num, places_in_cargo) not in taken_sizes
+    ]
+    return Train.objects.bulk_create(
+        Train(
+            name=f"{prefix} {number}",
+            cargo_num=cargo_num,
+            places_in_cargo=places_in_cargo,
+            train_type=rng.choice(train_types),
+        )
+        for number, (cargo_num, places_in_cargo) in enumerate(
+            rng.sample(sizes, min(count, len(sizes)))
+        )
+    )
+
+
+def create_crew(rng, count):
+    first_names = ("Olena", "Taras", "Iryna", "Andrii", "Maria", "Petro")
+    last_names = ("Kovalenko", "Bondar", "Shevchenko", "Melnyk", "Tkachuk")
+    return Crew.objects.bulk_create(
+        Crew(
+            first_name=rng.choice(first_names),
+            last_name=rng.choice(last_names),
+        )
+        for _ in range(count)
+    )
+
+
+def create_trips(rng, routes, trains, count, start, days):
+    """Create ``count`` trips over ``days`` days from ``start`` and return
+    (trip id, cargo_num, places_in_cargo) tuples of the created trips."""
+    cum_weights = _zipf_cum_weights(len(routes))
+    first_day = datetime.combine(start, datetime.min.time())
+    created = []
+    for offset in range(0, count, BATCH_SIZE):
+        batch = []
+        for _ in range(min(BATCH_SIZE, count - offset)):
+            route = rng.choices(routes, cum_weights=cum_weights)[0]
+            departure = first_day + timedelta(
+                days=rng.randrange(days), minutes=_departure_minute(rng)
+            )
+            duration = route.distance_km / AVERAGE_SPEED_KMH * 60
+            batch.append(
+                Trip(
+                    route=route,
+                    train=rng.choice(trains),
+                    departure_time=departure,
+                    arrival_time=departure
+                    + timedelta(minutes=max(15, round(duration))),
+                )
+            )
+        Trip.objects.bulk_create(batch)
+        created += [
+            (trip.id, trip.train.cargo_num, trip.train.places_in_cargo)
+            for trip in batch
+        ]
+    return created
+
+
+def create_users(count, password, prefix="user"):
+    password_hash = make_password(password)
+    return get_user_model().objects.bulk_create(
+        (
+            get_user_model()(
+                email=f"{prefix}{number}@example.com",
+                password=password_hash,
+            )
+            for number in range(count)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def create_orders(rng, users, trips, count, start):
+    """Create ``count`` orders with tickets on ``trips`` (tuples returned
+    by ``create_trips``) and keep the trips' seat maps in sync. A few
+    trips get most bookings and may sell out. Return the number of
+    created tickets."""
+    cum_weights = _zipf_cum_weights(len(trips), exponent=0.8)
+    seat_maps = {}
+    tickets = []
+    orders = []
+    created_at = []
+
+    for _ in range(count):
+        trip_id, cargo_num, places_in_cargo = rng.choices(
+            trips, cum_weights=cum_weights
+        )[0]
+        if trip_id not in seat_maps:
+            seat_maps[trip_id] = SeatMap(cargo_num, places_in_cargo)
+        seat_map = seat_maps[trip_id]
+        party_size = rng.choices(PARTY_SIZES, PARTY_SIZE_WEIGHTS)[0]
+        if seat_map.free_count < party_size:
+            continue
+
+        # Parties sit together, starting from a random cargo.
+        first_cargo = rng.randrange(cargo_num)
+        seats = []
+        for index in range(cargo_num * places_in_cargo):
+            cargo = (first_cargo + index // places_in_cargo) % cargo_num + 1
+            seat = index % places_in_cargo + 1
+            if not seat_map.is_taken(cargo, seat):
+                seat_map.take(cargo, seat)
+                seats.append((cargo, seat))
+                if len(seats) == party_size:
+                    break
+
+        order = Order(user=rng.choice(users))
+        orders.append(order)
+        created_at.append(
+            datetime.combine(start, datetime.min.time())
+            - timedelta(minutes=rng.randrange(60 * 24 * 30))
+        )
+        tickets += [
+            Ticket(order=order, trip_id=trip_id, cargo=cargo, seat=seat)
+            for cargo, seat in seats
+        ]
+
+    Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+    # created_at is auto_now_add, so the order history is spread over
+    # the past month after insertion.
+    for order, order_created_at in zip(orders, created_at):
+        order.created_at = order_created_at
+    Order.objects.bulk_update(orders, ["created_at"], batch_size=BATCH_SIZE)
+    Ticket.objects.bulk_create(tickets, batch_size=BATCH_SIZE)
+    Trip.objects.bulk_update(
+        [
+            Trip(
+                id=trip_id,
+                occupancy=seat_map.to_bytes(),
+                tickets_sold=seat_map.taken_count,
+            )
+            for trip_id, seat_map in seat_maps.items()
+        ],
+        ["occupancy", "tickets_sold"],
+        batch_size=BATCH_SIZE,
+    )
+    return len(tickets)
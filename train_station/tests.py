@@ -1,22 +1,97 @@
+import asyncio
+import csv
+import json
 import tempfile
 import os
+import uuid
+import random
+import sys
+import threading
+import time
 
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
 from PIL import Image
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.test import (
+    AsyncClient,
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from asgiref.sync import sync_to_async
 from rest_framework.test import APIClient
-from rest_framework import status
+from rest_framework import serializers, status
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
 
-from train_station.models import Train, TrainType, Route, Station, Trip
-from train_station.serializer import TrainSerializer, TripDetailSerializer
+from train_station.models import (
+    Crew,
+    Order,
+    Train,
+    TrainType,
+    Route,
+    Station,
+    Trip,
+    Ticket,
+    RouteDailyStats,
+    TrainDailyStats,
+)
+from train_station import analytics, booking
+from train_station.distance_matrix import (
+    KEEP_VERSIONS,
+    StationDistanceMatrix,
+    build_station_distance_matrix,
+)
+from train_station.exports import Export
+from train_station.holds import CacheHoldStore, LocalHoldStore, hold_store
+from train_station.journeys import planner
+from train_station.loadtest import LoadTestResult
+from train_station.occupancy import SeatMap
+from train_station.profiling import ProfileStore, StackSampler, fold_stack
+from train_station.renderers import ORJSONRenderer
+from train_station.seat_events import LAGGED, RedisSeatBroker, seat_broker
+from train_station.seating import assign_seats
+from train_station.serializer import (
+    RouteListSerializer,
+    RouteListValuesSerializer,
+    TimetableRuleSerializer,
+    TrainSerializer,
+    TripDetailSerializer,
+    TripListSerializer,
+    TripListValuesSerializer,
+    ValuesListSerializer,
+)
+from train_station.views import RouteViewSet, TripViewSet
+from train_station_service.metrics import MetricsRegistry, registry
 
 
 TRAIN_URL = reverse("train_station:train-list")
+STATION_URL = reverse("train_station:station-list")
 TRIP_URL = reverse("train_station:trip-list")
+ROUTE_URL = reverse("train_station:route-list")
+JOURNEY_URL = reverse("train_station:journey-list")
+ORDER_URL = reverse("train_station:order-list")
+HOLD_URL = reverse("train_station:hold-list")
 
 
 def sample_train_type():
@@ -209,3 +284,2621 @@ class TrainImageUploadTests(TestCase):
         res = self.client.delete(url)
 
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OrderBookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "booking@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip()
+
+    def book(self, seats):
+        payload = {
+            "tickets": [
+                {"trip": self.trip.id, "cargo": cargo, "seat": seat}
+                for cargo, seat in seats
+            ]
+        }
+        return self.client.post(ORDER_URL, payload, format="json")
+
+    def test_create_order_with_tickets(self):
+        res = self.book([(1, 1), (1, 2), (2, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data["tickets"]), 3)
+        self.assertEqual(
+            set(Ticket.objects.values_list("cargo", "seat")),
+            {(1, 1), (1, 2), (2, 1)},
+        )
+
+    def test_group_booking_query_count_does_not_grow(self):
+        with CaptureQueriesContext(connection) as small_order:
+            self.book([(1, seat) for seat in range(1, 3)])
+        with CaptureQueriesContext(connection) as group_order:
+            self.book([(2, seat) for seat in range(1, 21)])
+
+        self.assertEqual(len(group_order), len(small_order))
+        self.assertEqual(Ticket.objects.count(), 22)
+
+    def test_taken_seat_conflict(self):
+        self.book([(1, 1)])
+        res = self.book([(1, 2), (1, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            res.data["seats"],
+            [{"trip": self.trip.id, "cargo": 1, "seat": 1}],
+        )
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_seat_sold_outside_seat_map_conflict(self):
+        order = Order.objects.create(user=self.user)
+        Ticket.objects.bulk_create(
+            [Ticket(order=order, trip=self.trip, cargo=1, seat=1)]
+        )
+
+        res = self.book([(1, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            res.data["seats"],
+            [{"trip": self.trip.id, "cargo": 1, "seat": 1}],
+        )
+
+    def test_duplicate_seat_in_request_rejected(self):
+        res = self.book([(1, 1), (1, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_seat_out_of_train_range_rejected(self):
+        res = self.book([(11, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ticket.objects.exists())
+
+
+class SeatMapTests(TestCase):
+    def test_take_and_release_seats(self):
+        seat_map = SeatMap(cargo_num=3, places_in_cargo=7)
+        seat_map.take(2, 7)
+        seat_map.take(1, 1)
+        seat_map.take(3, 4)
+        seat_map.release(1, 1)
+
+        self.assertTrue(seat_map.is_taken(2, 7))
+        self.assertFalse(seat_map.is_taken(1, 1))
+        self.assertEqual(list(seat_map.taken_seats()), [(2, 7), (3, 4)])
+        self.assertEqual(seat_map.free_count, 19)
+
+    def test_round_trip_through_bytes(self):
+        seat_map = SeatMap(cargo_num=10, places_in_cargo=50)
+        seat_map.take(10, 50)
+        restored = SeatMap(10, 50, seat_map.to_bytes())
+
+        self.assertEqual(list(restored.taken_seats()), [(10, 50)])
+
+    def test_seat_out_of_range(self):
+        seat_map = SeatMap(cargo_num=2, places_in_cargo=2)
+
+        with self.assertRaises(IndexError):
+            seat_map.take(3, 1)
+
+
+class TripOccupancyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "occupancy@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip()
+
+    def book(self, seats):
+        return self.client.post(
+            ORDER_URL,
+            {
+                "tickets": [
+                    {"trip": self.trip.id, "cargo": cargo, "seat": seat}
+                    for cargo, seat in seats
+                ]
+            },
+            format="json",
+        )
+
+    def test_detail_taken_places_follow_bookings(self):
+        self.book([(2, 3), (1, 5)])
+        res = self.client.get(detail_url(self.trip.id))
+
+        self.assertEqual(
+            res.data["taken_places"],
+            [{"cargo": 1, "seat": 5}, {"cargo": 2, "seat": 3}],
+        )
+
+    def test_list_tickets_available_follow_bookings(self):
+        self.book([(1, 1), (1, 2)])
+        res = self.client.get(TRIP_URL)
+
+        self.assertEqual(res.data["results"][0]["tickets_available"], 498)
+
+    def test_deleted_ticket_releases_seat(self):
+        self.book([(1, 1), (1, 2)])
+        Ticket.objects.get(cargo=1, seat=1).delete()
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.taken_places, [{"cargo": 1, "seat": 2}])
+
+    def test_ticket_save_moves_seat(self):
+        self.book([(1, 1)])
+        ticket = Ticket.objects.get()
+        ticket.seat = 9
+        ticket.save()
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.taken_places, [{"cargo": 1, "seat": 9}])
+
+    def test_tickets_sold_counter_follows_bookings(self):
+        self.book([(1, 1), (1, 2), (3, 3)])
+        Ticket.objects.get(cargo=1, seat=2).delete()
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.tickets_sold, 2)
+        self.assertEqual(self.trip.tickets_available, 498)
+
+    def test_rebuild_trip_occupancy_command(self):
+        self.book([(1, 1), (2, 2)])
+        Trip.objects.update(occupancy=b"", tickets_sold=0)
+
+        call_command("rebuild_trip_occupancy", stdout=StringIO())
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.tickets_sold, 2)
+        self.assertEqual(
+            self.trip.taken_places,
+            [{"cargo": 1, "seat": 1}, {"cargo": 2, "seat": 2}],
+        )
+
+    def test_detail_query_count_does_not_depend_on_sold_seats(self):
+        with CaptureQueriesContext(connection) as empty_trip:
+            self.client.get(detail_url(self.trip.id))
+        self.book([(cargo, seat) for cargo in range(1, 11) for seat in (1, 2)])
+        with CaptureQueriesContext(connection) as popular_trip:
+            res = self.client.get(detail_url(self.trip.id))
+
+        self.assertEqual(len(res.data["taken_places"]), 20)
+        self.assertEqual(len(popular_trip), len(empty_trip))
+
+    def test_order_delete_releases_seats_in_one_batch(self):
+        def delete_order(seats):
+            self.book(seats)
+            order = Order.objects.latest("id")
+            with CaptureQueriesContext(connection) as queries:
+                order.delete()
+            return len(queries)
+
+        one_ticket = delete_order([(1, 1)])
+        many_tickets = delete_order(
+            [(cargo, seat) for cargo in range(1, 5) for seat in range(1, 6)]
+        )
+        self.trip.refresh_from_db()
+
+        self.assertEqual(many_tickets, one_ticket)
+        self.assertEqual(self.trip.tickets_sold, 0)
+        self.assertEqual(self.trip.taken_places, [])
+
+    def test_ticket_queryset_delete_releases_seats(self):
+        self.book([(1, 1), (1, 2), (2, 1)])
+        Ticket.objects.filter(cargo=1).delete()
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.taken_places, [{"cargo": 2, "seat": 1}])
+
+    def test_trip_delete_does_not_update_seat_maps(self):
+        self.book([(cargo, seat) for cargo in (1, 2) for seat in (1, 2)])
+        with CaptureQueriesContext(connection) as queries:
+            self.trip.delete()
+
+        self.assertFalse(
+            [
+                query
+                for query in queries
+                if query["sql"].startswith('UPDATE "train_station_trip"')
+            ]
+        )
+
+    def test_train_change_rebuilds_seat_map(self):
+        self.book([(2, 5)])
+        self.trip.train = sample_train(
+            name="Longer cargos", cargo_num=4, places_in_cargo=60
+        )
+        self.trip.save()
+
+        self.assertEqual(self.trip.taken_places, [{"cargo": 2, "seat": 5}])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.taken_places, [{"cargo": 2, "seat": 5}])
+        self.assertEqual(self.trip.tickets_sold, 1)
+
+    def test_stale_trip_save_keeps_bookings(self):
+        stale_trip = Trip.objects.get(id=self.trip.id)
+        self.book([(1, 1), (1, 2)])
+        stale_trip.arrival_time += timedelta(minutes=5)
+        stale_trip.save()
+        self.trip.refresh_from_db()
+
+        self.assertEqual(self.trip.arrival_time, stale_trip.arrival_time)
+        self.assertEqual(self.trip.tickets_sold, 2)
+        self.assertEqual(
+            self.trip.taken_places,
+            [{"cargo": 1, "seat": 1}, {"cargo": 1, "seat": 2}],
+        )
+
+    def test_train_resize_rebuilds_seat_maps(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.book([(2, 1)])
+        url = reverse("train_station:train-detail", args=[self.trip.train_id])
+
+        res = self.client.patch(url, {"places_in_cargo": 60}, format="json")
+        self.trip.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.trip.taken_places, [{"cargo": 2, "seat": 1}])
+        self.assertEqual(self.trip.tickets_available, 599)
+
+        res = self.client.patch(url, {"cargo_num": 1}, format="json")
+        self.trip.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.trip.taken_places, [{"cargo": 2, "seat": 1}])
+
+    def test_train_change_refused_for_seats_the_train_lacks(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.book([(5, 1)])
+        train = sample_train(name="Short", cargo_num=4, places_in_cargo=60)
+
+        res = self.client.patch(
+            detail_url(self.trip.id), {"train": train.id}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.taken_places, [{"cargo": 5, "seat": 1}])
+
+
+class RouteDistanceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "distance@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.route = sample_trip().route
+
+    def test_distance_stored_on_save(self):
+        self.assertAlmostEqual(self.route.distance_km, 178.7, places=1)
+        self.assertEqual(self.route.distance, "179 km")
+
+    def test_station_move_recomputes_distance(self):
+        station = self.route.destination
+        station.latitude = self.route.source.latitude
+        station.longitude = self.route.source.longitude
+        station.save()
+        self.route.refresh_from_db()
+
+        self.assertEqual(self.route.distance, "0 km")
+
+    def test_recompute_distances_invalidates_route_list(self):
+        self.client.get(ROUTE_URL)
+        source = self.route.source
+        Station.objects.filter(id=self.route.destination_id).update(
+            latitude=source.latitude, longitude=source.longitude
+        )
+        Route.recompute_distances()
+        res = self.client.get(ROUTE_URL)
+
+        self.assertEqual(res.data["results"][0]["distance"], "0 km")
+
+    def test_route_list_distance_without_extra_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(ROUTE_URL)
+
+        self.assertEqual(res.data["results"][0]["distance"], "179 km")
+        self.assertEqual(len(queries), 1)
+
+
+class StationDistanceMatrixTests(TestCase):
+    def setUp(self):
+        self.route = sample_trip().route
+        self.far_station = Station.objects.create(
+            name="Far station", latitude=-33.86, longitude=151.21
+        )
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "distances.npy")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_matrix_matches_route_distance(self):
+        build_station_distance_matrix(self.path)
+        matrix = StationDistanceMatrix.load(self.path)
+        source_id = self.route.source_id
+        destination_id = self.route.destination_id
+
+        self.assertEqual(len(matrix), 3)
+        self.assertAlmostEqual(
+            matrix.distance(source_id, destination_id),
+            self.route.distance_km,
+            places=2,
+        )
+        self.assertEqual(
+            matrix.distance(source_id, destination_id),
+            matrix.distance(destination_id, source_id),
+        )
+        self.assertEqual(matrix.distance(source_id, source_id), 0)
+
+    def test_command_writes_matrix(self):
+        call_command(
+            "build_distance_matrix", output=self.path, stdout=StringIO()
+        )
+        matrix = StationDistanceMatrix.load(self.path)
+
+        self.assertGreater(
+            matrix.distance(self.route.source_id, self.far_station.id), 10000
+        )
+
+    def test_rebuild_swaps_matrix_and_ids_together(self):
+        old_matrix = build_station_distance_matrix(self.path)
+        new_station = Station.objects.create(
+            name="New station", latitude=10, longitude=10
+        )
+        for _ in range(3):
+            build_station_distance_matrix(self.path)
+        matrix = StationDistanceMatrix.load(self.path)
+
+        self.assertEqual(len(old_matrix), 3)
+        self.assertEqual(len(matrix), 4)
+        self.assertEqual(matrix.distance(new_station.id, new_station.id), 0)
+        self.assertEqual(
+            len(os.listdir(self.tmp_dir.name)), 1 + 1 + KEEP_VERSIONS
+        )
+
+
+class JourneySearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        planner.invalidate()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "journey@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.train = sample_train()
+        self.station_a, self.station_b, self.station_c = (
+            Station.objects.create(name=name, latitude=50, longitude=lon)
+            for name, lon in (("A", 30), ("B", 31), ("C", 32))
+        )
+        self.a_to_b = Route.objects.create(
+            source=self.station_a, destination=self.station_b
+        )
+        self.b_to_c = Route.objects.create(
+            source=self.station_b, destination=self.station_c
+        )
+        self.a_to_c = Route.objects.create(
+            source=self.station_a, destination=self.station_c
+        )
+        self.day = datetime(2030, 1, 1)
+
+    def add_trip(self, route, departure, arrival):
+        return Trip.objects.create(
+            route=route,
+            train=self.train,
+            departure_time=self.day + departure,
+            arrival_time=self.day + arrival,
+        )
+
+    def search(self, **params):
+        return self.client.get(
+            JOURNEY_URL,
+            {
+                "source": self.station_a.id,
+                "destination": self.station_c.id,
+                "departure": self.day.isoformat(),
+                **params,
+            },
+        )
+
+    def test_journey_with_change_respects_transfer_time(self):
+        first_leg = self.add_trip(
+            self.a_to_b, timedelta(hours=8), timedelta(hours=9)
+        )
+        self.add_trip(
+            self.b_to_c,
+            timedelta(hours=9, minutes=5),
+            timedelta(hours=10),
+        )
+        second_leg = self.add_trip(
+            self.b_to_c,
+            timedelta(hours=9, minutes=30),
+            timedelta(hours=10, minutes=30),
+        )
+        self.add_trip(self.a_to_c, timedelta(hours=8), timedelta(hours=12))
+
+        res = self.search(limit=1)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]["transfers"], 1)
+        self.assertEqual(
+            [leg["id"] for leg in res.data[0]["legs"]],
+            [first_leg.id, second_leg.id],
+        )
+        self.assertEqual(res.data[0]["tickets_available"], 500)
+
+    def test_later_journeys_are_listed(self):
+        self.add_trip(self.a_to_c, timedelta(hours=8), timedelta(hours=12))
+        later = self.add_trip(
+            self.a_to_c, timedelta(hours=14), timedelta(hours=18)
+        )
+
+        res = self.search(limit=3)
+
+        self.assertEqual(len(res.data), 2)
+        self.assertEqual(res.data[1]["legs"][0]["id"], later.id)
+
+    def test_planner_follows_trip_changes(self):
+        self.search()
+        trip = self.add_trip(
+            self.a_to_c, timedelta(hours=8), timedelta(hours=12)
+        )
+        self.assertEqual(len(self.search().data), 1)
+
+        trip.delete()
+        self.assertEqual(self.search().data, [])
+
+    def test_search_requires_stations(self):
+        res = self.client.get(JOURNEY_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EndpointQueryBudgetTests(TestCase):
+    """Upper bounds of queries and time per endpoint, so that N+1
+    regressions fail the test suite."""
+
+    def setUp(self):
+        cache.clear()
+        planner.invalidate()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "budget@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+
+        self.trip = sample_trip()
+        crew = [
+            Crew.objects.create(first_name=f"Driver{i}", last_name="Test")
+            for i in range(3)
+        ]
+        self.trip.crew.set(crew)
+        trips = [self.trip] + [
+            Trip.objects.create(
+                route=self.trip.route,
+                train=self.trip.train,
+                departure_time=self.trip.departure_time + timedelta(hours=i),
+                arrival_time=self.trip.arrival_time + timedelta(hours=i),
+            )
+            for i in range(1, 5)
+        ]
+        for trip in trips[1:]:
+            trip.crew.set(crew)
+        for order_number in range(8):
+            self.client.post(
+                ORDER_URL,
+                {
+                    "tickets": [
+                        {"trip": trip.id, "cargo": 1, "seat": order_number + 1}
+                        for trip in trips[:3]
+                    ]
+                },
+                format="json",
+            )
+        cache.clear()
+
+    def assert_within_budget(
+        self, url, max_queries, max_seconds=0.5, **params
+    ):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            res = self.client.get(url, params)
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(
+            len(queries),
+            max_queries,
+            "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+        self.assertLess(elapsed, max_seconds)
+        return res
+
+    def test_order_list_budget(self):
+        res = self.assert_within_budget(ORDER_URL, max_queries=3)
+
+        self.assertEqual(len(res.data["results"]), 5)
+
+    def test_compact_order_list_budget(self):
+        res = self.assert_within_budget(
+            ORDER_URL, max_queries=2, mode="compact"
+        )
+
+        self.assertEqual(len(res.data["results"]), 5)
+
+    def test_trip_list_budget(self):
+        self.assert_within_budget(TRIP_URL, max_queries=1)
+
+    def test_trip_detail_budget(self):
+        self.assert_within_budget(detail_url(self.trip.id), max_queries=2)
+
+    def test_route_list_budget(self):
+        self.assert_within_budget(ROUTE_URL, max_queries=1)
+
+    def test_station_list_budget(self):
+        self.assert_within_budget(STATION_URL, max_queries=1)
+
+    def test_train_list_budget(self):
+        self.assert_within_budget(TRAIN_URL, max_queries=1)
+
+    def test_journey_search_budget(self):
+        self.assert_within_budget(
+            JOURNEY_URL,
+            max_queries=2,
+            source=self.trip.route.source_id,
+            destination=self.trip.route.destination_id,
+            departure=self.trip.departure_time.isoformat(),
+        )
+
+
+class CompactOrderListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "compact@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip()
+        for seat in (1, 2):
+            ticket = {"trip": self.trip.id, "cargo": 1, "seat": seat}
+            self.client.post(
+                ORDER_URL, {"tickets": [ticket]}, format="json"
+            )
+
+    def test_compact_tickets_reference_side_loaded_trips(self):
+        res = self.client.get(ORDER_URL, {"mode": "compact"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ticket = res.data["results"][0]["tickets"][0]
+        self.assertEqual(
+            set(ticket),
+            {"id", "trip", "route", "departure_time", "cargo", "seat"},
+        )
+        self.assertEqual(ticket["route"], "Station1 - Station2")
+        self.assertEqual(list(res.data["trips"]), [self.trip.id])
+        self.assertNotIn("taken_places", res.data["trips"][self.trip.id])
+
+    def test_default_listing_keeps_full_trip(self):
+        res = self.client.get(ORDER_URL)
+
+        self.assertNotIn("trips", res.data)
+        self.assertIn(
+            "taken_places", res.data["results"][0]["tickets"][0]["trip"]
+        )
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["catalog"].clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "catalog@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        Station.objects.create(name="Kyiv", latitude=50.45, longitude=30.52)
+
+    def test_list_served_from_cache(self):
+        self.client.get(STATION_URL)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(STATION_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(queries), 0)
+        self.assertIn("ETag", res)
+        self.assertIn("Last-Modified", res)
+
+    def test_conditional_get_not_modified(self):
+        etag = self.client.get(STATION_URL)["ETag"]
+        res = self.client.get(STATION_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+
+    def test_save_invalidates_cached_list(self):
+        etag = self.client.get(STATION_URL)["ETag"]
+        Station.objects.create(name="Lviv", latitude=49.84, longitude=24.03)
+        res = self.client.get(STATION_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 2)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_change_within_a_second_moves_last_modified(self):
+        caches["catalog"].clear()
+        with mock.patch("train_station.cache.time.time", return_value=100.2):
+            last_modified = self.client.get(STATION_URL)["Last-Modified"]
+        with mock.patch("train_station.cache.time.time", return_value=100.7):
+            Station.objects.create(
+                name="Lviv", latitude=49.84, longitude=24.03
+            )
+        res = self.client.get(
+            STATION_URL, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 2)
+
+    def test_dependent_model_invalidates_cached_list(self):
+        station = Station.objects.get()
+        other = Station.objects.create(name="Lviv", latitude=49, longitude=24)
+        Route.objects.create(source=station, destination=other)
+        self.client.get(ROUTE_URL)
+        other.name = "Odesa"
+        other.save()
+        res = self.client.get(ROUTE_URL)
+
+        self.assertEqual(res.data["results"][0]["destination"], "Odesa")
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "cursor@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        trip = sample_trip()
+        self.trips = [trip] + [
+            Trip.objects.create(
+                route=trip.route,
+                train=trip.train,
+                departure_time=trip.departure_time + timedelta(hours=hours),
+                arrival_time=trip.arrival_time + timedelta(hours=hours),
+            )
+            for hours in (2, 1, 1, 3)
+        ]
+
+    def test_trip_pages_follow_departure_order(self):
+        seen = []
+        url = f"{TRIP_URL}?page_size=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(url)
+            seen += [trip["id"] for trip in res.data["results"]]
+            self.assertNotIn("count", res.data)
+            self.assertEqual(len(queries), 1)
+            url = res.data["next"]
+
+        expected = sorted(
+            self.trips, key=lambda trip: (trip.departure_time, trip.id)
+        )
+        self.assertEqual(seen, [trip.id for trip in expected])
+
+    def test_page_size_is_bounded(self):
+        res = self.client.get(TRIP_URL, {"page_size": 10_000})
+
+        self.assertEqual(len(res.data["results"]), 5)
+        self.assertIn("next", res.data)
+
+
+class TripScheduleFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "schedule@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip(departure_time=datetime(2030, 5, 1))
+
+    def add_trip(self, departure_time):
+        return Trip.objects.create(
+            route=self.trip.route,
+            train=self.trip.train,
+            departure_time=departure_time,
+            arrival_time=departure_time + timedelta(hours=2),
+        )
+
+    def test_date_filter_is_half_open_day_range(self):
+        late = self.add_trip(datetime(2030, 5, 1, 23, 59, 59))
+        self.add_trip(datetime(2030, 5, 2))
+        self.add_trip(datetime(2030, 4, 30, 23, 59, 59))
+
+        res = self.client.get(
+            TRIP_URL, {"date": "2030-05-01", "route": self.trip.route_id}
+        )
+
+        self.assertEqual(
+            [trip["id"] for trip in res.data["results"]],
+            [self.trip.id, late.id],
+        )
+
+    def test_date_filter_does_not_cast_departure_time(self):
+        queryset = Trip.objects.departing_on(datetime(2030, 5, 1).date())
+
+        self.assertNotIn("django_datetime_cast_date", str(queryset.query))
+        self.assertNotIn("::date", str(queryset.query))
+
+    def test_benchmark_schedule_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_schedule",
+            trips=50,
+            routes=3,
+            days=2,
+            repeat=2,
+            stdout=out,
+        )
+
+        self.assertIn("route + date", out.getvalue())
+        self.assertEqual(Trip.objects.count(), 1)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate_data_keeps_seat_maps_consistent(self):
+        out = StringIO()
+        call_command(
+            "generate_data",
+            stations=10,
+            routes=15,
+            trains=3,
+            crew=5,
+            trips=40,
+            days=3,
+            users=5,
+            orders=60,
+            stdout=out,
+        )
+
+        self.assertEqual(Station.objects.count(), 10)
+        self.assertEqual(Trip.objects.count(), 40)
+        self.assertEqual(get_user_model().objects.count(), 5)
+        self.assertTrue(Ticket.objects.exists())
+        for trip in Trip.objects.annotate(tickets_count=Count("tickets")):
+            self.assertEqual(trip.tickets_sold, trip.tickets_count)
+            self.assertEqual(
+                len(trip.taken_places), trip.tickets_count
+            )
+        self.assertTrue(
+            get_user_model()
+            .objects.get(email="loadtest-0@example.com")
+            .check_password("loadtest")
+        )
+
+    def test_load_test_report(self):
+        result = LoadTestResult()
+        for elapsed in (0.01, 0.02, 0.03, 0.04):
+            result.record("trip-list", elapsed, 200)
+        result.record("order-create", 0.05, 400)
+        result.duration = 2.0
+
+        report = result.report()
+
+        self.assertEqual(report["trip-list"]["count"], 4)
+        self.assertEqual(report["trip-list"]["p50"], 20.0)
+        self.assertEqual(report["trip-list"]["p99"], 40.0)
+        self.assertEqual(report["trip-list"]["throughput"], 2.0)
+        self.assertEqual(report["order-create"]["statuses"], {400: 1})
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.trip = sample_trip()
+
+    def book(self, user, seats):
+        client = APIClient()
+        client.force_authenticate(user)
+        payload = {
+            "tickets": [
+                {"trip": self.trip.id, "cargo": cargo, "seat": seat}
+                for cargo, seat in seats
+            ]
+        }
+        try:
+            return client.post(ORDER_URL, payload, format="json")
+        finally:
+            connections.close_all()
+
+    # In-memory SQLite fails concurrent reads instead of waiting for locks.
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_parallel_bookings_never_double_sell(self):
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"rush{number}@test.com")
+            for number in range(300)
+        )
+        rng = random.Random(0)
+        requests = [
+            (user, rng.sample([(1, seat) for seat in range(1, 41)], 2))
+            for user in users
+        ]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            responses = list(
+                executor.map(lambda request: self.book(*request), requests)
+            )
+
+        statuses = [res.status_code for res in responses]
+        self.assertLessEqual(
+            set(statuses),
+            {
+                status.HTTP_201_CREATED,
+                status.HTTP_409_CONFLICT,
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+            },
+        )
+        self.assertIn(status.HTTP_409_CONFLICT, statuses)
+        sold = list(Ticket.objects.values_list("cargo", "seat"))
+        self.assertEqual(len(sold), len(set(sold)))
+        self.assertEqual(
+            len(sold), 2 * statuses.count(status.HTTP_201_CREATED)
+        )
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.tickets_sold, len(sold))
+        self.assertEqual(
+            sorted(self.trip.seat_map.taken_seats()), sorted(sold)
+        )
+
+    def create_order_failing(self, failures):
+        """Create an order while the first ``failures`` booking
+        transactions abort with a lock conflict."""
+        book_seats = booking._book_seats
+        attempts = []
+
+        def flaky_book_seats(*args):
+            attempts.append(args)
+            if len(attempts) <= failures:
+                raise OperationalError("database is locked")
+            return book_seats(*args)
+
+        user = get_user_model().objects.create_user("retry@test.com", "pw")
+        with mock.patch.object(booking, "_book_seats", flaky_book_seats):
+            try:
+                return booking.create_order(
+                    [{"trip": self.trip, "cargo": 1, "seat": 1}], user=user
+                )
+            finally:
+                self.attempts = len(attempts)
+
+    @override_settings(BOOKING_MAX_ATTEMPTS=3, BOOKING_RETRY_BACKOFF=0)
+    def test_serialization_failure_retried(self):
+        order = self.create_order_failing(failures=2)
+
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(order.tickets.count(), 1)
+
+    @override_settings(BOOKING_MAX_ATTEMPTS=2, BOOKING_RETRY_BACKOFF=0)
+    def test_retries_are_bounded(self):
+        with self.assertRaises(booking.BookingBusy):
+            self.create_order_failing(failures=2)
+
+        self.assertEqual(self.attempts, 2)
+        self.assertFalse(Ticket.objects.exists())
+
+
+class HoldStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stores = (LocalHoldStore(), CacheHoldStore("default"))
+
+    def test_reserve_conflict_and_release(self):
+        for store in self.stores:
+            with self.subTest(store=type(store).__name__):
+                hold, _ = store.reserve(1, [(1, 1, 1), (1, 1, 2)], 60)
+                rejected, conflicts = store.reserve(
+                    2, [(1, 1, 2), (1, 1, 3)], 60
+                )
+
+                self.assertIsNone(rejected)
+                self.assertEqual(conflicts, [(1, 1, 2)])
+                self.assertEqual(store.get(hold.id), hold)
+                self.assertEqual(
+                    store.held_seats([1, 2]), {1: {(1, 1), (1, 2)}}
+                )
+                self.assertEqual(
+                    store.held_by_others([(1, 1, 1)], hold.id), []
+                )
+                self.assertEqual(
+                    store.held_by_others([(1, 1, 1), (1, 1, 3)]),
+                    [(1, 1, 1)],
+                )
+
+                store.release(hold)
+
+                self.assertIsNone(store.get(hold.id))
+                self.assertEqual(store.held_seats([1]), {})
+                self.assertIsNotNone(store.reserve(2, [(1, 1, 2)], 60)[0])
+
+    def test_expired_holds_are_swept(self):
+        for store in self.stores:
+            with self.subTest(store=type(store).__name__):
+                holds = [
+                    store.reserve(1, [(2, 1, seat)], 60)[0]
+                    for seat in range(1, 4)
+                ]
+
+                with mock.patch("time.time", return_value=time.time() + 61):
+                    if isinstance(store, LocalHoldStore):
+                        self.assertEqual(store.sweep(), 3)
+                    self.assertIsNone(store.get(holds[0].id))
+                    self.assertEqual(store.held_seats([2]), {})
+                    self.assertIsNotNone(
+                        store.reserve(2, [(2, 1, 1)], 60)[0]
+                    )
+
+
+class SeatHoldApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        hold_store().clear()
+        self.addCleanup(hold_store().clear)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "hold@test.com",
+            "testpass",
+        )
+        self.other_user = get_user_model().objects.create_user(
+            "other-hold@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip()
+
+    def tickets(self, seats):
+        return {
+            "tickets": [
+                {"trip": self.trip.id, "cargo": cargo, "seat": seat}
+                for cargo, seat in seats
+            ]
+        }
+
+    def hold(self, seats):
+        return self.client.post(HOLD_URL, self.tickets(seats), format="json")
+
+    def test_hold_seats(self):
+        res = self.hold([(1, 2), (1, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            res.data["tickets"],
+            [
+                {"trip": self.trip.id, "cargo": 1, "seat": 1},
+                {"trip": self.trip.id, "cargo": 1, "seat": 2},
+            ],
+        )
+        self.assertEqual(
+            self.client.get(
+                reverse("train_station:hold-detail", args=[res.data["id"]])
+            ).data,
+            res.data,
+        )
+
+    def test_holds_reduce_availability(self):
+        self.hold([(1, 1), (1, 2)])
+
+        list_res = self.client.get(TRIP_URL)
+        detail_res = self.client.get(detail_url(self.trip.id))
+
+        self.assertEqual(list_res.data["results"][0]["tickets_available"], 498)
+        self.assertEqual(
+            detail_res.data["held_places"],
+            [{"cargo": 1, "seat": 1}, {"cargo": 1, "seat": 2}],
+        )
+
+    def test_held_seats_conflict_for_other_users(self):
+        self.hold([(1, 1)])
+        self.client.force_authenticate(self.other_user)
+
+        hold_res = self.hold([(1, 1), (1, 2)])
+        order_res = self.client.post(
+            ORDER_URL, self.tickets([(1, 1)]), format="json"
+        )
+
+        for res in (hold_res, order_res):
+            self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(
+                res.data["seats"],
+                [{"trip": self.trip.id, "cargo": 1, "seat": 1}],
+            )
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_sold_seat_cannot_be_held(self):
+        self.client.post(ORDER_URL, self.tickets([(1, 1)]), format="json")
+
+        res = self.hold([(1, 1)])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+
+    @override_settings(SEAT_HOLD_MAX_SEATS=2)
+    def test_hold_size_is_limited(self):
+        res = self.hold([(1, 1), (1, 2), (1, 3)])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_converts_hold_into_order(self):
+        hold_id = self.hold([(1, 1), (1, 2)]).data["id"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse("train_station:hold-checkout", args=[hold_id])
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data["tickets"]), 2)
+        self.assertIsNone(hold_store().get(hold_id))
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.tickets_sold, 2)
+        self.assertEqual(
+            self.client.get(TRIP_URL).data["results"][0]["tickets_available"],
+            498,
+        )
+
+    def test_other_users_cannot_use_hold(self):
+        hold_id = self.hold([(1, 1)]).data["id"]
+        self.client.force_authenticate(self.other_user)
+
+        checkout_res = self.client.post(
+            reverse("train_station:hold-checkout", args=[hold_id])
+        )
+        delete_res = self.client.delete(
+            reverse("train_station:hold-detail", args=[hold_id])
+        )
+
+        self.assertEqual(checkout_res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(delete_res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNotNone(hold_store().get(hold_id))
+
+    def test_release_hold(self):
+        hold_id = self.hold([(1, 1)]).data["id"]
+
+        res = self.client.delete(
+            reverse("train_station:hold-detail", args=[hold_id])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            self.client.get(TRIP_URL).data["results"][0]["tickets_available"],
+            500,
+        )
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        hold_store().clear()
+        self.addCleanup(hold_store().clear)
+        planner.invalidate()
+        self.user = get_user_model().objects.create_user(
+            "async@test.com",
+            "testpass",
+        )
+        self.client = Client(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+        self.sync_client = APIClient()
+        self.sync_client.force_authenticate(self.user)
+        self.trip = sample_trip(
+            departure_time=datetime(2030, 5, 1, 8),
+            arrival_time=datetime(2030, 5, 1, 10),
+        )
+        for hour in range(9, 14):
+            Trip.objects.create(
+                route=self.trip.route,
+                train=self.trip.train,
+                departure_time=datetime(2030, 5, 1, hour),
+                arrival_time=datetime(2030, 5, 1, hour + 2),
+            )
+
+    def test_trip_list_matches_sync_view(self):
+        params = {"date": "2030-05-01", "route": self.trip.route_id}
+
+        res = self.client.get(
+            reverse("train_station:async-trip-list"), params
+        )
+        sync_res = self.sync_client.get(TRIP_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["results"], sync_res.json()["results"])
+
+    def test_trip_list_cursor_pagination(self):
+        url = reverse("train_station:async-trip-list") + "?page_size=4"
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids += [trip["id"] for trip in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(
+            ids,
+            list(
+                Trip.objects.order_by("departure_time", "id").values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+
+    def test_trip_availability(self):
+        self.sync_client.post(
+            ORDER_URL,
+            {"tickets": [{"trip": self.trip.id, "cargo": 1, "seat": 1}]},
+            format="json",
+        )
+        hold_store().reserve(self.user.id, [(self.trip.id, 2, 5)], 60)
+
+        res = self.client.get(
+            reverse(
+                "train_station:async-trip-availability", args=[self.trip.id]
+            )
+        )
+
+        sync_res = self.sync_client.get(
+            reverse("train_station:trip-availability", args=[self.trip.id])
+        )
+
+        self.assertEqual(
+            res.json(),
+            {
+                "id": self.trip.id,
+                "tickets_available": 498,
+                "taken_places": [{"cargo": 1, "seat": 1}],
+                "held_places": [{"cargo": 2, "seat": 5}],
+            },
+        )
+        self.assertEqual(sync_res.json(), res.json())
+
+    def test_trips_availability(self):
+        other = Trip.objects.exclude(id=self.trip.id).first()
+        self.sync_client.post(
+            ORDER_URL,
+            {"tickets": [{"trip": self.trip.id, "cargo": 1, "seat": 1}]},
+            format="json",
+        )
+        hold_store().reserve(self.user.id, [(self.trip.id, 2, 5)], 60)
+
+        with self.assertNumQueries(2):
+            # The user and a single query for all trips.
+            res = self.client.get(
+                reverse("train_station:async-trips-availability"),
+                {"ids": f"{other.id},{self.trip.id},999999", "cargo": "1"},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        by_cargo = [{"cargo": cargo, "free": 50} for cargo in range(1, 11)]
+        trip_by_cargo = [dict(item) for item in by_cargo]
+        trip_by_cargo[0]["free"] = 49
+        trip_by_cargo[1]["free"] = 49
+        self.assertEqual(
+            res.json(),
+            [
+                {
+                    "id": other.id,
+                    "tickets_available": 500,
+                    "free_by_cargo": by_cargo,
+                },
+                {
+                    "id": self.trip.id,
+                    "tickets_available": 498,
+                    "free_by_cargo": trip_by_cargo,
+                },
+            ],
+        )
+
+    def test_trips_availability_without_cargo(self):
+        res = self.client.get(
+            reverse("train_station:async-trips-availability"),
+            {"ids": str(self.trip.id)},
+        )
+
+        self.assertEqual(
+            res.json(), [{"id": self.trip.id, "tickets_available": 500}]
+        )
+
+    def test_trips_availability_invalid_ids(self):
+        with self.settings(TRIP_AVAILABILITY_MAX_IDS=3):
+            for ids in ("", "1,a", "1,2,3,4"):
+                res = self.client.get(
+                    reverse("train_station:async-trips-availability"),
+                    {"ids": ids},
+                )
+
+                self.assertEqual(
+                    res.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertIn("ids", res.json())
+
+    def test_journey_search_matches_sync_view(self):
+        params = {
+            "source": self.trip.route.source_id,
+            "destination": self.trip.route.destination_id,
+            "departure": "2030-05-01T00:00:00",
+        }
+
+        res = self.client.get(
+            reverse("train_station:async-journey-list"), params
+        )
+        sync_res = self.sync_client.get(JOURNEY_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.json()), 3)
+        self.assertEqual(res.json(), sync_res.json())
+
+    def test_authentication_required(self):
+        for url in (
+            reverse("train_station:async-trip-list"),
+            reverse(
+                "train_station:async-trip-availability", args=[self.trip.id]
+            ),
+            reverse("train_station:async-trips-availability"),
+            reverse("train_station:async-journey-list"),
+        ):
+            res = Client().get(url)
+
+            self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_filters_rejected(self):
+        res = self.client.get(
+            reverse("train_station:async-trip-list"), {"date": "tomorrow"}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.user = get_user_model().objects.create_user(
+            "metrics@test.com",
+            "testpass",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        sample_trip()
+
+    def test_metrics_tagged_by_view_and_action(self):
+        self.client.get(TRIP_URL)
+        self.client.post(ORDER_URL, {"tickets": []}, format="json")
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        metrics = self.client.get(reverse("metrics")).content.decode()
+
+        self.assertIn(
+            'http_requests_total{view="TripViewSet.list",'
+            'method="GET",status="200"} 1',
+            metrics,
+        )
+        self.assertIn('view="OrderViewSet.create",method="POST"', metrics)
+        for name in (
+            "http_request_duration_seconds",
+            "http_request_db_queries",
+            "http_request_serializer_duration_seconds",
+            "http_response_size_bytes",
+        ):
+            self.assertIn(
+                f'{name}_count{{view="TripViewSet.list"}} 1', metrics
+            )
+
+    def test_metrics_summed_over_workers(self):
+        other_worker = MetricsRegistry()
+        other_worker.record(
+            "TripViewSet.list",
+            "GET",
+            200,
+            {"http_request_duration_seconds": 0.2},
+        )
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            with override_settings(METRICS_DIR=metrics_dir):
+                other_worker.flush()
+                self.client.get(TRIP_URL)
+                metrics = registry.render()
+
+        self.assertIn(
+            'http_requests_total{view="TripViewSet.list",'
+            'method="GET",status="200"} 2',
+            metrics,
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{view="TripViewSet.list"} 2',
+            metrics,
+        )
+
+    def test_db_and_serializer_time_recorded(self):
+        with mock.patch.object(registry, "record") as record:
+            self.client.get(TRIP_URL)
+
+        view, method, status_code, observations = record.call_args.args
+        self.assertEqual(view, "TripViewSet.list")
+        self.assertGreater(observations["http_request_db_queries"], 0)
+        self.assertGreater(
+            observations["http_request_db_duration_seconds"], 0
+        )
+        self.assertGreater(
+            observations["http_request_serializer_duration_seconds"], 0
+        )
+
+    def test_metrics_forbidden_for_non_staff(self):
+        res = self.client.get(reverse("metrics"))
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_for_staff_with_jwt(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        res = Client().get(
+            reverse("metrics"),
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_metrics_forbidden_with_invalid_jwt(self):
+        res = Client().get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer not-a-token"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN="scrape-token")
+    def test_metrics_with_token(self):
+        res = Client().get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-token"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs(
+            "train_station_service.performance", "WARNING"
+        ) as logs:
+            self.client.get(TRIP_URL)
+
+        self.assertIn("TripViewSet.list", logs.output[0])
+        self.assertEqual(logs.records[0].view, "TripViewSet.list")
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.user = get_user_model().objects.create_user(
+            "profiles@test.com",
+            "testpass",
+            is_staff=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        sample_trip()
+
+    def slow_trip_list(self):
+        get_queryset = TripViewSet.get_queryset
+
+        def slow_get_queryset(view):
+            time.sleep(0.05)
+            return get_queryset(view)
+
+        with mock.patch.object(
+            TripViewSet, "get_queryset", slow_get_queryset
+        ):
+            return self.client.get(TRIP_URL)
+
+    def test_fold_stack_names_nested_serializers(self):
+        class StackField(serializers.Field):
+            def to_representation(self, value):
+                return fold_stack(sys._getframe())
+
+        class OuterSerializer(serializers.Serializer):
+            stack = StackField(source="*")
+
+        stack = OuterSerializer(object()).data["stack"].split(";")
+
+        self.assertTrue(
+            stack[-2].startswith(
+                "OuterSerializer.Serializer.to_representation "
+                "(rest_framework/serializers.py:"
+            )
+        )
+        self.assertTrue(stack[-1].startswith("StackField."))
+
+    def test_sampler_collects_stacks(self):
+        sampler = StackSampler(0.001)
+
+        def busy_wait():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler.start()
+        busy_wait()
+        samples = sampler.stop()
+
+        self.assertTrue(samples)
+        self.assertTrue(
+            any("busy_wait" in stack for stack in samples), samples
+        )
+
+    def test_store_rotation(self):
+        store = ProfileStore(self.profile_dir.name, max_bytes=100)
+        paths = [
+            store.save(f"view-{i}", Counter({f"{'x' * 40};{i}": 1}))
+            for i in range(3)
+        ]
+
+        self.assertEqual(
+            [profile["name"] for profile in store.list()],
+            [paths[2].name, paths[1].name],
+        )
+        self.assertIsNone(store.path(paths[0].name))
+
+    def test_slow_request_profiled(self):
+        with override_settings(
+            PROFILING_ENABLED=True,
+            PROFILE_DIR=self.profile_dir.name,
+            PROFILE_SLOW_REQUEST_MS=20,
+            PROFILE_INTERVAL_MS=1,
+        ):
+            self.client = APIClient()
+            self.client.force_authenticate(self.user)
+            self.slow_trip_list()
+
+            profiles = self.client.get(
+                reverse("train_station:profile-list")
+            ).json()
+
+        self.assertEqual(len(profiles), 1)
+        self.assertIn("-TripViewSet.list-", profiles[0]["name"])
+        with open(
+            os.path.join(self.profile_dir.name, profiles[0]["name"])
+        ) as file:
+            self.assertIn("slow_get_queryset", file.read())
+
+    def test_fast_request_not_profiled(self):
+        with override_settings(
+            PROFILING_ENABLED=True,
+            PROFILE_DIR=self.profile_dir.name,
+            PROFILE_SLOW_REQUEST_MS=10_000,
+            PROFILE_SAMPLE_RATE=0,
+            PROFILE_INTERVAL_MS=1,
+        ):
+            self.client = APIClient()
+            self.client.force_authenticate(self.user)
+            self.slow_trip_list()
+
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    def test_download_profile(self):
+        with override_settings(PROFILE_DIR=self.profile_dir.name):
+            ProfileStore(self.profile_dir.name, 1024).save(
+                "TripViewSet.list", Counter({"main;view": 3})
+            )
+            name = os.listdir(self.profile_dir.name)[0]
+
+            res = self.client.get(
+                reverse("train_station:profile-detail", args=[name])
+            )
+            missing = self.client.get(
+                reverse(
+                    "train_station:profile-detail", args=["missing.folded"]
+                )
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(res.streaming_content), b"main;view 3\n")
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_profiles_admin_only(self):
+        self.user.is_staff = False
+        self.user.save()
+
+        res = self.client.get(reverse("train_station:profile-list"))
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ValuesListSerializerTests(TestCase):
+    def setUp(self):
+        hold_store().clear()
+        self.addCleanup(hold_store().clear)
+        call_command(
+            "generate_data",
+            stations=8,
+            routes=10,
+            trains=3,
+            trips=30,
+            days=2,
+            users=3,
+            orders=40,
+            stdout=StringIO(),
+        )
+        trip = Trip.objects.first()
+        hold_store().reserve(1, [(trip.id, 1, 1), (trip.id, 1, 2)], 60)
+
+    def assertSameJson(self, data, values_data):
+        self.assertEqual(
+            ORJSONRenderer().render(values_data),
+            JSONRenderer().render(data),
+        )
+
+    def test_trip_list_identical_output(self):
+        queryset = TripViewSet.queryset.order_by("departure_time", "id")
+
+        self.assertSameJson(
+            TripListSerializer(queryset, many=True).data,
+            TripListValuesSerializer(
+                TripListValuesSerializer.get_rows(queryset)
+            ).data,
+        )
+
+    def test_route_list_identical_output(self):
+        queryset = RouteViewSet.queryset.order_by("id")
+
+        self.assertSameJson(
+            RouteListSerializer(queryset, many=True).data,
+            RouteListValuesSerializer(
+                RouteListValuesSerializer.get_rows(queryset)
+            ).data,
+        )
+
+    def test_subclass_without_values_fields_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            type(
+                "NoFieldsSerializer",
+                (ValuesListSerializer,),
+                {"values": ("id",)},
+            )
+
+    def test_trip_list_endpoint_paginates_values(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.first())
+        queryset = TripViewSet.queryset.order_by("departure_time", "id")
+
+        results = []
+        url = f"{TRIP_URL}?page_size=7"
+        while url:
+            page = client.get(url).json()
+            results += page["results"]
+            url = page["next"]
+
+        self.assertEqual(
+            results,
+            [dict(trip) for trip in TripListSerializer(
+                queryset, many=True
+            ).data],
+        )
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "id": uuid.UUID(int=7),
+            "departure_time": datetime(2030, 5, 1, 8, 30, 15, 123456),
+            "price": Decimal("12.50"),
+            "route": "Київ - Львів",
+            1: [1.5, None, True],
+        }
+
+        self.assertSameJson(data, data)
+
+
+class ExportApiTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_user(
+            "exports@test.com",
+            "testpass",
+            is_staff=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.trip = sample_trip(
+            departure_time=datetime(2030, 5, 1, 8),
+            arrival_time=datetime(2030, 5, 1, 10),
+        )
+        self.other_trip = Trip.objects.create(
+            route=Route.objects.create(
+                source=self.trip.route.destination,
+                destination=self.trip.route.source,
+            ),
+            train=self.trip.train,
+            departure_time=datetime(2030, 5, 3, 8),
+            arrival_time=datetime(2030, 5, 3, 10),
+        )
+        for trip, seats in ((self.trip, 3), (self.other_trip, 1)):
+            booking.create_order(
+                [
+                    {"trip": trip, "cargo": 1, "seat": seat}
+                    for seat in range(1, seats + 1)
+                ],
+                user=self.admin,
+            )
+
+    def export(self, name, **params):
+        res = self.client.get(
+            reverse("train_station:export-detail", args=[name]), params
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        return res, b"".join(res.streaming_content).decode()
+
+    def test_export_trips_ndjson(self):
+        res, content = self.export("trips")
+
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="trips-', res["Content-Disposition"])
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [
+                {
+                    "id": self.trip.id,
+                    "route": self.trip.route_id,
+                    "source": "Station1",
+                    "destination": "Station2",
+                    "train": "Sample train",
+                    "departure_time": "2030-05-01T08:00:00",
+                    "arrival_time": "2030-05-01T10:00:00",
+                    "tickets_sold": 3,
+                },
+                {
+                    "id": self.other_trip.id,
+                    "route": self.other_trip.route_id,
+                    "source": "Station2",
+                    "destination": "Station1",
+                    "train": "Sample train",
+                    "departure_time": "2030-05-03T08:00:00",
+                    "arrival_time": "2030-05-03T10:00:00",
+                    "tickets_sold": 1,
+                },
+            ],
+        )
+
+    def test_export_tickets_csv_filtered_by_dates(self):
+        res, content = self.export(
+            "tickets",
+            export_format="csv",
+            date_from="2030-05-01",
+            date_to="2030-05-02",
+        )
+
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(res["Content-Type"], "text/csv")
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(
+            {row["trip"] for row in rows}, {str(self.trip.id)}
+        )
+        self.assertEqual(rows[0]["departure_time"], "2030-05-01T08:00:00")
+        self.assertEqual(rows[0]["user_email"], "exports@test.com")
+
+    def test_export_orders_filtered_by_route(self):
+        _, content = self.export("orders", route=self.trip.route_id)
+
+        orders = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(orders[0]["tickets"], 3)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_export_streams_chunks(self):
+        res = self.client.get(
+            reverse("train_station:export-detail", args=["tickets"])
+        )
+
+        self.assertEqual(len(list(res.streaming_content)), 4)
+
+    def test_export_id_ranges_without_server_side_cursors(self):
+        settings_dict = connection.settings_dict
+        with mock.patch.dict(
+            settings_dict, {"DISABLE_SERVER_SIDE_CURSORS": True}
+        ), override_settings(EXPORT_CHUNK_SIZE=2):
+            _, content = self.export("tickets", export_format="csv")
+
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(
+            [int(row["id"]) for row in rows],
+            list(Ticket.objects.order_by("id").values_list("id", flat=True)),
+        )
+
+    def test_export_invalid_params(self):
+        res = self.client.get(
+            reverse("train_station:export-detail", args=["trips"]),
+            {"export_format": "xml", "date_from": "2030-05-02",
+             "date_to": "2030-05-01"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("export_format", res.data)
+
+    def test_export_reads_current_rows(self):
+        self.export("trips")
+        Trip.objects.filter(id=self.other_trip.id).delete()
+        _, content = self.export("trips")
+
+        self.assertEqual(len(content.splitlines()), 1)
+
+    def test_export_without_queryset_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            type("NoQuerysetExport", (Export,), {"name": "none"})
+
+    def test_export_admin_only(self):
+        user = get_user_model().objects.create_user(
+            "customer@test.com", "testpass"
+        )
+        self.client.force_authenticate(user)
+
+        res = self.client.get(
+            reverse("train_station:export-detail", args=["trips"])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        token = AccessToken.for_user(self.admin)
+
+        res = await AsyncClient().get(
+            reverse("train_station:export-detail", args=["trips"]),
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.is_async)
+        content = b"".join([chunk async for chunk in res.streaming_content])
+        self.assertEqual(len(content.splitlines()), 2)
+
+
+class TimetableImportTests(TestCase):
+    IMPORT_URL = reverse("train_station:trip-import-timetable")
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_user(
+            "timetable@test.com",
+            "testpass",
+            is_staff=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.trip = sample_trip(
+            departure_time=datetime(2030, 9, 1, 8, 15),
+            arrival_time=datetime(2030, 9, 1, 10, 40),
+        )
+        self.route, self.train = self.trip.route, self.trip.train
+        self.crew = [
+            Crew.objects.create(first_name="Crew", last_name=str(i))
+            for i in range(2)
+        ]
+
+    def rule(self, **params):
+        rule = {
+            "route": self.route.id,
+            "train": self.train.id,
+            "departure": "08:15",
+            "arrival": "10:40",
+            "days": "Mon-Fri",
+            "start_date": "2030-09-02",
+            "end_date": "2030-09-15",
+            "crew": [crew.id for crew in self.crew],
+        }
+        rule.update(params)
+        return rule
+
+    def test_import_rules_and_trips(self):
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(
+            planner, "invalidate"
+        ) as invalidate, CaptureQueriesContext(connection) as queries:
+            res = self.client.post(
+                self.IMPORT_URL,
+                {
+                    "rules": [
+                        self.rule(),
+                        self.rule(
+                            departure="23:30", arrival="01:10", days="Sun"
+                        ),
+                    ],
+                    "trips": [
+                        {
+                            "route": self.route.id,
+                            "train": self.train.id,
+                            "departure_time": "2030-09-20T12:00",
+                            "arrival_time": "2030-09-20T14:00",
+                        }
+                    ],
+                },
+                format="json",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        self.assertEqual(res.data, {"created": 13})
+        invalidate.assert_called_once()
+        self.assertLess(len(queries), 20)
+        imported = Trip.objects.exclude(id=self.trip.id)
+        self.assertEqual(
+            sorted(
+                trip.departure_time.strftime("%a %d")
+                for trip in imported.filter(departure_time__hour=8)
+            ),
+            sorted(
+                f"{day} {date:02}"
+                for day, dates in (
+                    ("Mon", (2, 9)),
+                    ("Tue", (3, 10)),
+                    ("Wed", (4, 11)),
+                    ("Thu", (5, 12)),
+                    ("Fri", (6, 13)),
+                )
+                for date in dates
+            ),
+        )
+        night = imported.get(departure_time=datetime(2030, 9, 8, 23, 30))
+        self.assertEqual(night.arrival_time, datetime(2030, 9, 9, 1, 10))
+        self.assertEqual(
+            Trip.crew.through.objects.filter(trip__in=imported).count(), 24
+        )
+
+    def test_import_csv_upload(self):
+        upload = SimpleUploadedFile(
+            "timetable.csv",
+            (
+                "route,train,departure_time,arrival_time,crew\n"
+                f"{self.route.id},{self.train.id},2030-10-01T08:00,"
+                f"2030-10-01T09:00,{self.crew[0].id};{self.crew[1].id}\n"
+                f"{self.route.id},{self.train.id},2030-10-02T08:00,"
+                "2030-10-02T09:00,\n"
+            ).encode(),
+            content_type="text/csv",
+        )
+
+        res = self.client.post(
+            self.IMPORT_URL, {"file": upload}, format="multipart"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        trip = Trip.objects.get(departure_time=datetime(2030, 10, 1, 8))
+        self.assertEqual(
+            sorted(trip.crew.values_list("id", flat=True)),
+            [crew.id for crew in self.crew],
+        )
+
+    def test_errors_reported_by_row_and_nothing_imported(self):
+        upload = SimpleUploadedFile(
+            "timetable.csv",
+            (
+                "route,train,departure_time,arrival_time,crew\n"
+                f"{self.route.id},{self.train.id},2030-10-01T08:00,"
+                "2030-10-01T09:00,\n"
+                f"999,{self.train.id},2030-10-02T08:00,2030-10-02T09:00,\n"
+                f"{self.route.id},{self.train.id},2030-10-03T08:00,"
+                "2030-10-03T07:00,\n"
+                f"{self.route.id},{self.train.id},2030-09-01T08:15,"
+                "2030-09-01T10:40,999\n"
+            ).encode(),
+        )
+
+        res = self.client.post(
+            self.IMPORT_URL, {"file": upload}, format="multipart"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = {
+            error["row"]: error["errors"] for error in res.data["errors"]
+        }
+        self.assertEqual(set(errors), {3, 4, 5})
+        self.assertEqual(errors[3], {"route": ["Route 999 does not exist."]})
+        self.assertIn("arrival_time", errors[4])
+        self.assertEqual(set(errors[5]), {"crew", "departure_time"})
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_rule_errors(self):
+        res = self.client.post(
+            self.IMPORT_URL,
+            {
+                "rules": [
+                    self.rule(days="Someday"),
+                    self.rule(),
+                    self.rule(days="Mon"),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            [error["row"] for error in res.data["errors"]],
+            ["rules[0]", "rules[2]"],
+        )
+        self.assertIn("days", res.data["errors"][0]["errors"])
+        self.assertIn(
+            "also in row rules[1]",
+            res.data["errors"][1]["errors"]["departure_time"][0],
+        )
+
+    @override_settings(TIMETABLE_IMPORT_MAX_TRIPS=5)
+    def test_trip_limit(self):
+        res = self.client.post(
+            self.IMPORT_URL, {"rules": [self.rule()]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data["errors"][0]["row"], "rules[0]")
+
+    @override_settings(TIMETABLE_IMPORT_MAX_TRIPS=5)
+    def test_trip_limit_counts_trip_rows(self):
+        trips = [
+            {
+                "route": self.route.id,
+                "train": self.train.id,
+                "departure_time": f"2030-10-{day:02}T12:00",
+                "arrival_time": f"2030-10-{day:02}T14:00",
+            }
+            for day in range(1, 8)
+        ]
+
+        for rules in ([self.rule()], []):
+            res = self.client.post(
+                self.IMPORT_URL,
+                {"rules": rules, "trips": trips},
+                format="json",
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(res.data["errors"][0]["row"], "trips[5]")
+            self.assertIn(
+                "limited to 5 trips",
+                res.data["errors"][0]["errors"]["non_field_errors"][0],
+            )
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_weekday_ranges(self):
+        for days, expected in (
+            ("daily", set(range(7))),
+            ("Mon\u2013Fri", {0, 1, 2, 3, 4}),
+            ("Fri-Mon", {4, 5, 6, 0}),
+            ("sat, sun", {5, 6}),
+            ("Mon-Tue,Thu", {0, 1, 3}),
+        ):
+            serializer = TimetableRuleSerializer(data=self.rule(days=days))
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(serializer.validated_data["days"], expected)
+
+    def test_dry_run(self):
+        res = self.client.post(
+            f"{self.IMPORT_URL}?dry_run=1",
+            {"rules": [self.rule()]},
+            format="json",
+        )
+
+        self.assertEqual(res.data, {"valid": 10})
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_import_admin_only(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@test.com", "pass")
+        )
+
+        res = self.client.post(
+            self.IMPORT_URL, {"rules": [self.rule()]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_timetable_command(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".json", delete=False
+        ) as file:
+            json.dump({"rules": [self.rule()]}, file)
+        self.addCleanup(os.unlink, file.name)
+        out = StringIO()
+
+        call_command("import_timetable", file.name, stdout=out)
+
+        self.assertIn("Imported 10 trips", out.getvalue())
+        with self.assertRaisesMessage(CommandError, "1 rows have errors"):
+            call_command(
+                "import_timetable", file.name, stdout=out, stderr=StringIO()
+            )
+
+
+class SeatAssignmentTests(TestCase):
+    def setUp(self):
+        self.seat_map = SeatMap(cargo_num=3, places_in_cargo=10)
+        for seat in (1, 2, 4, 5, 6):
+            self.seat_map.take(1, seat)
+        self.seat_map.take(2, 3)
+
+    def test_adjacent_takes_shortest_fitting_run(self):
+        self.assertEqual(
+            assign_seats(self.seat_map, 4, "adjacent"),
+            [(1, 7), (1, 8), (1, 9), (1, 10)],
+        )
+        self.assertEqual(
+            assign_seats(self.seat_map, 2, "adjacent"),
+            [(2, 1), (2, 2)],
+        )
+
+    def test_adjacent_without_run_takes_closest_seats_of_one_cargo(self):
+        self.seat_map.take(1, 8)
+        self.seat_map.take(1, 10)
+        for cargo in (2, 3):
+            for seat in range(2, 11, 2):
+                self.seat_map.take(cargo, seat)
+
+        self.assertEqual(
+            assign_seats(self.seat_map, 3, "adjacent"),
+            [(2, 5), (2, 7), (2, 9)],
+        )
+        self.assertIsNone(assign_seats(self.seat_map, 6, "adjacent"))
+
+    def test_fill_first_takes_first_free_seats(self):
+        self.assertEqual(
+            assign_seats(self.seat_map, 3, "fill_first"),
+            [(1, 3), (1, 7), (1, 8)],
+        )
+
+    def test_spread_uses_emptiest_cargos_and_distant_seats(self):
+        self.assertEqual(
+            assign_seats(self.seat_map, 4, "spread"),
+            [(2, 6), (2, 10), (3, 1), (3, 10)],
+        )
+
+    def test_unavailable_seats_are_skipped(self):
+        self.assertEqual(
+            assign_seats(self.seat_map, 2, "fill_first", {(1, 3), (1, 7)}),
+            [(1, 8), (1, 9)],
+        )
+
+    def test_not_enough_free_seats(self):
+        for preference in ("adjacent", "fill_first", "spread"):
+            self.assertIsNone(assign_seats(self.seat_map, 26, preference))
+
+
+class AutoAssignBookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        hold_store().clear()
+        self.addCleanup(hold_store().clear)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "auto-assign@test.com",
+            "testpass",
+        )
+        self.client.force_authenticate(self.user)
+        self.trip = sample_trip()
+
+    def book(self, party_size, **payload):
+        return self.client.post(
+            ORDER_URL,
+            {"trip": self.trip.id, "party_size": party_size, **payload},
+            format="json",
+        )
+
+    def test_adjacent_seats_by_default(self):
+        self.client.post(
+            ORDER_URL,
+            {"tickets": [{"trip": self.trip.id, "cargo": 1, "seat": 2}]},
+            format="json",
+        )
+        hold_store().reserve(0, [(self.trip.id, 1, 4)], 60)
+
+        res = self.book(3)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [
+                (ticket["cargo"], ticket["seat"])
+                for ticket in res.data["tickets"]
+            ],
+            [(1, 5), (1, 6), (1, 7)],
+        )
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.tickets_sold, 4)
+        self.assertTrue(self.trip.seat_map.is_taken(1, 6))
+
+    def test_consecutive_parties_do_not_conflict(self):
+        seats = set()
+        for preference in ("adjacent", "fill_first", "spread"):
+            res = self.book(5, preference=preference)
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            seats.update(
+                (ticket["cargo"], ticket["seat"])
+                for ticket in res.data["tickets"]
+            )
+        self.assertEqual(len(seats), 15)
+        self.assertEqual(Ticket.objects.count(), 15)
+
+    def test_not_enough_seats(self):
+        with self.settings(AUTO_ASSIGN_MAX_PARTY_SIZE=1000):
+            res = self.book(501, preference="fill_first")
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+
+    def test_invalid_requests_rejected(self):
+        for payload in (
+            {"party_size": 0},
+            {"party_size": 21},
+            {"party_size": 2, "preference": "window"},
+            {"party_size": 2, "trip": 999999},
+        ):
+            res = self.client.post(
+                ORDER_URL, {"trip": self.trip.id, **payload}, format="json"
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+
+class SeatEventTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        hold_store().clear()
+        self.addCleanup(hold_store().clear)
+        self.user = get_user_model().objects.create_user(
+            "seat-events@test.com",
+            "testpass",
+        )
+        self.headers = {
+            "Authorization": f"Bearer {AccessToken.for_user(self.user)}"
+        }
+        self.trip = sample_trip()
+        self.url = reverse(
+            "train_station:async-trip-seat-events", args=[self.trip.id]
+        )
+
+    def book(self, seats):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.post(
+                ORDER_URL,
+                {
+                    "tickets": [
+                        {"trip": self.trip.id, "cargo": cargo, "seat": seat}
+                        for cargo, seat in seats
+                    ]
+                },
+                format="json",
+            )
+
+    def cancel(self, order_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.get(id=order_id).delete()
+
+    @asynccontextmanager
+    async def stream(self):
+        """Consume the event stream in a task, cancelled on exit like by
+        the ASGI handler when the client disconnects."""
+        res = await AsyncClient().get(self.url, headers=self.headers)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        chunks = asyncio.Queue()
+
+        async def consume():
+            async for chunk in res.streaming_content:
+                await chunks.put(chunk)
+
+        task = asyncio.create_task(consume())
+        try:
+            yield chunks
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    async def next_event(chunks):
+        chunk = await asyncio.wait_for(chunks.get(), 5)
+        lines = chunk.decode().splitlines()
+        if lines[0].startswith(":"):
+            return lines[0], None
+        return lines[0].removeprefix("event: "), json.loads(
+            lines[1].removeprefix("data: ")
+        )
+
+    async def test_snapshot_then_seat_changes(self):
+        order = await sync_to_async(self.book)([(1, 1)])
+
+        async with self.stream() as chunks:
+            snapshot = await self.next_event(chunks)
+            await sync_to_async(self.book)([(2, 3), (2, 4)])
+            await sync_to_async(self.cancel)(order.data["id"])
+            booked = await self.next_event(chunks)
+            cancelled = await self.next_event(chunks)
+
+        self.assertEqual(
+            snapshot,
+            (
+                "snapshot",
+                {
+                    "id": self.trip.id,
+                    "tickets_available": 499,
+                    "taken_places": [{"cargo": 1, "seat": 1}],
+                    "held_places": [],
+                },
+            ),
+        )
+        self.assertEqual(
+            booked,
+            (
+                "seats",
+                {
+                    "trip": self.trip.id,
+                    "taken": [
+                        {"cargo": 2, "seat": 3},
+                        {"cargo": 2, "seat": 4},
+                    ],
+                    "released": [],
+                },
+            ),
+        )
+        self.assertEqual(
+            cancelled,
+            (
+                "seats",
+                {
+                    "trip": self.trip.id,
+                    "taken": [],
+                    "released": [{"cargo": 1, "seat": 1}],
+                },
+            ),
+        )
+        self.assertEqual(seat_broker().subscriber_count(self.trip.id), 0)
+
+    async def test_lagging_client_gets_new_snapshot(self):
+        with self.settings(SEAT_EVENTS_QUEUE_SIZE=1):
+            async with self.stream() as chunks:
+                await self.next_event(chunks)
+                for _ in range(3):
+                    seat_broker().publish(
+                        self.trip.id, {"trip": self.trip.id}
+                    )
+                event, _ = await self.next_event(chunks)
+
+        self.assertEqual(event, "snapshot")
+
+    async def assert_reconnect_lags_subscribers(self, error):
+        stopped = threading.Event()
+
+        def dropped_connection():
+            yield {
+                "channel": f"{broker.prefix}{self.trip.id}",
+                "data": json.dumps({"trip": self.trip.id}),
+            }
+            raise error
+
+        def new_connection():
+            stopped.wait()
+            yield from ()
+
+        client = mock.Mock()
+        client.pubsub.return_value.listen.side_effect = [
+            dropped_connection(),
+            new_connection(),
+            # Ends the listener thread quietly.
+            SystemExit,
+        ]
+        with mock.patch("redis.Redis.from_url", return_value=client):
+            broker = RedisSeatBroker()
+        with self.assertLogs("train_station.seat_events") as logs:
+            subscription = broker.subscribe(self.trip.id)
+            try:
+                event = await asyncio.wait_for(subscription.get(), 5)
+                lagged = await asyncio.wait_for(subscription.get(), 5)
+                subscribes = client.pubsub.return_value.psubscribe.call_count
+            finally:
+                stopped.set()
+
+        self.assertEqual(event, {"trip": self.trip.id})
+        self.assertIs(lagged, LAGGED)
+        self.assertEqual(subscribes, 2)
+        self.assertIn("disconnected", logs.output[0])
+
+    async def test_redis_reconnect_lags_subscribers(self):
+        await self.assert_reconnect_lags_subscribers(
+            RedisConnectionError("Connection reset by peer")
+        )
+
+    async def test_redis_timeout_lags_subscribers(self):
+        await self.assert_reconnect_lags_subscribers(
+            RedisTimeoutError("Timeout reading from socket")
+        )
+
+    async def test_keep_alive_comments(self):
+        with self.settings(SEAT_EVENTS_KEEPALIVE_SECONDS=0.01):
+            async with self.stream() as chunks:
+                await self.next_event(chunks)
+                event = await self.next_event(chunks)
+
+        self.assertEqual(event, (": keep-alive", None))
+
+    async def test_unknown_trip_and_authentication(self):
+        res = await AsyncClient().get(
+            reverse("train_station:async-trip-seat-events", args=[999999]),
+            headers=self.headers,
+        )
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = await AsyncClient().get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_not_served_over_wsgi(self):
+        res = Client().get(self.url, headers=self.headers)
+
+        self.assertEqual(res.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+@override_settings(ANALYTICS_GRACE_SECONDS=0)
+class AnalyticsRollupTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_user(
+            "analytics@test.com",
+            "testpass",
+            is_staff=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.trip = sample_trip(
+            departure_time=datetime(2030, 5, 1, 8),
+            arrival_time=datetime(2030, 5, 1, 10),
+        )
+        self.route = self.trip.route
+        self.train = self.trip.train
+        self.small_train = sample_train(
+            name="Small train", cargo_num=2, places_in_cargo=10
+        )
+        self.small_trip = Trip.objects.create(
+            route=self.route,
+            train=self.small_train,
+            departure_time=datetime(2030, 5, 1, 12),
+            arrival_time=datetime(2030, 5, 1, 14),
+        )
+        self.other_trip = Trip.objects.create(
+            route=Route.objects.create(
+                source=self.route.destination,
+                destination=self.route.source,
+            ),
+            train=self.train,
+            departure_time=datetime(2030, 5, 3, 8),
+            arrival_time=datetime(2030, 5, 3, 10),
+        )
+        self.order = self.book((self.trip, 1), (self.trip, 2), (self.trip, 3))
+        self.book((self.small_trip, 1), (self.other_trip, 1))
+
+    def book(self, *seats):
+        return booking.create_order(
+            [
+                {"trip": trip, "cargo": 1, "seat": seat}
+                for trip, seat in seats
+            ],
+            user=self.admin,
+        )
+
+    def route_stats(self):
+        return {
+            (stats.route_id, stats.day): (
+                stats.trips,
+                stats.seats,
+                stats.tickets_sold,
+                stats.orders,
+                stats.occupancy,
+            )
+            for stats in RouteDailyStats.objects.all()
+        }
+
+    def test_rollups_by_route_and_train(self):
+        self.assertEqual(analytics.refresh_rollups(), 2)
+
+        self.assertEqual(
+            self.route_stats(),
+            {
+                (self.route.id, date(2030, 5, 1)): (2, 520, 4, 2, 0.8),
+                (self.other_trip.route_id, date(2030, 5, 3)): (
+                    1, 500, 1, 1, 0.2
+                ),
+            },
+        )
+        self.assertEqual(
+            set(
+                TrainDailyStats.objects.values_list(
+                    "train_id", "day", "trips", "seats", "tickets_sold"
+                )
+            ),
+            {
+                (self.train.id, date(2030, 5, 1), 1, 500, 3),
+                (self.train.id, date(2030, 5, 3), 1, 500, 1),
+                (self.small_train.id, date(2030, 5, 1), 1, 20, 1),
+            },
+        )
+        stats = RouteDailyStats.objects.get(route=self.route)
+        self.assertAlmostEqual(
+            stats.passenger_km, 4 * self.route.distance_km
+        )
+
+    def test_refresh_only_adds_new_orders(self):
+        analytics.refresh_rollups()
+        self.book((self.trip, 4), (self.trip, 5))
+
+        with CaptureQueriesContext(connection) as one_order:
+            self.assertEqual(analytics.refresh_rollups(), 1)
+        for seat in range(6, 11):
+            self.book((self.trip, seat), (self.other_trip, seat))
+        with CaptureQueriesContext(connection) as more_orders:
+            self.assertEqual(analytics.refresh_rollups(), 5)
+
+        self.assertEqual(
+            self.route_stats()[self.route.id, date(2030, 5, 1)],
+            (2, 520, 11, 8, 2.1),
+        )
+        self.assertEqual(len(more_orders), len(one_order))
+        self.assertEqual(analytics.refresh_rollups(), 0)
+
+    def test_trips_added_later_and_days_without_sales_counted(self):
+        analytics.refresh_rollups()
+        Trip.objects.create(
+            route=self.route,
+            train=self.train,
+            departure_time=datetime(2030, 5, 1, 18),
+            arrival_time=datetime(2030, 5, 1, 20),
+        )
+        Trip.objects.create(
+            route=self.route,
+            train=self.small_train,
+            departure_time=datetime(2030, 5, 5, 8),
+            arrival_time=datetime(2030, 5, 5, 10),
+        )
+        self.other_trip.tickets.all().delete()
+        self.other_trip.delete()
+
+        self.assertEqual(analytics.refresh_rollups(), 0)
+
+        self.assertEqual(
+            self.route_stats(),
+            {
+                (self.route.id, date(2030, 5, 1)): (3, 1020, 4, 2, 0.4),
+                (self.route.id, date(2030, 5, 5)): (1, 20, 0, 0, 0.0),
+                (self.other_trip.route_id, date(2030, 5, 3)): (
+                    0, 0, 1, 1, 0.0
+                ),
+            },
+        )
+
+    def test_batches_add_up(self):
+        self.assertEqual(analytics.refresh_rollups(batch_size=1), 2)
+
+        self.assertEqual(
+            self.route_stats()[self.route.id, date(2030, 5, 1)],
+            (2, 520, 4, 2, 0.8),
+        )
+
+    @override_settings(ANALYTICS_GRACE_SECONDS=300)
+    def test_young_orders_wait_for_the_grace_period(self):
+        old = datetime.now() - timedelta(minutes=10)
+        Order.objects.filter(id=self.order.id).update(created_at=old)
+        later_order = self.book((self.trip, 4))
+        Order.objects.filter(id=later_order.id).update(created_at=old)
+
+        self.assertEqual(analytics.refresh_rollups(), 1)
+        self.assertEqual(
+            analytics.rollup_status()["last_order"], self.order.id
+        )
+
+        Order.objects.update(created_at=old)
+        self.assertEqual(analytics.refresh_rollups(), 2)
+        self.assertEqual(
+            self.route_stats()[self.route.id, date(2030, 5, 1)][2], 5
+        )
+
+    def test_rebuild_after_cancellation(self):
+        analytics.refresh_rollups()
+        self.order.delete()
+
+        call_command("refresh_analytics", "--rebuild", stdout=StringIO())
+
+        self.assertEqual(
+            self.route_stats()[self.route.id, date(2030, 5, 1)],
+            (2, 520, 1, 1, 0.2),
+        )
+
+    def test_dashboard_endpoints(self):
+        analytics.refresh_rollups()
+        url = reverse("train_station:analytics-routes")
+
+        res = self.client.get(
+            url,
+            {
+                "date_from": "2030-05-01",
+                "date_to": "2030-05-02",
+                "route": self.route.id,
+            },
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data["last_order"], Order.objects.latest("id").id
+        )
+        self.assertEqual(
+            [
+                (row["route"], row["day"], row["tickets_sold"])
+                for row in res.data["results"]
+            ],
+            [(self.route.id, "2030-05-01", 4)],
+        )
+        self.assertEqual(res.data["results"][0]["occupancy"], 0.8)
+
+        res = self.client.get(
+            reverse("train_station:analytics-trains"),
+            {"date_from": "2030-05-01", "date_to": "2030-05-31"},
+        )
+        self.assertEqual(len(res.data["results"]), 3)
+
+        rows = []
+        url = reverse("train_station:analytics-trains")
+        params = {
+            "date_from": "2030-05-01",
+            "date_to": "2030-05-31",
+            "page_size": 2,
+        }
+        while url:
+            page = self.client.get(url, params).json()
+            rows += [(row["train"], row["day"]) for row in page["results"]]
+            url, params = page["next"], None
+        self.assertEqual(
+            rows,
+            [
+                (stats.train_id, stats.day.isoformat())
+                for stats in TrainDailyStats.objects.order_by("day", "id")
+            ],
+        )
+
+    def test_dashboard_validation_and_permissions(self):
+        url = reverse("train_station:analytics-routes")
+        for params in (
+            {"date_from": "2030-05-02", "date_to": "2030-05-01"},
+            {"date_from": "2029-01-01", "date_to": "2030-05-01"},
+        ):
+            res = self.client.get(url, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.admin.is_staff = False
+        self.admin.save()
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,295 @@
+"""Bulk import of trip timetables.
+
+A timetable lists trips, as CSV rows or JSON objects, and recurrence rules
+generating trips of a route and train on given weekdays. Everything is
+validated in memory, with one query per referenced model, before the trips
+and their crew links are written with chunked ``bulk_create`` in a single
+transaction. A timetable with any error is not imported at all."""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from train_station.journeys import planner
+from train_station.models import Crew, Route, Train, Trip
+from train_station.serializer import (
+    TimetableRuleSerializer,
+    TimetableTripSerializer,
+)
+
+CSV_CREW_SEPARATOR = ";"
+
+PlannedTrip = namedtuple(
+    "PlannedTrip",
+    ("row", "route", "train", "departure_time", "arrival_time", "crew"),
+)
+
+
+def read_csv(text: str):
+    """Return the trip rows of a CSV timetable, labelled with their line
+    number. Columns: route, train, departure_time, arrival_time and crew,
+    the crew ids separated by semicolons."""
+    reader = csv.DictReader(io.StringIO(text))
+    rows = []
+    for row in reader:
+        data = {
+            column: value.strip()
+            for column, value in row.items()
+            if column and value and value.strip()
+        }
+        if "crew" in data:
+            data["crew"] = [
+                crew_id.strip()
+                for crew_id in data["crew"].split(CSV_CREW_SEPARATOR)
+                if crew_id.strip()
+            ]
+        rows.append((reader.line_num, data))
+    return rows, []
+
+
+def read_json(document):
+    """Return the trip rows and rules of a JSON timetable, either a list of
+    trips or an object with "trips" and "rules" lists, labelled with their
+    position, e.g. "trips[3]"."""
+    if isinstance(document, list):
+        document = {"trips": document}
+    if not isinstance(document, dict) or not all(
+        isinstance(document.get(key, []), list) for key in ("trips", "rules")
+    ):
+        raise ValidationError(
+            "Expected a list of trips or an object with trips and rules."
+        )
+    return tuple(
+        [(f"{key}[{index}]", row) for index, row in enumerate(document[key])]
+        if key in document
+        else []
+        for key in ("trips", "rules")
+    )
+
+
+def read_upload(upload):
+    """Read an uploaded CSV (by file name) or JSON timetable."""
+    try:
+        content = upload.read().decode()
+        if upload.name.lower().endswith(".csv"):
+            return read_csv(content)
+        return read_json(json.loads(content))
+    except (UnicodeDecodeError, ValueError) as error:
+        raise ValidationError({"file": f"Unreadable timetable: {error}"})
+
+
+def expand_rule(row, rule):
+    """Generate the trips of a validated recurrence rule."""
+    duration = datetime.combine(date.min, rule["arrival"]) - datetime.combine(
+        date.min, rule["departure"]
+    )
+    if duration <= timedelta(0):
+        duration += timedelta(days=1)
+
+    day = rule["start_date"]
+    while day <= rule["end_date"]:
+        if day.weekday() in rule["days"]:
+            departure_time = datetime.combine(day, rule["departure"])
+            yield PlannedTrip(
+                row,
+                rule["route"],
+                rule["train"],
+                departure_time,
+                departure_time + duration,
+                tuple(rule["crew"]),
+            )
+        day += timedelta(days=1)
+
+
+class TimetableErrors:
+    """Errors by row and field, in the order of the rows. A rule may fail
+    on every date, so only the first messages of a field are kept."""
+
+    max_messages = 5
+
+    def __init__(self):
+        self._errors = {}
+        self._omitted = {}
+
+    def add(self, row, field, message):
+        messages = self._errors.setdefault(row, {}).setdefault(field, [])
+        if message in messages:
+            return
+        if len(messages) < self.max_messages:
+            messages.append(message)
+        else:
+            self._omitted[row, field] = self._omitted.get((row, field), 0) + 1
+
+    def update(self, row, errors):
+        for field, messages in errors.items():
+            for message in messages:
+                self.add(row, field, str(message))
+
+    def as_list(self) -> list:
+        for (row, field), count in self._omitted.items():
+            self._errors[row][field].append(f"... and {count} more.")
+        self._omitted = {}
+        return [
+            {"row": row, "errors": errors}
+            for row, errors in self._errors.items()
+        ]
+
+
+def _limit_error(row, max_trips, errors):
+    errors.add(
+        row,
+        "non_field_errors",
+        f"Timetables are limited to {max_trips} trips.",
+    )
+
+
+def _validate_rows(trip_rows, rule_rows, errors) -> list:
+    max_trips = settings.TIMETABLE_IMPORT_MAX_TRIPS
+    planned = []
+    for row, data in trip_rows:
+        serializer = TimetableTripSerializer(data=data)
+        if not serializer.is_valid():
+            errors.update(row, serializer.errors)
+            continue
+        trip = serializer.validated_data
+        planned.append(
+            PlannedTrip(
+                row,
+                trip["route"],
+                trip["train"],
+                trip["departure_time"],
+                trip["arrival_time"],
+                tuple(trip["crew"]),
+            )
+        )
+        if len(planned) > max_trips:
+            _limit_error(row, max_trips, errors)
+            return planned
+
+    for row, data in rule_rows:
+        serializer = TimetableRuleSerializer(data=data)
+        if not serializer.is_valid():
+            errors.update(row, serializer.errors)
+            continue
+        planned += islice(
+            expand_rule(row, serializer.validated_data),
+            max(max_trips - len(planned) + 1, 0),
+        )
+        if len(planned) > max_trips:
+            _limit_error(row, max_trips, errors)
+            break
+    return planned
+
+
+def _validate_references(planned, errors):
+    for field, model in (("route", Route), ("train", Train)):
+        ids = {getattr(trip, field) for trip in planned}
+        missing = ids - set(
+            model.objects.filter(id__in=ids).values_list("id", flat=True)
+        )
+        for trip in planned:
+            if getattr(trip, field) in missing:
+                errors.add(
+                    trip.row,
+                    field,
+                    f"{model.__name__} {getattr(trip, field)} does not exist.",
+                )
+
+    crew_ids = {crew_id for trip in planned for crew_id in trip.crew}
+    missing = crew_ids - set(
+        Crew.objects.filter(id__in=crew_ids).values_list("id", flat=True)
+    )
+    for trip in planned:
+        for crew_id in missing.intersection(trip.crew):
+            errors.add(trip.row, "crew", f"Crew {crew_id} does not exist.")
+
+
+def _validate_departures(planned, errors):
+    """A train departs at most once at a given time."""
+    rows = {}
+    for trip in planned:
+        key = (trip.train, trip.departure_time)
+        if key in rows:
+            errors.add(
+                trip.row,
+                "departure_time",
+                f"Train {trip.train} departs twice at "
+                f"{trip.departure_time.isoformat()}, also in row {rows[key]}.",
+            )
+        else:
+            rows[key] = trip.row
+
+    if not planned:
+        return
+    existing = Trip.objects.filter(
+        train_id__in={trip.train for trip in planned},
+        departure_time__range=(
+            min(trip.departure_time for trip in planned),
+            max(trip.departure_time for trip in planned),
+        ),
+    ).values_list("train_id", "departure_time")
+    for train_id, departure_time in existing.iterator():
+        row = rows.get((train_id, departure_time))
+        if row is not None:
+            errors.add(
+                row,
+                "departure_time",
+                f"Train {train_id} already has a trip departing at "
+                f"{departure_time.isoformat()}.",
+            )
+
+
+def plan_timetable(trip_rows, rule_rows):
+    """Validate a timetable and return its trips and errors."""
+    errors = TimetableErrors()
+    planned = _validate_rows(trip_rows, rule_rows, errors)
+    _validate_references(planned, errors)
+    _validate_departures(planned, errors)
+    return planned, errors.as_list()
+
+
+def save_timetable(planned) -> int:
+    """Write the trips and crew links in one transaction."""
+    chunk_size = settings.TIMETABLE_IMPORT_CHUNK_SIZE
+    crew_link = Trip.crew.through
+    with transaction.atomic():
+        for offset in range(0, len(planned), chunk_size):
+            chunk = planned[offset:offset + chunk_size]
+            trips = Trip.objects.bulk_create(
+                Trip(
+                    route_id=trip.route,
+                    train_id=trip.train,
+                    departure_time=trip.departure_time,
+                    arrival_time=trip.arrival_time,
+                )
+                for trip in chunk
+            )
+            crew_link.objects.bulk_create(
+                [
+                    crew_link(trip_id=trip.id, crew_id=crew_id)
+                    for trip, planned_trip in zip(trips, chunk)
+                    for crew_id in dict.fromkeys(planned_trip.crew)
+                ],
+                batch_size=chunk_size,
+            )
+        # bulk_create does not send the signals updating the planner.
+        transaction.on_commit(planner.invalidate)
+    return len(planned)
+
+
+def import_timetable(trip_rows, rule_rows, dry_run=False):
+    """Validate and, unless ``dry_run`` or invalid, save a timetable.
+
+    Return the number of valid trips and the errors by row."""
+    planned, errors = plan_timetable(trip_rows, rule_rows)
+    if errors:
+        return 0, errors
+    if not dry_run:
+        save_timetable(planned)
+    return len(planned), []
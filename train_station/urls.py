@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
+from train_station import async_views
 from train_station.views import (
     TrainViewSet,
     TripViewSet,
@@ -8,7 +9,12 @@ from train_station.views import (
     CrewViewSet,
     OrderViewSet,
     RouteViewSet,
-    StationViewSet
+    StationViewSet,
+    JourneyViewSet,
+    SeatHoldViewSet,
+    ProfileViewSet,
+    ExportViewSet,
+    AnalyticsViewSet,
 )
 
 
@@ -21,7 +27,39 @@ router.register("crews", CrewViewSet)
 router.register("orders", OrderViewSet)
 router.register("routes", RouteViewSet)
 router.register("stations", StationViewSet)
+router.register("journeys", JourneyViewSet, basename="journey")
+router.register("holds", SeatHoldViewSet, basename="hold")
+router.register("profiles", ProfileViewSet, basename="profile")
+router.register("exports", ExportViewSet, basename="export")
+router.register("analytics", AnalyticsViewSet, basename="analytics")
 
-urlpatterns = [path("", include(router.urls))]
+urlpatterns = [
+    path("", include(router.urls)),
+    path(
+        "async/trips/",
+        async_views.trip_list,
+        name="async-trip-list",
+    ),
+    path(
+        "async/trips/availability/",
+        async_views.trips_availability,
+        name="async-trips-availability",
+    ),
+    path(
+        "async/trips/<int:pk>/availability/",
+        async_views.trip_availability,
+        name="async-trip-availability",
+    ),
+    path(
+        "async/trips/<int:pk>/seats/events/",
+        async_views.trip_seat_events,
+        name="async-trip-seat-events",
+    ),
+    path(
+        "async/journeys/",
+        async_views.journey_list,
+        name="async-journey-list",
+    ),
+]
 
 app_name = "train_station"
@@ -1,21 +1,35 @@
 from datetime import datetime
 
-from django.db.models import F, Count
+from django.db.models import Prefetch
+from django.http import FileResponse
 from drf_spectacular.types import OpenApiTypes
-from drf_spectacular.utils import extend_schema, OpenApiParameter
-from rest_framework import viewsets, status
+from drf_spectacular.utils import (
+    extend_schema,
+    inline_serializer,
+    OpenApiParameter,
+    PolymorphicProxySerializer,
+)
+from rest_framework import serializers, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.mixins import (
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
     DestroyModelMixin
 )
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from train_station.analytics import rollup_status
+from train_station.booking import checkout_hold
+from train_station.cache import CachedListMixin
+from train_station.exports import EXPORTS, export_response
+from train_station.holds import hold_store
+from train_station.journeys import search_journeys
 from train_station.models import (
     Crew,
     TrainType,
@@ -24,8 +38,10 @@ from train_station.models import (
     Station,
     Route,
     Order,
+    Ticket,
 )
 from train_station.permissions import IsAdminOrIfAuthenticatedReadOnly
+from train_station.profiling import profile_store
 
 from train_station.serializer import (
     TrainSerializer,
@@ -36,14 +52,53 @@ from train_station.serializer import (
     StationSerializer,
     TripListSerializer,
     TripDetailSerializer,
+    TripAvailabilitySerializer,
     OrderListSerializer,
     RouteSerializer,
     RouteListSerializer,
-    TrainImageSerializer
+    TrainImageSerializer,
+    JourneySearchSerializer,
+    JourneySerializer,
+    OrderCompactSerializer,
+    TripCompactSerializer,
+    SeatHoldSerializer,
+    TripListValuesSerializer,
+    RouteListValuesSerializer,
+    ExportSerializer,
+    OrderAutoAssignSerializer,
+    RouteAnalyticsSearchSerializer,
+    TrainAnalyticsSearchSerializer,
+    RouteDailyStatsSerializer,
+    TrainDailyStatsSerializer,
+)
+from train_station.timetable import (
+    import_timetable,
+    read_json,
+    read_upload,
 )
 
 
+class ValuesListMixin:
+    """Serve the list action from ``.values()`` rows serialized by
+    ``values_serializer_class`` instead of model instances."""
+
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.values_serializer_class
+        queryset = serializer_class.get_rows(
+            self.filter_queryset(self.get_queryset())
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer_class(page).data)
+
+        return Response(serializer_class(queryset).data)
+
+
 class TrainTypeViewSet(
+    CachedListMixin,
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
@@ -56,6 +111,7 @@ class TrainTypeViewSet(
 
 
 class TrainViewSet(
+    CachedListMixin,
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
@@ -65,6 +121,7 @@ class TrainViewSet(
     queryset = Train.objects.all().select_related("train_type")
     serializer_class = TrainSerializer
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+    cache_models = (Train, TrainType)
 
     def get_serializer_class(self):
         if self.action == "upload_image":
@@ -93,18 +150,20 @@ class TrainViewSet(
         )
 
 
-class TripViewSet(viewsets.ModelViewSet):
-    queryset = (
-        Trip.objects.all()
-        .select_related("route", "train")
-        .annotate(
-            tickets_available=(
-                F("train__cargo_num") * F("train__places_in_cargo")
-                - Count("tickets")
-            )
-        )
+class TripPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("departure_time", "id")
+
+
+class TripViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Trip.objects.all().select_related(
+        "route__source", "route__destination", "train__train_type"
     )
     serializer_class = TripSerializer
+    values_serializer_class = TripListValuesSerializer
+    pagination_class = TripPagination
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
 
     def get_queryset(self):
@@ -115,10 +174,19 @@ class TripViewSet(viewsets.ModelViewSet):
 
         if date:
             date = datetime.strptime(date, "%Y-%m-%d").date()
-            queryset = queryset.filter(departure_time__date=date)
+            queryset = queryset.departing_on(date)
 
         if route_id_str:
-            queryset = queryset.filter(route_id=int(route_id_str))
+            queryset = queryset.on_route(int(route_id_str))
+
+        if self.action == "list":
+            queryset = queryset.defer("occupancy")
+
+        if self.action == "retrieve":
+            queryset = queryset.prefetch_related("crew")
+
+        if self.action == "availability":
+            queryset = Trip.objects.for_availability()
 
         return queryset
 
@@ -129,6 +197,9 @@ class TripViewSet(viewsets.ModelViewSet):
         if self.action == "retrieve":
             return TripDetailSerializer
 
+        if self.action == "availability":
+            return TripAvailabilitySerializer
+
         return self.serializer_class
 
     @extend_schema(
@@ -151,17 +222,187 @@ class TripViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @action(methods=["GET"], detail=True)
+    def availability(self, request, pk=None):
+        """Free seat count and taken and held seats of a trip."""
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @extend_schema(
+        request={
+            "application/json": OpenApiTypes.OBJECT,
+            "multipart/form-data": {
+                "type": "object",
+                "properties": {
+                    "file": {"type": "string", "format": "binary"}
+                },
+            },
+        },
+        parameters=[
+            OpenApiParameter(
+                "dry_run",
+                type=OpenApiTypes.BOOL,
+                description="Only validate the timetable (ex. ?dry_run=1)",
+            ),
+        ],
+        responses={
+            201: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+        },
+    )
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[JSONParser, MultiPartParser],
+    )
+    def import_timetable(self, request):
+        """Import a timetable of trips and recurrence rules at once.
+
+        Send a JSON list of trips or an object with "trips" and "rules", or
+        upload a CSV or JSON file as "file". Nothing is imported if any row
+        has errors."""
+        upload = request.FILES.get("file")
+        if upload is not None:
+            trip_rows, rule_rows = read_upload(upload)
+        else:
+            trip_rows, rule_rows = read_json(request.data)
+
+        dry_run = request.query_params.get("dry_run") in ("1", "true")
+        count, errors = import_timetable(trip_rows, rule_rows, dry_run)
+        if errors:
+            return Response(
+                {"errors": errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if dry_run:
+            return Response({"valid": count}, status=status.HTTP_200_OK)
+        return Response({"created": count}, status=status.HTTP_201_CREATED)
+
+
+class JourneyViewSet(viewsets.ViewSet):
+    permission_classes = (IsAuthenticated,)
+
+    @extend_schema(
+        parameters=[JourneySearchSerializer],
+        responses=JourneySerializer(many=True),
+    )
+    def list(self, request):
+        """Search journeys between two stations, including changes"""
+        search = JourneySearchSerializer(data=request.query_params)
+        search.is_valid(raise_exception=True)
+
+        journeys = search_journeys(
+            search.validated_data["source"],
+            search.validated_data["destination"],
+            search.validated_data.get("departure"),
+            search.validated_data["limit"],
+        )
+        return Response(JourneySerializer(journeys, many=True).data)
+
+
+class SeatHoldViewSet(viewsets.ViewSet):
+    permission_classes = (IsAuthenticated,)
+    lookup_value_regex = "[0-9a-f]{32}"
+
+    def get_hold(self, pk):
+        hold = hold_store().get(pk)
+        if hold is None or hold.user_id != self.request.user.id:
+            raise NotFound("Seat hold does not exist or has expired.")
+        return hold
+
+    @extend_schema(request=SeatHoldSerializer, responses=SeatHoldSerializer)
+    def create(self, request):
+        """Hold seats for a limited time before checkout"""
+        serializer = SeatHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user_id=request.user.id)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(responses=SeatHoldSerializer)
+    def retrieve(self, request, pk=None):
+        return Response(SeatHoldSerializer(self.get_hold(pk)).data)
+
+    def destroy(self, request, pk=None):
+        """Release held seats"""
+        hold_store().release(self.get_hold(pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @extend_schema(request=None, responses=OrderSerializer)
+    @action(methods=["POST"], detail=True)
+    def checkout(self, request, pk=None):
+        """Convert the seat hold into an order"""
+        order = checkout_hold(self.get_hold(pk), user=request.user)
+        return Response(
+            OrderSerializer(order).data, status=status.HTTP_201_CREATED
+        )
+
+
+class ProfileViewSet(viewsets.ViewSet):
+    permission_classes = (IsAdminUser,)
+    lookup_value_regex = r"[\w.-]+\.folded"
+
+    def list(self, request):
+        """Request profiles written by ProfilingMiddleware, newest first"""
+        return Response(profile_store().list())
+
+    def retrieve(self, request, pk=None):
+        """Download a profile in the folded stack format of flamegraph.pl"""
+        path = profile_store().path(pk)
+        if path is None:
+            raise NotFound("Profile does not exist or has been rotated.")
+        return FileResponse(
+            path.open("rb"),
+            as_attachment=True,
+            filename=path.name,
+            content_type="text/plain",
+        )
+
+
+class ExportViewSet(viewsets.ViewSet):
+    permission_classes = (IsAdminUser,)
+    lookup_value_regex = "|".join(EXPORTS)
+
+    @extend_schema(
+        parameters=[ExportSerializer],
+        responses={
+            (200, "application/x-ndjson"): OpenApiTypes.STR,
+            (200, "text/csv"): OpenApiTypes.STR,
+        },
+    )
+    def retrieve(self, request, pk=None):
+        """Stream all trips, orders or tickets as NDJSON or CSV.
+
+        Dates filter trips and tickets by departure and orders by creation,
+        a route filters orders by their tickets."""
+        params = ExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return export_response(
+            request._request, EXPORTS[pk], **params.validated_data
+        )
+
+
+class RoutePagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("id",)
+
 
 class RouteViewSet(
+    CachedListMixin,
+    ValuesListMixin,
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
     DestroyModelMixin,
     GenericViewSet
 ):
-    queryset = Route.objects.all()
+    queryset = Route.objects.all().select_related("source", "destination")
     serializer_class = RouteSerializer
+    values_serializer_class = RouteListValuesSerializer
+    pagination_class = RoutePagination
     permission_classes = [IsAdminOrIfAuthenticatedReadOnly]
+    cache_models = (Route, Station)
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -170,9 +411,11 @@ class RouteViewSet(
         return self.serializer_class
 
 
-class OrderPagination(PageNumberPagination):
+class OrderPagination(CursorPagination):
     page_size = 5
+    page_size_query_param = "page_size"
     max_page_size = 50
+    ordering = ("-created_at", "id")
 
 
 class OrderViewSet(
@@ -183,26 +426,112 @@ class OrderViewSet(
     GenericViewSet
 ):
     queryset = Order.objects.prefetch_related(
-        "tickets__trip__train", "tickets__train__route"
+        Prefetch(
+            "tickets",
+            queryset=Ticket.objects.select_related(
+                "trip__route__source",
+                "trip__route__destination",
+                "trip__train__train_type",
+            ),
+        ),
+        "tickets__trip__crew",
     )
     serializer_class = OrderSerializer
     pagination_class = OrderPagination
     permission_classes = (IsAuthenticated,)
 
+    @property
+    def is_compact(self) -> bool:
+        return (
+            self.action == "list"
+            and self.request.query_params.get("mode") == "compact"
+        )
+
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        if self.is_compact:
+            return Order.objects.filter(
+                user=self.request.user
+            ).prefetch_related(
+                Prefetch(
+                    "tickets",
+                    queryset=Ticket.objects.select_related(
+                        "trip__route__source",
+                        "trip__route__destination",
+                        "trip__train",
+                    ).defer("trip__occupancy"),
+                )
+            )
+
+        return self.queryset.filter(user=self.request.user)
 
     def get_serializer_class(self):
+        if self.is_compact:
+            return OrderCompactSerializer
+
         if self.action == "list":
             return OrderListSerializer
 
+        if self.action == "create" and "party_size" in self.request.data:
+            return OrderAutoAssignSerializer
+
         return self.serializer_class
 
+    @extend_schema(
+        request=PolymorphicProxySerializer(
+            component_name="OrderCreate",
+            serializers=[OrderSerializer, OrderAutoAssignSerializer],
+            resource_type_field_name=None,
+        ),
+        responses=OrderSerializer,
+    )
+    def create(self, request, *args, **kwargs):
+        """Book the given seats, or with ``trip`` and ``party_size`` let the
+        server pick the seats, by ``preference``: ``adjacent`` seats in one
+        cargo (default), ``fill_first`` or ``spread`` out over the train"""
+        return super().create(request, *args, **kwargs)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "mode",
+                type=OpenApiTypes.STR,
+                enum=["compact"],
+                description=(
+                    "Compact listing: tickets reference trips, which are "
+                    "side-loaded once in `trips` (ex. ?mode=compact)"
+                ),
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        if not self.is_compact:
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        response = self.get_paginated_response(
+            self.get_serializer(page, many=True).data
+        )
+        trips = {
+            ticket.trip_id: ticket.trip
+            for order in page
+            for ticket in order.tickets.all()
+        }
+        response.data["trips"] = {
+            trip["id"]: trip
+            for trip in TripCompactSerializer(
+                trips.values(), many=True
+            ).data
+        }
+        return response
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
 class StationViewSet(
+    CachedListMixin,
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
@@ -215,6 +544,7 @@ class StationViewSet(
 
 
 class CrewViewSet(
+    CachedListMixin,
     CreateModelMixin,
     ListModelMixin,
     UpdateModelMixin,
@@ -224,3 +554,99 @@ class CrewViewSet(
     queryset = Crew.objects.all()
     serializer_class = CrewSerializer
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+
+
+class AnalyticsPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("day", "id")
+
+
+ANALYTICS_PAGE_PARAMETERS = [
+    OpenApiParameter(
+        "cursor", type=OpenApiTypes.STR, description="Pagination cursor"
+    ),
+    OpenApiParameter(
+        "page_size",
+        type=OpenApiTypes.INT,
+        description=(
+            f"Rows per page, at most {AnalyticsPagination.max_page_size}"
+        ),
+    ),
+]
+
+
+def _analytics_response(name, stats_serializer):
+    return inline_serializer(
+        name,
+        fields={
+            "last_order": serializers.IntegerField(allow_null=True),
+            "refreshed_at": serializers.DateTimeField(allow_null=True),
+            "next": serializers.URLField(allow_null=True),
+            "previous": serializers.URLField(allow_null=True),
+            "results": stats_serializer(many=True),
+        },
+    )
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """Dashboards served from the daily rollups of
+    ``train_station.analytics``, as of ``refreshed_at``."""
+
+    permission_classes = (IsAdminUser,)
+
+    def daily_stats(self, search_serializer_class, stats_serializer_class):
+        params = search_serializer_class(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        queryset = stats_serializer_class.Meta.model.objects.filter(
+            day__gte=filters.pop("date_from"),
+            day__lte=filters.pop("date_to"),
+        ).filter(
+            **{f"{field}_id": value for field, value in filters.items()}
+        )
+        paginator = AnalyticsPagination()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        return Response(
+            {
+                **rollup_status(),
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
+                "results": stats_serializer_class(page, many=True).data,
+            }
+        )
+
+    @extend_schema(
+        parameters=[
+            RouteAnalyticsSearchSerializer,
+            *ANALYTICS_PAGE_PARAMETERS,
+        ],
+        responses=_analytics_response(
+            "RouteAnalytics", RouteDailyStatsSerializer
+        ),
+    )
+    @action(detail=False)
+    def routes(self, request):
+        """Trips, seats, tickets sold, occupancy percentage, orders and
+        passenger kilometres per route and departure day"""
+        return self.daily_stats(
+            RouteAnalyticsSearchSerializer, RouteDailyStatsSerializer
+        )
+
+    @extend_schema(
+        parameters=[
+            TrainAnalyticsSearchSerializer,
+            *ANALYTICS_PAGE_PARAMETERS,
+        ],
+        responses=_analytics_response(
+            "TrainAnalytics", TrainDailyStatsSerializer
+        ),
+    )
+    @action(detail=False)
+    def trains(self, request):
+        """Trips, seats, tickets sold, occupancy percentage, orders and
+        passenger kilometres per train and departure day"""
+        return self.daily_stats(
+            TrainAnalyticsSearchSerializer, TrainDailyStatsSerializer
+        )
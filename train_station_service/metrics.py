@@ -0,0 +1,249 @@
+"""Request metrics in the Prometheus text format.
+
+Every worker process counts its own requests. With ``METRICS_DIR`` set,
+workers also write their counts to a file of that directory every
+``METRICS_FLUSH_SECONDS``, and a scrape of any worker sums the files of
+all of them, like the multiprocess mode of the Prometheus client. Files of
+exited workers are kept, so counters never go backwards, until the
+directory is cleared at server start, see gunicorn.conf.py."""
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": (
+        "Wall time of requests",
+        DURATION_BUCKETS,
+    ),
+    "http_request_db_duration_seconds": (
+        "Time spent in database queries per request",
+        DURATION_BUCKETS,
+    ),
+    "http_request_db_queries": (
+        "Database queries per request",
+        QUERY_BUCKETS,
+    ),
+    "http_request_serializer_duration_seconds": (
+        "Time spent serializing response bodies per request",
+        DURATION_BUCKETS,
+    ),
+    "http_response_size_bytes": (
+        "Size of non-streaming response bodies",
+        SIZE_BUCKETS,
+    ),
+}
+REQUESTS_TOTAL = "http_requests_total"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flusher = None
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._histograms = {}
+        self._requests = {}
+        self._pid = os.getpid()
+        # Workers recycled with the same pid get a file of their own.
+        self._file_name = f"{self._pid}-{time.time_ns()}.json"
+        self._dirty = False
+
+    def record(self, view, method, status_code, observations):
+        """Count a request and observe its ``observations``, a dict of
+        histogram name to value."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked from a process that already counted requests.
+                self._reset()
+                self._flusher = None
+            key = (view, method, status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, value in observations.items():
+                histogram = self._histograms.get((name, view))
+                if histogram is None:
+                    histogram = self._histograms[(name, view)] = Histogram(
+                        HISTOGRAMS[name][1]
+                    )
+                histogram.observe(value)
+            self._dirty = True
+            if settings.METRICS_DIR and self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_periodically,
+                    name="metrics-flusher",
+                    daemon=True,
+                )
+                self._flusher.start()
+
+    def _snapshot(self) -> dict:
+        return {
+            "requests": [
+                [*key, count] for key, count in self._requests.items()
+            ],
+            "histograms": [
+                [name, view, histogram.counts, histogram.sum]
+                for (name, view), histogram in self._histograms.items()
+            ],
+        }
+
+    def flush(self):
+        """Write the counts of this process to ``METRICS_DIR``."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            snapshot = json.dumps(self._snapshot())
+            path = Path(directory) / self._file_name
+            self._dirty = False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(snapshot)
+        os.replace(tmp_path, path)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            self.flush()
+
+    def _snapshots(self) -> list:
+        directory = settings.METRICS_DIR
+        if not directory:
+            with self._lock:
+                return [self._snapshot()]
+        self.flush()
+        snapshots = []
+        for path in Path(directory).glob("[!.]*.json"):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """Render the counts of all workers."""
+        requests = {}
+        histograms = {}
+        for snapshot in self._snapshots():
+            for view, method, status_code, count in snapshot["requests"]:
+                key = (view, method, status_code)
+                requests[key] = requests.get(key, 0) + count
+            for name, view, counts, total in snapshot["histograms"]:
+                if name not in HISTOGRAMS:
+                    continue
+                histogram = histograms.get((name, view))
+                if histogram is None:
+                    histogram = histograms[(name, view)] = Histogram(
+                        HISTOGRAMS[name][1]
+                    )
+                for index, count in enumerate(counts):
+                    histogram.counts[index] += count
+                histogram.sum += total
+
+        lines = [
+            f"# HELP {REQUESTS_TOTAL} Requests by view and status",
+            f"# TYPE {REQUESTS_TOTAL} counter",
+        ]
+        for (view, method, status_code), count in sorted(requests.items()):
+            lines.append(
+                f'{REQUESTS_TOTAL}{{view="{view}",'
+                f'method="{method}",status="{status_code}"}} {count}'
+            )
+
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines += [
+                f"# HELP {name} {description}",
+                f"# TYPE {name} histogram",
+            ]
+            for (histogram_name, view), histogram in sorted(
+                histograms.items()
+            ):
+                if histogram_name != name:
+                    continue
+                labels = f'view="{view}"'
+                cumulative = 0
+                for bound, count in zip(
+                    (*buckets, "+Inf"), histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{{labels},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines += [
+                    f"{name}_sum{{{labels}}} {histogram.sum}",
+                    f"{name}_count{{{labels}}} {cumulative}",
+                ]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _is_staff(request) -> bool:
+    """Authenticate like the API does, so that staff using JWTs are let
+    in, or fall back to the session user."""
+    if request.user.is_staff:
+        return True
+    api_request = Request(
+        request,
+        authenticators=[
+            authentication()
+            for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ],
+    )
+    try:
+        return api_request.user.is_staff
+    except APIException:
+        return False
+
+
+def metrics_view(request):
+    """Expose the metrics of all workers to staff users, or to scrapers
+    sending ``Authorization: Bearer <METRICS_TOKEN>``."""
+    token = settings.METRICS_TOKEN
+    authorized = (
+        token
+        and hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        )
+    ) or _is_staff(request)
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4"
+    )
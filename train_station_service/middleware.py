@@ -0,0 +1,204 @@
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from train_station.profiling import StackSampler, profile_store
+from train_station_service.metrics import registry
+
+logger = logging.getLogger("train_station_service.performance")
+
+_current_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    __slots__ = ("db_time", "db_queries", "serializer_time")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.serializer_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper, see ``connection.execute_wrapper``."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+
+@contextmanager
+def serializer_timer():
+    """Count the time spent in the block, e.g. rendering a response body,
+    as serializer time of the current request."""
+    timings = _current_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.serializer_time += time.perf_counter() - started
+
+
+def view_tag(request) -> str:
+    """Name the view of a request like ``TripViewSet.list``."""
+    match = request.resolver_match
+    if match is None:
+        return "unmatched"
+
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None:
+        return ".".join(match._func_path.rsplit(".", 2)[-2:])
+
+    method = request.method.lower()
+    action = getattr(match.func, "actions", {}).get(method, method)
+    return f"{view_class.__name__}.{action}"
+
+
+class PerformanceMiddleware:
+    """Record wall time, database queries and time, serializer time (see
+    ``serializer_timer``) and response size of every request in the metrics
+    registry, and log requests above the ``SLOW_REQUEST_*`` thresholds.
+
+    Should be the first middleware, so that the others are measured too."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        stack = ExitStack()
+        # Wrappers of not yet connected databases connect lazily later.
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings))
+        return timings, token, stack
+
+    @staticmethod
+    def _stop(timings, token, stack):
+        stack.close()
+        _current_timings.reset(token)
+
+    def _record(self, request, response, timings, wall_time):
+        view = view_tag(request)
+        observations = {
+            "http_request_duration_seconds": wall_time,
+            "http_request_db_duration_seconds": timings.db_time,
+            "http_request_db_queries": timings.db_queries,
+            "http_request_serializer_duration_seconds": (
+                timings.serializer_time
+            ),
+        }
+        if not response.streaming:
+            observations["http_response_size_bytes"] = len(response.content)
+        registry.record(
+            view, request.method, response.status_code, observations
+        )
+
+        if (
+            wall_time * 1000 >= settings.SLOW_REQUEST_MS
+            or timings.db_queries >= settings.SLOW_REQUEST_QUERIES
+        ):
+            logger.warning(
+                "Slow request %s %s (%s): %.1fms, %d queries in %.1fms, "
+                "serializers %.1fms",
+                request.method,
+                request.path,
+                view,
+                wall_time * 1000,
+                timings.db_queries,
+                timings.db_time * 1000,
+                timings.serializer_time * 1000,
+                extra={
+                    "view": view,
+                    "status_code": response.status_code,
+                    "wall_time": wall_time,
+                    "db_queries": timings.db_queries,
+                    "db_time": timings.db_time,
+                    "serializer_time": timings.serializer_time,
+                },
+            )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        state = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self._stop(*state)
+        self._record(
+            request, response, state[0], time.perf_counter() - started
+        )
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        state = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._stop(*state)
+        self._record(
+            request, response, state[0], time.perf_counter() - started
+        )
+        return response
+
+
+class ProfilingMiddleware:
+    """Sample the stacks of requests to the views of PROFILE_VIEW_MODULES
+    and keep the profiles of requests slower than PROFILE_SLOW_REQUEST_MS,
+    plus a random PROFILE_SAMPLE_RATE fraction of the others.
+
+    Only active with PROFILING_ENABLED. Sync only, so that under ASGI
+    Django runs it in the same thread as the sync views it profiles."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sampler = StackSampler(settings.PROFILE_INTERVAL_MS / 1000)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "cls", None)
+        if (
+            view_class is not None
+            and view_class.__module__ in settings.PROFILE_VIEW_MODULES
+        ):
+            request._profiled = True
+            self.sampler.start()
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            samples = (
+                self.sampler.stop()
+                if getattr(request, "_profiled", False)
+                else None
+            )
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        if samples and (
+            wall_ms >= settings.PROFILE_SLOW_REQUEST_MS
+            or random.random() < settings.PROFILE_SAMPLE_RATE
+        ):
+            profile_store().save(
+                f"{view_tag(request)}-{wall_ms:.0f}ms", samples
+            )
+        return response
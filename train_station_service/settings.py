@@ -45,22 +45,27 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "rest_framework",
     "drf_spectacular",
-    "debug_toolbar",
     "user",
     "train_station",
 ]
 
 MIDDLEWARE = [
+    "train_station_service.middleware.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "train_station_service.middleware.ProfilingMiddleware",
 ]
 
+if DEBUG:
+    # The toolbar records every SQL query, so it is for development only.
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(2, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "train_station_service.urls"
 
 TEMPLATES = [
@@ -96,6 +101,30 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Catalog list responses are cached in process memory by default; point
+# CATALOG_CACHE_BACKEND/LOCATION at a shared backend (e.g.
+# django.core.cache.backends.redis.RedisCache) so that all workers share
+# cached lists and their invalidation.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "catalog": {
+        "BACKEND": os.getenv(
+            "CATALOG_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("CATALOG_CACHE_LOCATION", "catalog"),
+        "TIMEOUT": int(os.getenv("CATALOG_CACHE_TIMEOUT", 3600)),
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
+CATALOG_CACHE_ALIAS = "catalog"
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -135,6 +164,104 @@ STATIC_URL = "static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = "/files/media"
 
+JOURNEY_MIN_TRANSFER_MINUTES = int(
+    os.getenv("JOURNEY_MIN_TRANSFER_MINUTES", 10)
+)
+JOURNEY_GRAPH_TTL_SECONDS = int(os.getenv("JOURNEY_GRAPH_TTL_SECONDS", 300))
+
+STATION_DISTANCE_MATRIX_PATH = os.getenv(
+    "STATION_DISTANCE_MATRIX_PATH", "/files/data/station_distances.npy"
+)
+
+# Attempts of a booking transaction aborted by a serialization failure
+# and the base backoff in seconds between them.
+BOOKING_MAX_ATTEMPTS = int(os.getenv("BOOKING_MAX_ATTEMPTS", 3))
+BOOKING_RETRY_BACKOFF = float(os.getenv("BOOKING_RETRY_BACKOFF", 0.05))
+# Largest party whose seats are assigned automatically in one order.
+AUTO_ASSIGN_MAX_PARTY_SIZE = int(os.getenv("AUTO_ASSIGN_MAX_PARTY_SIZE", 20))
+
+# Requests slower than SLOW_REQUEST_MS or running at least
+# SLOW_REQUEST_QUERIES queries are logged by PerformanceMiddleware.
+# /metrics is open to staff users and to scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>".
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", 50))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Metrics are kept per process. With METRICS_DIR, worker processes also
+# write them there every METRICS_FLUSH_SECONDS and /metrics sums all
+# workers, which is needed as soon as more than one serves the same port.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 1))
+
+# Opt-in sampling profiler: with PROFILING_ENABLED=1, the stacks of requests
+# to the views of PROFILE_VIEW_MODULES are sampled every
+# PROFILE_INTERVAL_MS. Profiles of requests slower than
+# PROFILE_SLOW_REQUEST_MS and of a random PROFILE_SAMPLE_RATE fraction of
+# the others are written to PROFILE_DIR, keeping the newest
+# PROFILE_DIR_MAX_BYTES. Admins download them from
+# /api/train_station/profiles/.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_VIEW_MODULES = ("train_station.views",)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 10))
+PROFILE_SLOW_REQUEST_MS = int(
+    os.getenv("PROFILE_SLOW_REQUEST_MS", SLOW_REQUEST_MS)
+)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", BASE_DIR / "profiles")
+PROFILE_DIR_MAX_BYTES = int(
+    os.getenv("PROFILE_DIR_MAX_BYTES", 50 * 1024 * 1024)
+)
+
+# Seat holds live in the memory of one process by default. Use
+# "train_station.holds.CacheHoldStore" with a cache shared by all processes
+# (e.g. Redis) when running more than one.
+SEAT_HOLD_STORE = os.getenv(
+    "SEAT_HOLD_STORE", "train_station.holds.LocalHoldStore"
+)
+SEAT_HOLD_CACHE_ALIAS = os.getenv("SEAT_HOLD_CACHE_ALIAS", "default")
+SEAT_HOLD_TTL_SECONDS = int(os.getenv("SEAT_HOLD_TTL_SECONDS", 600))
+SEAT_HOLD_MAX_SEATS = int(os.getenv("SEAT_HOLD_MAX_SEATS", 10))
+
+# Seat changes pushed to clients watching a trip are fanned out in the
+# process that wrote them by default. Use
+# "train_station.seat_events.RedisSeatBroker" when running more than one.
+SEAT_EVENT_BROKER = os.getenv(
+    "SEAT_EVENT_BROKER", "train_station.seat_events.LocalSeatBroker"
+)
+SEAT_EVENTS_REDIS_URL = os.getenv(
+    "SEAT_EVENTS_REDIS_URL", "redis://localhost:6379/0"
+)
+SEAT_EVENTS_CHANNEL_PREFIX = "seat-events:"
+# Events queued per client before it is sent a new snapshot instead, and
+# seconds between keep-alive comments of idle streams.
+SEAT_EVENTS_QUEUE_SIZE = int(os.getenv("SEAT_EVENTS_QUEUE_SIZE", 100))
+SEAT_EVENTS_KEEPALIVE_SECONDS = float(
+    os.getenv("SEAT_EVENTS_KEEPALIVE_SECONDS", 15)
+)
+
+# Most trips of one batched availability request.
+TRIP_AVAILABILITY_MAX_IDS = int(os.getenv("TRIP_AVAILABILITY_MAX_IDS", 200))
+
+# Rows fetched per round trip and written per chunk by the streaming
+# exports of /api/train_station/exports/.
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+
+# Trips written per bulk_create by timetable imports, and the most trips
+# one import may create, rules included.
+TIMETABLE_IMPORT_CHUNK_SIZE = int(
+    os.getenv("TIMETABLE_IMPORT_CHUNK_SIZE", 1000)
+)
+TIMETABLE_IMPORT_MAX_TRIPS = int(
+    os.getenv("TIMETABLE_IMPORT_MAX_TRIPS", 200_000)
+)
+
+# Orders added to the analytics rollups per transaction, the age in
+# seconds below which orders are left for the next refresh, and the most
+# days one analytics request may cover.
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", 5000))
+ANALYTICS_GRACE_SECONDS = int(os.getenv("ANALYTICS_GRACE_SECONDS", 300))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", 366))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -146,10 +273,17 @@ REST_FRAMEWORK = {
         "rest_framework.throttling.AnonRateThrottle",
         "rest_framework.throttling.UserRateThrottle",
     ],
-    "DEFAULT_THROTTLE_RATES": {"anon": "10/minute", "user": "30/minute"},
+    "DEFAULT_THROTTLE_RATES": {
+        "anon": os.getenv("ANON_THROTTLE_RATE", "10/minute"),
+        "user": os.getenv("USER_THROTTLE_RATE", "30/minute"),
+    },
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "train_station.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
 SPECTACULAR_SETTINGS = {
@@ -0,0 +1,66 @@
+"""
+Production settings for train_station_service project.
+
+Use with DJANGO_SETTINGS_MODULE=train_station_service.settings_production
+behind gunicorn, see gunicorn.conf.py for worker and connection sizing.
+"""
+import os
+
+from train_station_service.settings import *  # noqa: F401,F403
+from train_station_service.settings import (
+    CACHES,
+    DATABASES,
+    INSTALLED_APPS,
+    MIDDLEWARE,
+)
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "localhost").split(",")
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != "debug_toolbar"]
+MIDDLEWARE = [
+    middleware
+    for middleware in MIDDLEWARE
+    if not middleware.startswith("debug_toolbar.")
+]
+
+# Persistent connections: each worker thread keeps its connection for
+# DB_CONN_MAX_AGE seconds instead of connecting on every request, and
+# checks that it is still usable before reusing it after an idle period.
+#
+# Django 5.0 has no built-in psycopg pool and cannot reuse connections
+# under ASGI, where every request runs its sync code in a new thread, so
+# gunicorn.conf.py sets DB_CONN_MAX_AGE to 0 for the ASGI worker class;
+# put PgBouncer in front of PostgreSQL to pool connections in that case.
+DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 60))
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+# Exports stream rows from server-side cursors, which do not work behind
+# PgBouncer in transaction pooling mode. Set DB_DISABLE_SERVER_SIDE_CURSORS
+# there, exports then read rows in id ranges instead.
+DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = (
+    os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS", "0") == "1"
+)
+
+# Throttling, seat holds and cached catalog lists must be shared by all
+# worker processes.
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+CACHES["default"] = {
+    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+    "LOCATION": REDIS_URL,
+}
+CACHES["catalog"] = {
+    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+    "LOCATION": REDIS_URL,
+    "KEY_PREFIX": "catalog",
+    "TIMEOUT": CACHES["catalog"]["TIMEOUT"],
+}
+
+SEAT_HOLD_STORE = os.getenv(
+    "SEAT_HOLD_STORE", "train_station.holds.CacheHoldStore"
+)
+SEAT_EVENT_BROKER = os.getenv(
+    "SEAT_EVENT_BROKER", "train_station.seat_events.RedisSeatBroker"
+)
+SEAT_EVENTS_REDIS_URL = os.getenv("SEAT_EVENTS_REDIS_URL", REDIS_URL)
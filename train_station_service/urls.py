@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
@@ -7,7 +8,7 @@ from drf_spectacular.views import (
     SpectacularRedocView,
 )
 
-from train_station_service import settings
+from train_station_service.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -27,5 +28,8 @@ urlpatterns = [
         SpectacularRedocView.as_view(url_name="schema"),
         name="redoc",
     ),
-    path("__debug__/", include("debug_toolbar.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns.append(path("__debug__/", include("debug_toolbar.urls")))